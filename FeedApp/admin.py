@@ -1,5 +1,249 @@
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.contrib.auth.models import User
+from django.core.paginator import Paginator
+from django.utils import timezone
+from django.utils.functional import cached_property
 
-# Register your models here.
+from . import purge
+from .db import estimated_count
+from .models import (
+    ArchivedComment, ArchivedLike, ArchivedPost, Comment, Job, Like, Post, Profile, Relationship, Upload,
+)
 
+# The admin site, set up for tables with millions of rows.
+#
+# Django's defaults don't hold up at that size: every changelist page runs COUNT(*)
+# over the whole table (twice when filtered), foreign keys render as <select>s listing
+# every User, each row's __str__ may fetch its related user on its own, and "Delete
+# selected" loads everything that cascades from the selection into memory before
+# deleting it in one transaction. Here instead:
+#
+#  - pages are counted by EstimatedCountPaginator, and the second, unfiltered count is off;
+#  - foreign keys are raw id inputs (with a lookup popup), and list_select_related joins
+#    the rows each changelist shows;
+#  - lists are ordered by an indexed column, and the one search (users) is an exact
+#    match on an indexed column rather than a LIKE '%...%' scan;
+#  - deleting goes through FeedApp/purge.py: accounts and posts are hidden at once and
+#    purged in the background (until then "Restore selected" brings them back),
+#    everything else is deleted in batches, with the same counter and cache updates as
+#    deletions made on the site.
+#
+# Likes and comments can't be added here: they go through FeedApp/engagement.py so the
+# post counters stay right.
 
+# How many of the rows being deleted the confirmation page names.
+DELETE_PREVIEW = 100
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts an unfiltered changelist from the planner's row estimate once the table has
+    more than settings.ADMIN_COUNT_LIMIT rows, and a filtered one up to that many rows
+    only (pages past the limit aren't offered; narrow the filter to reach them).
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        limit = settings.ADMIN_COUNT_LIMIT
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model)
+            if estimate is not None and estimate > limit:
+                return estimate
+            return queryset.count()
+        # COUNT(*) over a LIMITed subquery: stops after `limit` matching rows.
+        return queryset[:limit].count()
+
+
+class DeletedFilter(admin.SimpleListFilter):
+    # Only deleted_at IS NOT NULL is indexed (partially), but "No" is cheap too: the
+    # changelist reads one page of rows in -id order and the count is capped.
+    title = 'deleted'
+    parameter_name = 'deleted'
+
+    def lookups(self, request, model_admin):
+        return (('yes', 'Yes'), ('no', 'No'))
+
+    def queryset(self, request, queryset):
+        if self.value() == 'yes':
+            return queryset.filter(deleted_at__isnull=False)
+        if self.value() == 'no':
+            return queryset.filter(deleted_at=None)
+        return queryset
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ('-id',)
+
+    def get_deleted_objects(self, objs, request):
+        # Name the selected rows without collecting everything that cascades from them.
+        count = len(objs) if isinstance(objs, list) else objs.count()
+        names = [str(obj) for obj in objs[:DELETE_PREVIEW]]
+        if count > len(names):
+            names.append(f'… and {count - len(names)} more')
+        return names, {self.model._meta.verbose_name_plural: count}, set(), []
+
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, self.model._base_manager.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        purge.purge(queryset)
+
+
+class SoftDeleteAdmin(ScalableAdmin):
+    # For models with deleted_at: deleted rows stay listed (and can be filtered) until
+    # they are purged, and can be brought back until then.
+    list_filter = (DeletedFilter,)
+    actions = ['hide_selected', 'restore_selected']
+
+    def get_queryset(self, request):
+        queryset = self.model.all_objects.get_queryset()
+        ordering = self.get_ordering(request)
+        return queryset.order_by(*ordering) if ordering else queryset
+
+    def restore_queryset(self, request, queryset):
+        """Bring back the deleted rows of `queryset`; returns how many. Defined by each subclass."""
+        raise NotImplementedError
+
+    # "Delete selected" without its confirmation page: the rows are only hidden.
+    @admin.action(description='Hide selected %(verbose_name_plural)s', permissions=['delete'])
+    def hide_selected(self, request, queryset):
+        count = queryset.count()
+        self.delete_queryset(request, queryset)
+        self.message_user(request, f'{count} {self.model._meta.verbose_name_plural} hidden; '
+                                   f'they can be restored until they are purged.')
+
+    @admin.action(description='Restore selected %(verbose_name_plural)s', permissions=['delete'])
+    def restore_selected(self, request, queryset):
+        restored = self.restore_queryset(request, queryset.filter(deleted_at__isnull=False))
+        self.message_user(request, f'{restored} {self.model._meta.verbose_name_plural} restored.')
+
+
+class ReadOnlyAdmin(ScalableAdmin):
+    # Rows that are only written by the site or by batch jobs; the admin may inspect and delete them.
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+# Accounts.
+
+admin.site.unregister(User)
+
+
+@admin.register(User)
+class UserAdmin(ScalableAdmin, BaseUserAdmin):
+    ordering = ('username',)
+    # auth_user.username is unique, so indexed; the default icontains search scans the table.
+    search_fields = ('username__exact',)
+
+    def delete_queryset(self, request, queryset):
+        for user in queryset.iterator():
+            purge.delete_account(user)
+
+
+@admin.register(Profile)
+class ProfileAdmin(SoftDeleteAdmin):
+    list_display = ('user', 'first_name', 'last_name', 'created', 'deleted_at')
+    list_select_related = ('user',)
+    raw_id_fields = ('user', 'friends')
+
+    def delete_queryset(self, request, queryset):
+        for profile in queryset.select_related('user').iterator():
+            purge.delete_account(profile.user)
+
+    def restore_queryset(self, request, queryset):
+        return sum(purge.restore_account(profile.user) for profile in queryset.select_related('user').iterator())
+
+
+@admin.register(Relationship)
+class RelationshipAdmin(ScalableAdmin):
+    list_display = ('sender', 'receiver', 'status', 'created')
+    list_select_related = ('sender__user', 'receiver__user')
+    list_filter = ('status',)
+    raw_id_fields = ('sender', 'receiver')
+
+
+# Posts and engagement.
+
+@admin.register(Post)
+class PostAdmin(SoftDeleteAdmin):
+    list_display = ('id', 'description', 'username', 'date_posted', 'like_count', 'comment_count', 'deleted_at')
+    list_select_related = ('username',)
+    raw_id_fields = ('username',)
+    readonly_fields = ('like_count', 'comment_count', 'version', 'image_variants')
+
+    def delete_queryset(self, request, queryset):
+        post_ids = list(queryset.values_list('id', flat=True))
+        for start in range(0, len(post_ids), settings.PURGE_BATCH_SIZE):
+            purge.delete_posts(post_ids[start:start + settings.PURGE_BATCH_SIZE])
+
+    def restore_queryset(self, request, queryset):
+        post_ids = list(queryset.values_list('id', flat=True))
+        return sum(purge.restore_posts(post_ids[start:start + settings.PURGE_BATCH_SIZE])
+                   for start in range(0, len(post_ids), settings.PURGE_BATCH_SIZE))
+
+
+@admin.register(Comment)
+class CommentAdmin(ScalableAdmin):
+    list_display = ('id', 'text', 'username', 'post', 'date_added')
+    list_select_related = ('username', 'post')
+    raw_id_fields = ('username',)
+    # Moving a comment to another post would leave both posts' comment_count wrong.
+    readonly_fields = ('post',)
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(Like)
+class LikeAdmin(ReadOnlyAdmin):
+    list_display = ('id', 'username', 'post')
+    list_select_related = ('username', 'post')
+    readonly_fields = ('post',)
+
+
+@admin.register(ArchivedPost)
+class ArchivedPostAdmin(ReadOnlyAdmin, PostAdmin):
+    pass
+
+
+@admin.register(ArchivedComment)
+class ArchivedCommentAdmin(ReadOnlyAdmin):
+    list_display = ('id', 'text', 'username', 'post', 'date_added')
+    list_select_related = ('username', 'post')
+
+
+@admin.register(ArchivedLike)
+class ArchivedLikeAdmin(ReadOnlyAdmin):
+    list_display = ('id', 'username', 'post')
+    list_select_related = ('username', 'post')
+
+
+# Background work.
+
+@admin.register(Job)
+class JobAdmin(ScalableAdmin):
+    list_display = ('id', 'task', 'status', 'attempts', 'run_after', 'updated')
+    # Filtering on status uses the (status, run_after) index.
+    list_filter = ('status',)
+    actions = ['retry']
+
+    @admin.action(description='Retry selected jobs now')
+    def retry(self, request, queryset):
+        retried = queryset.update(status='queued', attempts=0, run_after=timezone.now(),
+                                  locked_until=None, last_error='')
+        self.message_user(request, f'{retried} jobs queued again.')
+
+
+@admin.register(Upload)
+class UploadAdmin(ReadOnlyAdmin):
+    list_display = ('filename', 'user', 'received', 'size', 'created')
+    list_select_related = ('user',)
+    ordering = ('-created',)
@@ -0,0 +1,261 @@
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import BadRequest
+from django.core.files.storage import default_storage
+from django.db import IntegrityError
+from django.http import Http404, JsonResponse
+from django.views.decorators.http import require_http_methods
+
+from . import engagement
+from .models import ArchivedComment, ArchivedPost, Comment, Post, Profile, RankedEntry, TimelineEntry
+from .pagination import paginate_through
+
+# JSON API for feeds, comments and profiles.
+#
+# Every endpoint accepts ?fields=a,b,c to return only those fields. The requested
+# fields are translated into a .values() query, so only the columns (and joins) a
+# client asks for are read: a client that only needs ids and like counts never loads
+# descriptions or the author's User row.
+#
+# Lists are paginated with the same keyset cursors as the HTML feeds (see
+# pagination.py): pass the returned next_cursor back as ?cursor= for the next page.
+#
+# Liking and commenting through the API returns just the changed counts (a small delta)
+# instead of re-rendering a page; other viewers get the same change as a live event.
+#
+# Like the HTML feeds, the feeds and comment lists continue into the archive tables
+# (see archive.py) once a client pages past the hot ones.
+
+# Upper bound on ?limit= and on the number of ids in one batch request.
+MAX_PAGE_SIZE = 100
+
+# API field name -> ORM lookup, for each kind of object.
+POST_FIELDS = {
+    'id': 'id',
+    'author_id': 'username_id',
+    'author': 'username__username',
+    'description': 'description',
+    'image': 'image',
+    'image_variants': 'image_variants',
+    'date_posted': 'date_posted',
+    'like_count': 'like_count',
+    'comment_count': 'comment_count',
+    'version': 'version',
+}
+COMMENT_FIELDS = {
+    'id': 'id',
+    'post_id': 'post_id',
+    'author_id': 'username_id',
+    'author': 'username__username',
+    'text': 'text',
+    'date_added': 'date_added',
+}
+# Email and date of birth are deliberately not exposed.
+PROFILE_FIELDS = {
+    'id': 'id',
+    'user_id': 'user_id',
+    'username': 'user__username',
+    'first_name': 'first_name',
+    'last_name': 'last_name',
+    'bio': 'bio',
+}
+
+
+def _image_url(name):
+    return default_storage.url(name) if name else None
+
+
+def _variant_urls(variants):
+    return [{'format': v['format'], 'width': v['width'], 'url': default_storage.url(v['name'])} for v in variants]
+
+
+# Fields whose stored value is turned into something more useful to a client.
+FORMATTERS = {
+    'image': _image_url,
+    'image_variants': _variant_urls,
+}
+
+
+def parse_fields(request, available):
+    """The API field names requested with ?fields= (all of them by default)."""
+    requested = request.GET.get('fields')
+    if not requested:
+        return list(available)
+    fields = list(dict.fromkeys(name.strip() for name in requested.split(',') if name.strip()))
+    unknown = [name for name in fields if name not in available]
+    if unknown or not fields:
+        raise BadRequest(f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(available)}.")
+    return fields
+
+
+def parse_ids(request):
+    """The ids listed in ?ids=1,2,3, in order and without duplicates."""
+    try:
+        ids = list(dict.fromkeys(int(pk) for pk in request.GET.get('ids', '').split(',') if pk.strip()))
+    except ValueError:
+        raise BadRequest("ids must be a comma-separated list of integers.")
+    if not ids:
+        raise BadRequest("ids is required.")
+    if len(ids) > MAX_PAGE_SIZE:
+        raise BadRequest(f"At most {MAX_PAGE_SIZE} ids per request.")
+    return ids
+
+
+def page_size(request):
+    try:
+        return max(1, min(int(request.GET['limit']), MAX_PAGE_SIZE))
+    except (KeyError, ValueError):
+        return None
+
+
+def serialize(row, fields, lookups, prefix=''):
+    """Build the API dict for one .values() row, renaming lookups to API field names."""
+    item = {}
+    if prefix and prefix + lookups[fields[0]] not in row:
+        # A row of the archive queryset, which is read directly rather than through the relation.
+        prefix = ''
+    for name in fields:
+        value = row[prefix + lookups[name]]
+        if name in FORMATTERS:
+            value = FORMATTERS[name](value)
+        item[name] = value
+    return item
+
+
+def fetch_page(request, queryset, fields, lookups, date_field, descending=True, prefix='', archive=None):
+    # The cursor is built from the queryset's own date and id, so both are always selected.
+    # `archive` (rows read without `prefix`) continues the list once `queryset` runs out.
+    querysets = [queryset.values(*({prefix + lookups[name] for name in fields} | {date_field, 'id'}))]
+    if archive is not None:
+        querysets.append(archive.values(*({lookups[name] for name in fields} | {date_field, 'id'})))
+    rows, next_cursor = paginate_through(querysets, request.GET.get('cursor'),
+                                         date_field=date_field, descending=descending, page_size=page_size(request))
+    return [serialize(row, fields, lookups, prefix) for row in rows], next_cursor
+
+
+def api_view(view):
+    """login_required, plus errors reported as JSON {"error": ...} instead of HTML pages."""
+    @login_required
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except BadRequest as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        except Http404 as e:
+            return JsonResponse({'error': str(e)}, status=404)
+    return wrapper
+
+
+@api_view
+def myfeed(request):
+    # The current user's own posts, newest first.
+    fields = parse_fields(request, POST_FIELDS)
+    posts, next_cursor = fetch_page(request, Post.objects.filter(username=request.user),
+                                    fields, POST_FIELDS, 'date_posted',
+                                    archive=ArchivedPost.objects.filter(username=request.user))
+    return JsonResponse({'posts': posts, 'next_cursor': next_cursor})
+
+
+@api_view
+def friendsfeed(request):
+    # Friends' posts, newest first, read from the materialized timeline like the HTML feed.
+    # Post fields are selected through the entry's post__ relation, so this is still one query.
+    # ?order=top returns the ranked feed instead (see ranking.py), best first.
+    fields = parse_fields(request, POST_FIELDS)
+    if settings.RANKED_FEED and request.GET.get('order') == 'top':
+        posts, next_cursor = fetch_page(request, RankedEntry.objects.filter(owner=request.user, post__deleted_at=None),
+                                        fields, POST_FIELDS, 'rank', descending=False, prefix='post__')
+        return JsonResponse({'posts': posts, 'next_cursor': next_cursor})
+    # Archived posts have no timeline entries, so the feed continues with the friends' archived posts.
+    posts, next_cursor = fetch_page(request, TimelineEntry.objects.filter(owner=request.user, post__deleted_at=None),
+                                    fields, POST_FIELDS, 'date_posted', prefix='post__',
+                                    archive=ArchivedPost.objects.filter(username_id__in=request.friend_ids))
+    return JsonResponse({'posts': posts, 'next_cursor': next_cursor})
+
+
+def post_counts(post_id):
+    counts = Post.objects.filter(id=post_id).values('like_count', 'comment_count').first()
+    if counts is None:
+        raise Http404("No such post.")
+    return {'post_id': post_id, **counts}
+
+
+@api_view
+@require_http_methods(['POST', 'DELETE'])
+def like(request, post_id):
+    # POST likes the post, DELETE takes the like back; both answer with the new counts.
+    try:
+        if request.method == 'POST':
+            changed = engagement.add_like(request.user, post_id)
+        else:
+            changed = engagement.remove_like(request.user, post_id)
+    except IntegrityError:
+        # The like's foreign key points at a post that doesn't exist.
+        raise Http404("No such post.")
+    return JsonResponse({**post_counts(post_id), 'liked': request.method == 'POST', 'changed': changed})
+
+
+@api_view
+@require_http_methods(['GET', 'POST'])
+def comments(request, post_id):
+    if request.method == 'POST':
+        # Add a comment (form field "text"); answers with the comment and the new counts.
+        text = request.POST.get('text', '').strip()
+        max_length = Comment._meta.get_field('text').max_length
+        if not text or len(text) > max_length:
+            raise BadRequest(f"text must be 1 to {max_length} characters.")
+        try:
+            comment = engagement.add_comment(request.user, post_id, text)
+        except (IntegrityError, Post.DoesNotExist):
+            # No such post, or it was deleted.
+            raise Http404("No such post.")
+        return JsonResponse({**post_counts(post_id), 'comment': engagement.comment_data(comment)}, status=201)
+
+    # A post's comments, oldest first.
+    fields = parse_fields(request, COMMENT_FIELDS)
+    comments, next_cursor = fetch_page(request, Comment.objects.filter(post=post_id, post__deleted_at=None),
+                                       fields, COMMENT_FIELDS, 'date_added', descending=False)
+    # Only an empty page needs extra queries, to tell "no comments" from "no such post"
+    # (or a deleted one) and from "the post was archived" (its comments were moved along with it).
+    if not comments and not Post.objects.filter(id=post_id).exists():
+        if not ArchivedPost.objects.filter(id=post_id).exists():
+            raise Http404("No such post.")
+        comments, next_cursor = fetch_page(request, ArchivedComment.objects.filter(post=post_id, post__deleted_at=None),
+                                           fields, COMMENT_FIELDS, 'date_added', descending=False)
+    return JsonResponse({'comments': comments, 'next_cursor': next_cursor})
+
+
+def fetch_batch(request, querysets, lookups):
+    # Many objects by id in one query per queryset, returned in the order they were asked
+    # for. Each queryset after the first is only asked for the ids the ones before it
+    # didn't have (posts: the hot table, then the archive). Ids that don't exist are
+    # listed under "missing" instead of failing the whole batch.
+    ids = parse_ids(request)
+    fields = parse_fields(request, lookups)
+    values = {lookups[name] for name in fields} | {'id'}
+    rows = {}
+    for queryset in querysets:
+        wanted = [pk for pk in ids if pk not in rows]
+        if not wanted:
+            break
+        rows.update((row['id'], row) for row in queryset.filter(id__in=wanted).values(*values))
+    found = [serialize(rows[pk], fields, lookups) for pk in ids if pk in rows]
+    missing = [pk for pk in ids if pk not in rows]
+    return found, missing
+
+
+@api_view
+def posts(request):
+    # /api/posts/?ids=1,2,3
+    found, missing = fetch_batch(request, [Post.objects.all(), ArchivedPost.objects.all()], POST_FIELDS)
+    return JsonResponse({'posts': found, 'missing': missing})
+
+
+@api_view
+def profiles(request):
+    # /api/profiles/?ids=1,2,3
+    found, missing = fetch_batch(request, [Profile.objects.all()], PROFILE_FIELDS)
+    return JsonResponse({'profiles': found, 'missing': missing})
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class FeedappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'FeedApp'
+
+    def ready(self):
+        # Importing the modules registers their signal receivers (middleware.py's counts
+        # queries on every database connection, so it must be in place before the first opens).
+        from . import middleware, signals  # noqa: F401
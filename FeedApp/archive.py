@@ -0,0 +1,59 @@
+from django.db import transaction
+
+from . import versions
+from .models import ArchivedComment, ArchivedLike, ArchivedPost, Comment, Like, Post
+
+# Moving old posts out of the hot tables.
+#
+# Post, Comment and Like only grow, and every feed and counter query runs against them.
+# archive_older_than() moves posts older than a cutoff, together with their comments
+# and likes, into ArchivedPost/ArchivedComment/ArchivedLike (see models.py) in small
+# batches. Each batch is one transaction, so a post is always in exactly one place and
+# the job can be interrupted and re-run at any time.
+#
+# Archived rows keep their ids, dates, counters and version. Image files are left where
+# they are. Deleting the hot rows also drops their timeline entries, live events and
+# search documents: archived posts no longer appear in search results, and the friends
+# feed reaches them through ArchivedPost instead of the timeline.
+
+POST_FIELDS = [field.attname for field in Post._meta.concrete_fields]
+
+
+def archive_batch(cutoff, batch_size=500):
+    """Archive up to batch_size of the oldest posts from before `cutoff`. Returns how many were moved."""
+    with transaction.atomic():
+        # select_for_update() keeps a concurrent like/comment from landing on a post while it moves
+        # (a no-op on SQLite, where the write transaction already excludes other writers).
+        posts = list(Post.objects.select_for_update().filter(date_posted__lt=cutoff)
+                     .order_by('date_posted', 'id')[:batch_size])
+        if not posts:
+            return 0
+        ids = [post.id for post in posts]
+
+        ArchivedPost.objects.bulk_create(
+            [ArchivedPost(**{name: getattr(post, name) for name in POST_FIELDS}) for post in posts])
+        ArchivedComment.objects.bulk_create(
+            [ArchivedComment(id=c.id, post_id=c.post_id, username_id=c.username_id, text=c.text, date_added=c.date_added)
+             for c in Comment.objects.filter(post_id__in=ids).iterator()], batch_size=1000)
+        ArchivedLike.objects.bulk_create(
+            [ArchivedLike(post_id=post_id, username_id=user_id)
+             for post_id, user_id in Like.objects.filter(post_id__in=ids).values_list('post_id', 'username_id')],
+            batch_size=1000)
+
+        # The posts turn read-only on their authors' and readers' pages.
+        versions.bump_post_viewers(ids)
+        # Cascades to the posts' comments, likes, timeline entries and events.
+        Post.objects.filter(id__in=ids).delete()
+    return len(ids)
+
+
+def archive_older_than(cutoff, batch_size=500, progress=None):
+    """Archive every post from before `cutoff`, batch by batch. Returns the total moved."""
+    total = 0
+    while True:
+        moved = archive_batch(cutoff, batch_size)
+        if not moved:
+            return total
+        total += moved
+        if progress:
+            progress(total)
@@ -0,0 +1,118 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, redirect, render
+
+from . import engagement, events, fragments, identity, versions
+from .models import ArchivedComment, ArchivedPost, Comment, Post, RankedEntry, TimelineEntry
+from .pagination import apaginate, apaginate_through
+
+# Async versions of the read-heavy views in views.py, for the ASGI entry point.
+#
+# Under an ASGI server (see FeedProject/asgi.py) these replace views.myfeed,
+# views.friendsfeed and views.comments (settings.ASYNC_FEED_VIEWS, see urls.py). They
+# render the same templates and run the same queries, but wait on the database
+# without holding a worker thread, so one process can serve many slow requests at once.
+#
+# Nothing here may touch the database synchronously: related objects the templates
+# show are loaded with select_related(), and writes (which need transaction.atomic)
+# are handed to a thread with sync_to_async().
+#
+# event_stream has no sync version: it waits on new events for minutes at a time,
+# which only makes sense without a thread per open connection.
+
+
+async def current_user(request):
+    # request.user loads the user synchronously the first time something (e.g. base.html)
+    # reads it, which isn't allowed in async code. Load it asynchronously and keep it.
+    request.user = await request.auser()
+    return request.user
+
+
+@login_required
+@versions.conditional_page
+async def myfeed(request):
+    user = await current_user(request)
+    posts, next_cursor = await apaginate_through([Post.objects.filter(username=user).select_related('username'),
+                                                  ArchivedPost.objects.filter(username=user).select_related('username')],
+                                                 request.GET.get('cursor'))
+    rows = await fragments.arender_rows(posts, 'FeedApp/myfeed_row.html')
+
+    context = {'posts': posts, 'rows': rows, 'next_cursor': next_cursor}
+    return render(request, 'FeedApp/myfeed.html', context)
+
+
+@login_required
+async def comments(request, post_id):
+    user = await current_user(request)
+
+    if request.method == 'POST' and request.POST.get('btn1'):
+        # Archived posts (see archive.py) are read-only.
+        if await Post.objects.filter(id=post_id).aexists():
+            await sync_to_async(engagement.add_comment)(user, post_id, request.POST.get("comment"))
+        return redirect('FeedApp:comments', post_id=post_id)
+
+    # Awaited one after the other: the async ORM runs every query on the same worker
+    # thread, so gathering them wouldn't overlap them. Looking the post up first also
+    # tells which comments table to read.
+    post = await Post.objects.filter(id=post_id).afirst()
+    if post is None:
+        # Not in the hot table: the post and its comments may have been moved to the archive.
+        post = await aget_object_or_404(ArchivedPost, id=post_id)
+    comment_model = ArchivedComment if post.archived else Comment
+    comments, next_cursor = await apaginate(comment_model.objects.filter(post=post_id).select_related('username'),
+                                            request.GET.get('cursor'), date_field='date_added', descending=False)
+
+    context = {'post': post, 'comments': comments, 'next_cursor': next_cursor}
+    return render(request, 'FeedApp/comments.html', context)
+
+
+@login_required
+@versions.conditional_page
+async def friendsfeed(request):
+    user = await current_user(request)
+
+    if request.method == 'POST' and request.POST.get("like"):
+        if await sync_to_async(engagement.add_like)(user, request.POST.get("like")):
+            return redirect('FeedApp:friendsfeed')
+
+    # ?order=top: the ranked feed, falling back to the chronological one (as in views.friendsfeed).
+    order = 'top' if settings.RANKED_FEED and request.GET.get('order') == 'top' else None
+    posts = None
+    if order:
+        entries = RankedEntry.objects.filter(owner=user, post__deleted_at=None).select_related('post__username')
+        entries, next_cursor = await apaginate(entries, request.GET.get('cursor'), date_field='rank', descending=False)
+        if entries or request.GET.get('cursor'):
+            posts = [entry.post for entry in entries]
+        else:
+            order = None
+
+    if posts is None:
+        # Past the end of the timeline, the friends' archived posts (as in views.friendsfeed).
+        entries = TimelineEntry.objects.filter(owner=user, post__deleted_at=None).select_related('post__username')
+        friend_ids = await sync_to_async(identity.get_friend_ids)(user)
+        archived = ArchivedPost.objects.filter(username_id__in=friend_ids).select_related('username')
+        rows, next_cursor = await apaginate_through([entries, archived], request.GET.get('cursor'))
+        posts = [row.post if isinstance(row, TimelineEntry) else row for row in rows]
+    rows = await fragments.arender_rows(posts, 'FeedApp/friendsfeed_row.html')
+
+    context = {'posts': posts, 'rows': rows, 'next_cursor': next_cursor, 'order': order,
+               'ranked_feed': settings.RANKED_FEED}
+    return render(request, 'FeedApp/friendsfeed.html', context)
+
+
+@login_required
+async def event_stream(request):
+    # Server-Sent Events: live likes, comments and friend requests for the current user
+    # (see events.py). Browsers open it with `new EventSource('/events/')`.
+    if not settings.EVENTS_STREAM:
+        # 204 tells EventSource to stop reconnecting.
+        return HttpResponse(status=204)
+    user = await current_user(request)
+    response = StreamingHttpResponse(events.stream(user.id, request.headers.get('Last-Event-ID')),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream.
+    response['X-Accel-Buffering'] = 'no'
+    return response
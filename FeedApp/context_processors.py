@@ -0,0 +1,9 @@
+from django.conf import settings
+
+# Context processors add variables to every template rendered with a request
+# (see TEMPLATES in settings.py).
+
+
+def live_events(request):
+    # base.html only loads the live-update script's event stream when it is enabled.
+    return {'live_events': settings.EVENTS_STREAM}
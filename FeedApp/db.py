@@ -0,0 +1,93 @@
+from django.db import connections, router
+
+# Database helpers that the ORM doesn't offer directly.
+
+# Rows per INSERT (or DELETE) statement, keeping well under SQLite's limit on query parameters.
+BATCH_SIZE = 100
+
+
+def insert_ignore(model, rows):
+    """
+    INSERT the given unsaved model instances, silently skipping any that would violate
+    a unique constraint, and return how many rows were actually inserted.
+
+    This is a single "INSERT ... ON CONFLICT DO NOTHING" statement (SQLite and
+    PostgreSQL), so it is safe when several gunicorn workers insert the same row at
+    once. Unlike bulk_create(ignore_conflicts=True) it reports the inserted row count,
+    which callers use to decide whether to bump counters.
+    """
+    if not rows:
+        return 0
+    db = router.db_for_write(model)
+    connection = connections[db]
+    opts = model._meta
+    # Every concrete column except an auto-incrementing primary key.
+    fields = [f for f in opts.concrete_fields if not (f.primary_key and f.auto_created)]
+
+    qn = connection.ops.quote_name
+    insert = 'INSERT INTO {} ({}) VALUES '.format(qn(opts.db_table), ', '.join(qn(f.column) for f in fields))
+    placeholders = '(' + ', '.join(['%s'] * len(fields)) + ')'
+
+    inserted = 0
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), BATCH_SIZE):
+            batch = rows[start:start + BATCH_SIZE]
+            # pre_save() fills auto_now/auto_now_add timestamps the way Model.save() would.
+            params = [f.get_db_prep_save(f.pre_save(obj, add=True), connection) for obj in batch for f in fields]
+            sql = insert + ', '.join([placeholders] * len(batch)) + ' ON CONFLICT DO NOTHING'
+            cursor.execute(sql, params)
+            inserted += cursor.rowcount
+    return inserted
+
+
+def raw_delete(model, pks):
+    """
+    DELETE the rows with these primary keys and return how many were deleted.
+
+    Unlike QuerySet.delete() nothing is loaded, no signals are sent and nothing is
+    cascaded: the caller deletes dependent rows first (see FeedApp/purge.py).
+    """
+    db = router.db_for_write(model)
+    connection = connections[db]
+    qn = connection.ops.quote_name
+    opts = model._meta
+    pks = list(pks)
+    deleted = 0
+    with connection.cursor() as cursor:
+        for start in range(0, len(pks), BATCH_SIZE):
+            batch = pks[start:start + BATCH_SIZE]
+            sql = 'DELETE FROM {} WHERE {} IN ({})'.format(
+                qn(opts.db_table), qn(opts.pk.column), ', '.join(['%s'] * len(batch)))
+            cursor.execute(sql, [opts.pk.get_db_prep_value(pk, connection) for pk in batch])
+            deleted += cursor.rowcount
+    return deleted
+
+
+def estimated_count(model):
+    """
+    The number of rows in the model's table according to the database's planner
+    statistics, or None when there are none (never analyzed, or another database).
+
+    Unlike COUNT(*) this reads a single catalog row, however large the table, but it
+    is only as current as the last ANALYZE (autovacuum keeps it close on PostgreSQL).
+    """
+    db = router.db_for_read(model)
+    connection = connections[db]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                           [connection.ops.quote_name(table)])
+            row = cursor.fetchone()
+            # -1 (or 0 on older servers) until the table is first analyzed.
+            return int(row[0]) if row and row[0] > 0 else None
+        if connection.vendor == 'sqlite':
+            # sqlite_stat1 only exists once ANALYZE has run. The first number of each
+            # index's stat is the rows it covers; partial indexes cover fewer.
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [table])
+            counts = [int(stat.split()[0]) for stat, in cursor.fetchall()]
+            return max(counts) if counts else None
+    return None
@@ -0,0 +1,74 @@
+from django.db import transaction
+from django.db.models import F
+
+from . import events, versions
+from .db import insert_ignore
+from .models import Comment, Like, Post
+
+# Every like/comment write goes through these functions so that Post.like_count and
+# Post.comment_count change in the same transaction as the row they count.
+# F() expressions make the database do the arithmetic ("like_count = like_count + 1"),
+# so two concurrent requests can't overwrite each other's increment. The same UPDATE bumps
+# Post.version, which retires the post's cached feed rows (see fragments.py). Each change
+# is also published to the post's viewers as a live event (see events.py), and their
+# pages' version stamps are bumped (see versions.py).
+
+
+def comment_data(comment):
+    """The JSON form of a comment used by the API and live events."""
+    return {'id': comment.id, 'post_id': comment.post_id, 'author_id': comment.username_id,
+            'author': comment.username.username, 'text': comment.text, 'date_added': comment.date_added.isoformat()}
+
+
+def add_like(user, post_id):
+    """Like a post once. Returns True if a new like was recorded (never for a deleted post)."""
+    try:
+        with transaction.atomic():
+            # One conflict-tolerant INSERT instead of check-then-insert: the unique constraint on
+            # (username, post) decides, so concurrent double-clicks can't create two likes.
+            created = insert_ignore(Like, [Like(post_id=post_id, username=user)])
+            if created:
+                _count(post_id, like_count=F('like_count') + 1)
+                events.post_changed('like', post_id)
+                versions.bump_post_viewers([post_id])
+    except Post.DoesNotExist:
+        return False
+    return bool(created)
+
+
+def _count(post_id, **counters):
+    # The default manager leaves out deleted posts (see purge.py): raising rolls back the
+    # like or comment just inserted, so rows and counters can't drift apart.
+    if not Post.objects.filter(id=post_id).update(**counters, version=F('version') + 1):
+        raise Post.DoesNotExist("No such post.")
+
+
+def remove_like(user, post_id):
+    """Undo a like. Returns True if a like was removed."""
+    with transaction.atomic():
+        deleted, _ = Like.objects.filter(post_id=post_id, username=user).delete()
+        if deleted:
+            Post.objects.filter(id=post_id).update(like_count=F('like_count') - deleted, version=F('version') + 1)
+            events.post_changed('like', post_id)
+            versions.bump_post_viewers([post_id])
+    return bool(deleted)
+
+
+def add_comment(user, post_id, text):
+    """Create a comment on a post and return it. Raises Post.DoesNotExist if the post is deleted."""
+    with transaction.atomic():
+        comment = Comment.objects.create(post_id=post_id, username=user, text=text)
+        _count(post_id, comment_count=F('comment_count') + 1)
+        events.post_changed('comment', post_id, comment=comment_data(comment))
+        versions.bump_post_viewers([post_id])
+    return comment
+
+
+def delete_comment(comment):
+    """Delete a comment and decrement its post's counter."""
+    with transaction.atomic():
+        deleted, _ = Comment.objects.filter(id=comment.id).delete()
+        if deleted:
+            Post.objects.filter(id=comment.post_id).update(comment_count=F('comment_count') - 1, version=F('version') + 1)
+            events.post_changed('comment', comment.post_id)
+            versions.bump_post_viewers([comment.post_id])
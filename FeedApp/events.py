@@ -0,0 +1,102 @@
+import asyncio
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from . import jobs, tasks
+from .models import Event, Post, TimelineEntry
+
+# Live updates over Server-Sent Events, without an outside message broker.
+#
+# Writers publish by inserting Event rows in the same transaction as the change they
+# describe, so an event only becomes visible if the change commits. Each open stream
+# (one per browser tab, see async_views.event_stream) polls the table for rows newer
+# than the last id it sent that its user is allowed to see.
+#
+# Payloads carry absolute values ("like_count": 7) rather than increments, so a
+# client that misses an event (e.g. while reconnecting) is put right by the next one.
+
+_last_prune = 0.0
+
+
+def _maybe_prune():
+    # Schedule a clean-up of old events at most once per retention period per process.
+    global _last_prune
+    now = time.monotonic()
+    if now - _last_prune >= settings.EVENTS_RETENTION:
+        _last_prune = now
+        jobs.enqueue(tasks.prune_events)
+
+
+def post_changed(kind, post_id, **extra):
+    """Publish the post's current like and comment counts (plus `extra`) to everyone who can see it."""
+    counts = Post.objects.filter(id=post_id).values('like_count', 'comment_count').first()
+    if counts is None:
+        return
+    Event.objects.create(kind=kind, post_id=post_id, data={'post_id': int(post_id), **counts, **extra})
+    _maybe_prune()
+
+
+def notify_users(kind, user_ids, data):
+    """Publish the same event to each of the given users."""
+    Event.objects.bulk_create([Event(kind=kind, user_id=user_id, data=data) for user_id in user_ids])
+    _maybe_prune()
+
+
+def prune():
+    """Delete events older than settings.EVENTS_RETENTION seconds."""
+    cutoff = timezone.now() - timedelta(seconds=settings.EVENTS_RETENTION)
+    Event.objects.filter(created__lt=cutoff).delete()
+
+
+def visible_to(user_id):
+    # Events addressed to the user, about the user's own posts, or about posts in their timeline.
+    # The timeline check is a semi-join on the (owner, post) unique index.
+    return Event.objects.filter(
+        Q(user_id=user_id)
+        | Q(post__username_id=user_id)
+        | Q(post_id__in=TimelineEntry.objects.filter(owner_id=user_id).values('post_id'))
+    )
+
+
+def _message(fields):
+    return ''.join(f'{name}: {value}\n' for name, value in fields) + '\n'
+
+
+async def stream(user_id, last_event_id=None):
+    """
+    Yield the user's events in the text/event-stream format until EVENTS_STREAM_TIMEOUT.
+
+    The browser reconnects by itself when the stream ends, sending the id of the last
+    event it saw as Last-Event-ID; pass that as last_event_id to continue from there.
+    Without one, the stream starts with events published from now on.
+    """
+    try:
+        last_id = int(last_event_id)
+    except (TypeError, ValueError):
+        last_id = (await Event.objects.aaggregate(last=Max('id')))['last'] or 0
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.EVENTS_STREAM_TIMEOUT
+    # Tell the browser how soon to reconnect, and where this stream starts: a message with
+    # only an id still updates the id the browser sends back when it reconnects.
+    yield _message([('retry', settings.EVENTS_RETRY_MS), ('id', last_id)])
+    last_sent = loop.time()
+
+    while loop.time() < deadline:
+        events = [event async for event in visible_to(user_id).filter(id__gt=last_id).order_by('id')[:100]]
+        for event in events:
+            last_id = event.id
+            yield _message([('id', event.id), ('event', event.kind), ('data', json.dumps(event.data))])
+        if events:
+            last_sent = loop.time()
+        elif loop.time() - last_sent >= settings.EVENTS_HEARTBEAT:
+            # A comment line keeps proxies from closing an idle connection.
+            yield ': keepalive\n\n'
+            last_sent = loop.time()
+        if len(events) < 100:
+            await asyncio.sleep(settings.EVENTS_POLL_INTERVAL)
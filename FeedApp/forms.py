@@ -9,6 +9,10 @@ from .models import (
 # Form 1: for creating or editing a Post object
 # ModelForm creates a form automatically from a model class.
 class PostForm(forms.ModelForm):
+    # Set by static/FeedApp/upload.js when a large image was sent in chunks beforehand
+    # (see FeedApp/uploads.py); the image field is then left empty.
+    upload_id = forms.UUIDField(required=False, widget=forms.HiddenInput)
+
     # The Meta class is where we tell Django which model to use and which fields to include in the form.
     class Meta:
         model = Post
@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from . import metrics
+
+# Fragment cache for feed rows.
+#
+# A post's row looks the same to every viewer and only changes when the post does,
+# so the rendered HTML is cached under (template, model, post id, post version). Likes,
+# comments and edits bump Post.version, which makes the old entry unreachable; it is
+# never deleted explicitly and simply ages out of the cache.
+#
+# The cache is settings.CACHES[FRAGMENT_CACHE_ALIAS]: a size-bounded in-process LRU by
+# default, or a file/Redis/Memcached cache shared by all workers (see settings.py).
+
+
+def _key(template_name, post):
+    # Archived posts keep their id and version but render differently (read-only).
+    return f'row:{template_name}:{post._meta.model_name}:{post.id}:{post.version}'
+
+
+def _render(posts, keys, found, template_name):
+    # Render the rows missing from `found`; returns (rows, {key: html} to store).
+    rows = []
+    missing = {}
+    for key, post in zip(keys, posts):
+        html = found.get(key)
+        if html is None:
+            html = render_to_string(template_name, {'p': post})
+            missing[key] = html
+        rows.append(mark_safe(html))
+
+    metrics.increment('prism_fragment_cache_hits_total', template_name, len(found))
+    metrics.increment('prism_fragment_cache_misses_total', template_name, len(missing))
+    return rows, missing
+
+
+def render_rows(posts, template_name):
+    """
+    Return the rendered row HTML for each post, in order.
+
+    All rows are looked up with one get_many(); only misses are rendered (with the post
+    available as `p`) and written back with one set_many().
+    """
+    cache = caches[settings.FRAGMENT_CACHE_ALIAS]
+    keys = [_key(template_name, post) for post in posts]
+    rows, missing = _render(posts, keys, cache.get_many(keys), template_name)
+    if missing:
+        cache.set_many(missing)
+    return rows
+
+
+async def arender_rows(posts, template_name):
+    """Async version of render_rows(), for async views."""
+    cache = caches[settings.FRAGMENT_CACHE_ALIAS]
+    keys = [_key(template_name, post) for post in posts]
+    rows, missing = _render(posts, keys, await cache.aget_many(keys), template_name)
+    if missing:
+        await cache.aset_many(missing)
+    return rows
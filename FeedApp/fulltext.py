@@ -0,0 +1,159 @@
+import base64
+import json
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.http import Http404
+
+from .models import Comment, Post, Profile, SearchDocument
+
+# Full-text search over posts, comments and profiles.
+#
+# Every searchable object has one SearchDocument row holding its text. The row is
+# rewritten by signal receivers (signals.py) whenever the object is saved or deleted,
+# and the database keeps its full-text index over that row current: an FTS5 table on
+# SQLite, a tsvector column with a GIN index on PostgreSQL (see migration 0012).
+#
+# Results are ranked by relevance (bm25 on SQLite, ts_rank on PostgreSQL) and paged
+# with a cursor holding the (score, id) of the last result, like the feeds.
+
+DOCUMENT = '"FeedApp_searchdocument"'
+FTS = '"FeedApp_searchdocument_fts"'
+
+
+def body_for(kind, obj):
+    """The text indexed for a post, comment or profile."""
+    if kind == 'post':
+        return obj.description
+    if kind == 'comment':
+        return obj.text
+    return ' '.join([obj.user.username, obj.first_name, obj.last_name, obj.bio])
+
+
+def index_object(kind, obj):
+    # Update in place (the common case: an edit), or insert the first time.
+    body = body_for(kind, obj)
+    if not SearchDocument.objects.filter(kind=kind, object_id=obj.pk).update(body=body):
+        SearchDocument.objects.create(kind=kind, object_id=obj.pk, body=body)
+
+
+def remove_object(kind, object_id):
+    SearchDocument.objects.filter(kind=kind, object_id=object_id).delete()
+
+
+def remove_objects(kind, object_ids):
+    SearchDocument.objects.filter(kind=kind, object_id__in=object_ids).delete()
+
+
+def rebuild(batch_size=1000):
+    """Re-create every SearchDocument, e.g. after rows were bulk-loaded without signals."""
+    SearchDocument.objects.all().delete()
+    sources = [
+        ('post', Post.objects.all()),
+        ('comment', Comment.objects.all()),
+        ('profile', Profile.objects.select_related('user')),
+    ]
+    total = 0
+    for kind, queryset in sources:
+        batch = []
+        for obj in queryset.iterator(chunk_size=batch_size):
+            batch.append(SearchDocument(kind=kind, object_id=obj.pk, body=body_for(kind, obj)))
+            if len(batch) >= batch_size:
+                SearchDocument.objects.bulk_create(batch)
+                total += len(batch)
+                batch = []
+        SearchDocument.objects.bulk_create(batch)
+        total += len(batch)
+    if connection.vendor == 'sqlite':
+        # Merge the FTS5 index segments written by the inserts, for faster queries.
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS}({FTS}) VALUES ('optimize')")
+    return total
+
+
+def _encode_cursor(score, pk):
+    return base64.urlsafe_b64encode(json.dumps([score, pk]).encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor):
+    try:
+        score, pk = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return float(score), int(pk)
+    except (ValueError, TypeError):
+        raise Http404("Invalid page cursor.")
+
+
+def _fts5_query(text):
+    # Users type words, not FTS5 syntax: quote every word so characters like '-' or '"'
+    # can't break the query. Documents must contain all of them (after stemming, so
+    # "running" also finds "runs"), like websearch_to_tsquery() on PostgreSQL.
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"' for word in words)
+
+
+def _matches(query, kind):
+    # SQL returning (id, kind, object_id, score) for every matching document; higher scores rank first.
+    kind_clause = 'AND d.kind = %s' if kind else ''
+    kind_params = [kind] if kind else []
+    if connection.vendor == 'sqlite':
+        match = _fts5_query(query)
+        if match is None:
+            return None, None
+        # bm25() is lower for better matches; negate it so both databases sort descending.
+        sql = (f'SELECT d.id, d.kind, d.object_id, -bm25({FTS}) AS score '
+               f'FROM {FTS} JOIN {DOCUMENT} d ON d.id = {FTS}.rowid '
+               f'WHERE {FTS} MATCH %s {kind_clause}')
+        return sql, [match, *kind_params]
+    if connection.vendor == 'postgresql':
+        sql = (f"SELECT d.id, d.kind, d.object_id, ts_rank(d.vector, q)::float8 AS score "
+               f"FROM {DOCUMENT} d, websearch_to_tsquery('english', %s) q "
+               f"WHERE d.vector @@ q {kind_clause}")
+        return sql, [query, *kind_params]
+    # No full-text index on other databases: a plain, unranked substring match.
+    sql = f'SELECT d.id, d.kind, d.object_id, 0.0 AS score FROM {DOCUMENT} d WHERE d.body LIKE %s {kind_clause}'
+    return sql, [f'%{query}%', *kind_params]
+
+
+def search(query, kind=None, cursor=None, page_size=None):
+    """
+    Return (results, next_cursor) for one page of matches, best first.
+
+    Each result is a (kind, object, score) tuple; kind limits the search to
+    "post", "comment" or "profile".
+    """
+    page_size = page_size or settings.FEED_PAGE_SIZE
+    sql, params = _matches(query, kind)
+    if sql is None:
+        return [], None
+
+    sql = f'SELECT id, kind, object_id, score FROM ({sql}) AS r'
+    if cursor:
+        score, pk = _decode_cursor(cursor)
+        sql += ' WHERE r.score < %s OR (r.score = %s AND r.id > %s)'
+        params += [score, score, pk]
+    sql += ' ORDER BY r.score DESC, r.id LIMIT %s'
+    params.append(page_size + 1)
+
+    with connection.cursor() as c:
+        c.execute(sql, params)
+        rows = c.fetchall()
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = _encode_cursor(rows[-1][3], rows[-1][0])
+
+    # Load the matched objects with one query per kind.
+    ids = {'post': [], 'comment': [], 'profile': []}
+    for _, row_kind, object_id, _ in rows:
+        ids[row_kind].append(object_id)
+    objects = {
+        'post': Post.objects.select_related('username').in_bulk(ids['post']) if ids['post'] else {},
+        'comment': Comment.objects.select_related('username').in_bulk(ids['comment']) if ids['comment'] else {},
+        'profile': Profile.objects.select_related('user').in_bulk(ids['profile']) if ids['profile'] else {},
+    }
+    results = [(row_kind, objects[row_kind][object_id], score)
+               for _, row_kind, object_id, score in rows if object_id in objects[row_kind]]
+    return results, next_cursor
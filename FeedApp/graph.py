@@ -0,0 +1,232 @@
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+
+from .models import Profile, Relationship
+
+# An in-memory index of the friend graph (Profile.friends) used for friend suggestions.
+#
+# The graph is stored in "compressed sparse row" (CSR) form: every user gets a dense
+# position i, and the friends of that user are indices[indptr[i]:indptr[i + 1]].
+# Two flat integer arrays hold the whole graph, about 8 bytes per friendship.
+#
+# CSR arrays are expensive to change in place, so friendships added or removed after a
+# build go into small per-user overlays (`added`/`removed`). Once the overlays grow past
+# COMPACT_THRESHOLD the arrays are rebuilt from memory, without touching the database.
+# Rebuilds (and reloads) make a new FriendGraph and swap it in, so concurrent readers
+# never see one half-built.
+#
+# Each process (e.g. each gunicorn worker) keeps its own copy. Changes made in this
+# process are applied immediately through the m2m_changed receiver in signals.py;
+# changes made by other processes are picked up when the copy is older than
+# settings.FRIEND_GRAPH_MAX_AGE seconds and is reloaded.
+
+# Overlay size (added + removed edges) that triggers an in-memory rebuild.
+COMPACT_THRESHOLD = 1000
+
+
+class FriendGraph:
+    def __init__(self, edges):
+        """edges is an iterable of (user_id, friend_user_id) pairs."""
+        edges = sorted(set(edges))
+        # Every user that appears on either end of an edge gets a dense position.
+        self.node_ids = array('q', sorted({u for edge in edges for u in edge}))
+        self.indptr = array('q', [0] * (len(self.node_ids) + 1))
+        self.indices = array('q', [0] * len(edges))
+
+        # Edges are sorted by user, so each user's friends are one contiguous run.
+        for n, (user_id, friend_id) in enumerate(edges):
+            self.indices[n] = self._position(friend_id)
+            self.indptr[self._position(user_id) + 1] = n + 1
+        # Users without outgoing edges inherit the end of the previous run.
+        for i in range(1, len(self.indptr)):
+            self.indptr[i] = max(self.indptr[i], self.indptr[i - 1])
+
+        self.added = defaultdict(set)
+        self.removed = defaultdict(set)
+        self.built_at = time.monotonic()
+
+    @classmethod
+    def from_database(cls):
+        # One query over the Profile.friends through table gives every (user, friend) pair.
+        edges = Profile.friends.through.objects.values_list('profile__user_id', 'user_id')
+        return cls(edges.iterator())
+
+    def _position(self, user_id):
+        # Binary search in the sorted node id array; None for users without friendships.
+        i = bisect_left(self.node_ids, user_id)
+        if i < len(self.node_ids) and self.node_ids[i] == user_id:
+            return i
+        return None
+
+    def neighbors(self, user_id):
+        """Set of user ids that user_id is friends with."""
+        result = set()
+        i = self._position(user_id)
+        if i is not None:
+            result.update(self.node_ids[j] for j in self.indices[self.indptr[i]:self.indptr[i + 1]])
+        result -= self.removed.get(user_id, set())
+        result |= self.added.get(user_id, set())
+        return result
+
+    def add_edge(self, user_id, friend_id):
+        self.removed[user_id].discard(friend_id)
+        self.added[user_id].add(friend_id)
+
+    def remove_edge(self, user_id, friend_id):
+        self.added[user_id].discard(friend_id)
+        self.removed[user_id].add(friend_id)
+
+    def apply(self, action, pairs):
+        """Apply added or removed (user_id, friend_id) pairs; returns the graph to use from now on."""
+        for user_id, friend_id in pairs:
+            if action == 'add':
+                self.add_edge(user_id, friend_id)
+            else:
+                self.remove_edge(user_id, friend_id)
+        overlay = sum(map(len, self.added.values())) + sum(map(len, self.removed.values()))
+        if overlay <= COMPACT_THRESHOLD:
+            return self
+        # A new graph rather than rebuilding this one in place: requests still reading
+        # this one keep a consistent copy.
+        compacted = FriendGraph([(u, f) for u in set(self.node_ids) | set(self.added) for f in self.neighbors(u)])
+        # Compaction doesn't make the data any fresher than the last database load.
+        compacted.built_at = self.built_at
+        return compacted
+
+    def suggestions(self, user_id, k, exclude=()):
+        """
+        Top k (candidate_user_id, mutual_friend_count) pairs for user_id.
+
+        Candidates are friends of friends, ranked by how many friends they share with
+        user_id; ties go to the lower (older) user id. Users in `exclude` are skipped.
+        """
+        friends = self.neighbors(user_id)
+        skip = friends | set(exclude) | {user_id}
+        mutual = defaultdict(int)
+        for friend_id in friends:
+            for candidate in self.neighbors(friend_id):
+                if candidate not in skip:
+                    mutual[candidate] += 1
+        return heapq.nsmallest(k, mutual.items(), key=lambda item: (-item[1], item[0]))
+
+
+# The loaded graph. A graph object is never rebuilt in place: reloads and compactions
+# build a new one and swap this reference, so a request keeps using the graph it got
+# even while another one replaces it. Edge changes are applied to the overlays of the
+# current graph.
+_graph = None
+# Guards the variables below. Never held while the graph is loaded from the database.
+_lock = threading.Lock()
+# Makes the requests that find no graph at all wait for a single first load.
+_first_load = threading.Lock()
+# True while a request reloads a graph that has grown too old.
+_refreshing = False
+# One list per load in progress, collecting the changes applied meanwhile (the load may
+# have read the table before they were committed); they are replayed onto its result.
+_loads = []
+# Bumped by invalidate(): a load that started before it may miss changes, so its result is not kept.
+_generation = 0
+
+
+def _load():
+    global _graph
+    changes = []
+    with _lock:
+        _loads.append(changes)
+        generation = _generation
+    try:
+        graph = FriendGraph.from_database()
+    except BaseException:
+        with _lock:
+            _loads.remove(changes)
+        raise
+    # Stop collecting and swap in one step, so no change falls in between.
+    with _lock:
+        _loads.remove(changes)
+        for action, pairs in changes:
+            graph = graph.apply(action, pairs)
+        if generation == _generation:
+            _graph = graph
+    return graph
+
+
+def get_graph():
+    """
+    The process-wide FriendGraph, loaded from the database when missing or too old.
+
+    An old graph is reloaded by the request that notices, while the others keep using
+    it; only the very first load makes requests wait.
+    """
+    global _refreshing
+    with _lock:
+        graph = _graph
+        if graph is not None:
+            if _refreshing or time.monotonic() - graph.built_at <= settings.FRIEND_GRAPH_MAX_AGE:
+                return graph
+            _refreshing = True
+    if graph is not None:
+        try:
+            return _load()
+        finally:
+            with _lock:
+                _refreshing = False
+    with _first_load:
+        with _lock:
+            if _graph is not None:
+                return _graph
+        return _load()
+
+
+def apply_change(action, pairs):
+    """Apply added or removed (user_id, friend_id) pairs to the loaded graph, if there is one."""
+    global _graph
+    pairs = list(pairs)
+    with _lock:
+        for changes in _loads:
+            changes.append((action, pairs))
+        if _graph is not None:
+            _graph = _graph.apply(action, pairs)
+
+
+def invalidate():
+    """Drop the loaded graph so the next request reloads it from the database."""
+    global _graph, _generation
+    with _lock:
+        _graph = None
+        _generation += 1
+
+
+def suggest_friends(user, k=None):
+    """
+    Profiles the user may know, best first, each with a `mutual_friends` attribute.
+
+    Users already sent a request are left out. When there are fewer than k
+    friend-of-friend candidates (e.g. a brand new account) the list is topped up
+    with the newest profiles.
+    """
+    k = k or settings.FRIEND_SUGGESTIONS_COUNT
+    graph = get_graph()
+    requested = set(Relationship.objects.filter(sender__user=user).values_list('receiver__user_id', flat=True))
+    exclude = requested | graph.neighbors(user.id)
+    ranked = graph.suggestions(user.id, k, exclude=requested)
+
+    mutual = dict(ranked)
+    if len(mutual) < k:
+        newest = (Profile.objects.exclude(user_id__in=exclude | set(mutual) | {user.id})
+                  .order_by('-id').values_list('user_id', flat=True)[:k - len(mutual)])
+        for user_id in newest:
+            mutual[user_id] = 0
+
+    profiles = {p.user_id: p for p in Profile.objects.filter(user_id__in=mutual).select_related('user')}
+    result = []
+    for user_id, count in mutual.items():
+        if user_id in profiles:
+            profiles[user_id].mutual_friends = count
+            result.append(profiles[user_id])
+    return result
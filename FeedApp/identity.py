@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import Profile
+
+# Who is making the request: the current user's Profile and the ids of their friends.
+#
+# IdentityMiddleware (middleware.py) puts these on every request as request.profile and
+# request.friend_ids. Both are lazy, so a view that never reads them pays nothing, and
+# each costs at most one query per request. They are also cached for
+# settings.IDENTITY_CACHE_TTL seconds and dropped from the cache once a change to the
+# profile or the friendships commits. With the default per-process cache, other worker
+# processes can see the old values until the TTL runs out.
+
+FRIENDSHIP = Profile.friends.through
+PROFILE_FIELDS = [field.attname for field in Profile._meta.concrete_fields]
+
+
+def _cache():
+    return caches[settings.IDENTITY_CACHE_ALIAS]
+
+
+def _profile_key(user_id):
+    return f'identity:profile:{user_id}'
+
+
+def _friends_key(user_id):
+    return f'identity:friends:{user_id}'
+
+
+def get_profile(user):
+    """The user's Profile, created on first use, with profile.user set to `user`."""
+    ttl = settings.IDENTITY_CACHE_TTL
+    values = _cache().get(_profile_key(user.id)) if ttl else None
+    if values is None:
+        profile, _ = Profile.objects.get_or_create(user=user)
+        if ttl:
+            # Cache the column values rather than the object, so the User isn't pickled along with it.
+            _cache().set(_profile_key(user.id), [getattr(profile, name) for name in PROFILE_FIELDS], ttl)
+    else:
+        # from_db() builds an instance that saves as an UPDATE, like one read from the database.
+        profile = Profile.from_db('default', PROFILE_FIELDS, values)
+    # __str__ and the templates read profile.user; reuse the user already on the request.
+    profile.user = user
+    return profile
+
+
+def get_friend_ids(user):
+    """The ids of the user's friends (User ids), as a frozenset."""
+    ttl = settings.IDENTITY_CACHE_TTL
+    friend_ids = _cache().get(_friends_key(user.id)) if ttl else None
+    if friend_ids is None:
+        friend_ids = frozenset(FRIENDSHIP.objects.filter(profile__user_id=user.id).values_list('user_id', flat=True))
+        if ttl:
+            _cache().set(_friends_key(user.id), friend_ids, ttl)
+    return friend_ids
+
+
+def profile_changed(user_id):
+    # Forget the cached profile once the change is committed (before that, a concurrent
+    # request could cache the old row again).
+    transaction.on_commit(lambda: _cache().delete(_profile_key(user_id)))
+
+
+def friends_changed(user_ids):
+    keys = [_friends_key(user_id) for user_id in set(user_ids)]
+    transaction.on_commit(lambda: _cache().delete_many(keys))
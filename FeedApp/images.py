@@ -0,0 +1,78 @@
+import hashlib
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+# This file builds the resized copies ("variants") of a post's image.
+# Feeds show these small files through <img srcset> instead of downloading the
+# full-size original and shrinking it in the browser.
+
+# Pillow's save() arguments for each output format.
+# Re-encoding from pixels also drops EXIF and other metadata from the variants.
+FORMATS = {
+    'jpeg': ('jpg', {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('webp', {'format': 'WEBP', 'quality': 80, 'method': 4}),
+}
+
+
+def _load(image_field):
+    # Read the upload once and return an RGB image in its displayed orientation.
+    image_field.open('rb')
+    try:
+        img = Image.open(image_field)
+        # Apply the EXIF rotation before the metadata is thrown away.
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info:
+            # JPEG has no alpha channel; flatten transparent images onto white.
+            background = Image.new('RGB', img.size, 'white')
+            background.paste(img, mask=img.convert('RGBA').getchannel('A'))
+            img = background
+        img = img.convert('RGB')
+    finally:
+        image_field.close()
+    return img
+
+
+def _widths(original_width):
+    # Never upscale: keep the configured widths smaller than the original, and always
+    # produce at least one variant so the feed has something small to show.
+    widths = [w for w in settings.IMAGE_VARIANT_WIDTHS if w < original_width]
+    return widths or [original_width]
+
+
+def generate_variants(post):
+    """
+    Create the resized, re-encoded variants of post.image and record them on the post.
+
+    Files are stored next to the original as "<name>.<hash>.<width>w.<ext>", where the
+    hash is taken from the encoded bytes, so a URL always points at the same content.
+    """
+    if not post.image:
+        return []
+
+    original = _load(post.image)
+    stem = os.path.splitext(post.image.name)[0]
+    variants = []
+
+    for width in _widths(original.width):
+        resized = original.copy()
+        # thumbnail() keeps the aspect ratio and only ever shrinks.
+        resized.thumbnail((width, width * 10), Image.LANCZOS)
+        for fmt, (ext, save_args) in FORMATS.items():
+            buffer = io.BytesIO()
+            resized.save(buffer, **save_args)
+            data = buffer.getvalue()
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            name = f'{stem}.{digest}.{width}w.{ext}'
+            # Same name means same bytes, so an existing file can simply be reused.
+            if not default_storage.exists(name):
+                name = default_storage.save(name, ContentFile(data))
+            variants.append({'format': fmt, 'width': resized.width, 'name': name})
+
+    post.image_variants = variants
+    post.save(update_fields=['image_variants'])
+    return variants
@@ -0,0 +1,133 @@
+import logging
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+# A small database-backed job queue, so no external broker (Redis, RabbitMQ...) is needed.
+#
+# Views call enqueue(some_task, **kwargs), which inserts a Job row and returns at once.
+# Worker processes started by `manage.py run_workers` claim due jobs, run them, and
+# delete them on success. Failed attempts are retried with exponential backoff until
+# max_attempts is reached, after which the job is kept with status "failed".
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(func, delay=0, max_attempts=None, **kwargs):
+    """
+    Schedule func(**kwargs) to run in a background worker.
+
+    func must be a module-level function (see FeedApp/tasks.py) and kwargs must be
+    JSON-serializable. With settings.JOBS_RUN_INLINE the function runs immediately
+    instead, which keeps local development and tests free of a worker process.
+    """
+    if settings.JOBS_RUN_INLINE:
+        func(**kwargs)
+        return None
+    return Job.objects.create(
+        task=f"{func.__module__}.{func.__qualname__}",
+        payload=kwargs,
+        run_after=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or settings.JOBS_MAX_ATTEMPTS,
+    )
+
+
+def enqueue_many(func, kwargs_list):
+    """Schedule func once per kwargs dict in kwargs_list, with a single INSERT."""
+    if settings.JOBS_RUN_INLINE:
+        for kwargs in kwargs_list:
+            func(**kwargs)
+        return []
+    now = timezone.now()
+    task = f"{func.__module__}.{func.__qualname__}"
+    return Job.objects.bulk_create([
+        Job(task=task, payload=kwargs, run_after=now, max_attempts=settings.JOBS_MAX_ATTEMPTS)
+        for kwargs in kwargs_list
+    ])
+
+
+def _due(now):
+    # Queued jobs whose time has come, plus running jobs whose worker has let the lock expire
+    # (delivery is "at least once", so tasks must be safe to run twice).
+    return (Q(status='queued', run_after__lte=now)
+            | Q(status='running', locked_until__lt=now, attempts__lt=F('max_attempts')))
+
+
+def fail_abandoned():
+    """Mark jobs failed whose last allowed attempt timed out (e.g. the worker was killed)."""
+    return Job.objects.filter(
+        status='running', locked_until__lt=timezone.now(), attempts__gte=F('max_attempts'),
+    ).update(status='failed', locked_until=None, last_error="Visibility timeout expired on the last attempt.")
+
+
+def claim(visibility_timeout):
+    """Take one due job for this worker, or return None if there is nothing to do."""
+    now = timezone.now()
+    candidates = Job.objects.filter(_due(now)).order_by('run_after').values_list('id', flat=True)[:10]
+    for job_id in candidates:
+        # The conditional UPDATE is the lock: if another worker claimed the job first,
+        # the filter no longer matches and zero rows are updated.
+        claimed = Job.objects.filter(_due(now), id=job_id).update(
+            status='running',
+            locked_until=now + timedelta(seconds=visibility_timeout),
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return Job.objects.get(id=job_id)
+    return None
+
+
+def backoff(attempts):
+    """Seconds to wait before retry number `attempts`: 2, 4, 8, ... capped at JOBS_MAX_BACKOFF."""
+    return min(settings.JOBS_BASE_BACKOFF * 2 ** (attempts - 1), settings.JOBS_MAX_BACKOFF)
+
+
+def run(job):
+    """Run a claimed job and record the outcome."""
+    try:
+        func = import_string(job.task)
+        func(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning("Job %s (%s) failed on attempt %s", job.id, job.task, job.attempts)
+        if job.attempts >= job.max_attempts:
+            Job.objects.filter(id=job.id).update(status='failed', locked_until=None, last_error=error)
+        else:
+            retry_at = timezone.now() + timedelta(seconds=backoff(job.attempts))
+            Job.objects.filter(id=job.id).update(status='queued', locked_until=None,
+                                                 run_after=retry_at, last_error=error)
+        return False
+    Job.objects.filter(id=job.id).delete()
+    return True
+
+
+def work(poll_interval=1.0, visibility_timeout=None, once=False):
+    """
+    Worker loop: claim and run jobs until stopped.
+
+    With once=True the loop returns as soon as the queue has no due jobs, which is
+    handy for cron-style runs and tests.
+    """
+    visibility_timeout = visibility_timeout or settings.JOBS_VISIBILITY_TIMEOUT
+    processed = 0
+    while True:
+        # Long-running processes must drop stale or broken connections themselves;
+        # Django only does this automatically around HTTP requests.
+        close_old_connections()
+        job = claim(visibility_timeout)
+        if job is None:
+            fail_abandoned()
+            if once:
+                return processed
+            time.sleep(poll_interval)
+            continue
+        run(job)
+        processed += 1
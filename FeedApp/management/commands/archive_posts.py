@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from FeedApp import archive
+
+
+class Command(BaseCommand):
+    help = "Move posts older than --older-than days, with their comments and likes, into the archive tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, required=True, metavar='DAYS',
+                            help="Archive posts made more than this many days ago.")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Number of posts moved per transaction (default: 500).")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['older_than'])
+        total = archive.archive_older_than(
+            cutoff, options['batch_size'], progress=lambda moved: self.stdout.write(f"Archived {moved} posts..."))
+        self.stdout.write(self.style.SUCCESS(f"Archived {total} posts from before {cutoff:%Y-%m-%d %H:%M}."))
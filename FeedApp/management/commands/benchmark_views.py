@@ -0,0 +1,116 @@
+import json
+import statistics
+import subprocess
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.runner import DiscoverRunner
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment,
+)
+from django.urls import reverse
+
+from FeedApp import graph
+from FeedApp.models import Post, Profile
+
+# Drives the main views through Django's test client against seeded datasets of
+# several sizes and reports latency percentiles and query counts as JSON.
+# Everything runs in a throwaway test database, never in db.sqlite3.
+
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile of an already sorted list.
+    index = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "Benchmark the feed views at several dataset sizes and print the results as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000',
+                            help="Comma-separated numbers of users to seed (default: 100,1000).")
+        parser.add_argument('--posts-per-user', type=int, default=20)
+        parser.add_argument('--friends-per-user', type=int, default=20)
+        parser.add_argument('--requests', type=int, default=50, help="Timed requests per view and size.")
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        report = {'revision': git_revision(), 'requests': options['requests'], 'sizes': {}}
+
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0)
+        old_config = runner.setup_databases()
+        try:
+            for size in sizes:
+                # flush also resets id sequences, so the first seeded user is user 1, whom
+                # the friends view treats as the site admin.
+                call_command('flush', interactive=False, verbosity=0)
+                graph.invalidate()
+                call_command('seed_benchmark', users=size, posts_per_user=options['posts_per_user'],
+                             friends_per_user=options['friends_per_user'], stdout=self.stderr)
+                # Jobs run inline so that anything a view enqueues completes within the request.
+                with override_settings(JOBS_RUN_INLINE=True):
+                    report['sizes'][size] = self.run_views(options['requests'])
+        finally:
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def run_views(self, n_requests):
+        # Benchmark from the point of view of the user with the most friends.
+        profile = Profile.objects.annotate(n_friends=Count('friends')).order_by('-n_friends').first()
+        client = Client()
+        client.force_login(profile.user)
+        post = Post.objects.filter(username=profile.user).order_by('-date_posted').first()
+
+        urls = {
+            'index': reverse('FeedApp:index'),
+            'myfeed': reverse('FeedApp:myfeed'),
+            'friendsfeed': reverse('FeedApp:friendsfeed'),
+            'comments': reverse('FeedApp:comments', args=[post.id]),
+            'friends': reverse('FeedApp:friends'),
+        }
+        results = {}
+        for name, url in urls.items():
+            # One warm-up request fills per-process caches (e.g. the friend graph).
+            client.get(url)
+            timings = []
+            queries = []
+            for _ in range(n_requests):
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    response = client.get(url)
+                    timings.append((time.perf_counter() - start) * 1000)
+                queries.append(len(captured))
+            timings.sort()
+            results[name] = {
+                'status': response.status_code,
+                'p50_ms': round(percentile(timings, 50), 3),
+                'p95_ms': round(percentile(timings, 95), 3),
+                'p99_ms': round(percentile(timings, 99), 3),
+                'mean_ms': round(statistics.fmean(timings), 3),
+                'queries': max(queries),
+                'response_bytes': len(response.content),
+            }
+        return results
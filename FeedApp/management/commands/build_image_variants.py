@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from FeedApp import images
+from FeedApp.models import Post
+
+
+class Command(BaseCommand):
+    help = "Generate resized image variants for posts uploaded before the image pipeline existed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help="Rebuild variants for every post with an image, not only missing ones.")
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').only('id', 'image', 'image_variants')
+        if not options['all']:
+            posts = posts.filter(image_variants=[])
+
+        built = 0
+        for post in posts.iterator():
+            try:
+                images.generate_variants(post)
+            except (OSError, ValueError) as exc:
+                # A missing or unreadable original shouldn't stop the rest of the run.
+                self.stderr.write(f"Post {post.id}: {exc}")
+                continue
+            built += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Built variants for {built} posts."))
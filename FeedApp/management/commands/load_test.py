@@ -0,0 +1,118 @@
+import http.client
+import json
+import re
+import statistics
+import threading
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from .benchmark_views import percentile
+
+# Measures throughput of a *running* server under concurrent load, e.g. to compare
+# the WSGI entry point (sync views) with the ASGI one (async views). Unlike
+# benchmark_views, requests go over real HTTP to whatever server --url points at.
+
+
+class Command(BaseCommand):
+    help = "Send concurrent requests to a running server and report throughput and latency as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="Base URL of the running server.")
+        parser.add_argument('--paths', default='/myfeed/,/friendsfeed/',
+                            help="Comma-separated paths, requested round-robin.")
+        parser.add_argument('--concurrency', type=int, default=20, help="Simultaneous connections.")
+        parser.add_argument('--duration', type=float, default=10, help="Seconds to run for.")
+        parser.add_argument('--username', default='bench1')
+        parser.add_argument('--password', default='benchmark')
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http':
+            raise CommandError("Only http:// URLs are supported.")
+        self.host, self.port = url.hostname, url.port or 80
+        paths = [path.strip() for path in options['paths'].split(',') if path.strip()]
+        cookie = self.login(options['username'], options['password'])
+
+        timings = []
+        errors = {}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + options['duration']
+
+        def client(n):
+            # One keep-alive connection per simulated client, cycling through the paths.
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            i = n
+            while time.perf_counter() < deadline:
+                path = paths[i % len(paths)]
+                i += 1
+                start = time.perf_counter()
+                try:
+                    conn.request('GET', path, headers={'Cookie': cookie})
+                    response = conn.getresponse()
+                    response.read()
+                    outcome = response.status
+                except (OSError, http.client.HTTPException) as e:
+                    conn.close()
+                    conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+                    outcome = type(e).__name__
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    if outcome == 200:
+                        timings.append(elapsed)
+                    else:
+                        errors[str(outcome)] = errors.get(str(outcome), 0) + 1
+            conn.close()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=client, args=(n,)) for n in range(options['concurrency'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        timings.sort()
+        report = {
+            'url': options['url'], 'paths': paths, 'concurrency': options['concurrency'],
+            'seconds': round(wall, 3), 'requests': len(timings), 'errors': errors,
+            'requests_per_second': round(len(timings) / wall, 1),
+        }
+        if timings:
+            report.update({
+                'p50_ms': round(percentile(timings, 50), 3),
+                'p95_ms': round(percentile(timings, 95), 3),
+                'p99_ms': round(percentile(timings, 99), 3),
+                'mean_ms': round(statistics.fmean(timings), 3),
+            })
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def login(self, username, password):
+        # Log in through the normal login form and return the Cookie header to send.
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        conn.request('GET', '/users/login/')
+        response = conn.getresponse()
+        page = response.read().decode()
+        cookies = SimpleCookie()
+        for header in response.msg.get_all('Set-Cookie') or []:
+            cookies.load(header)
+        match = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', page)
+        if 'csrftoken' not in cookies or not match:
+            raise CommandError("Couldn't find a CSRF token on /users/login/.")
+
+        body = urlencode({'username': username, 'password': password, 'csrfmiddlewaretoken': match.group(1)})
+        conn.request('POST', '/users/login/', body=body, headers={
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Cookie': f"csrftoken={cookies['csrftoken'].value}",
+            'Referer': f'http://{self.host}:{self.port}/users/login/',
+        })
+        response = conn.getresponse()
+        response.read()
+        for header in response.msg.get_all('Set-Cookie') or []:
+            cookies.load(header)
+        conn.close()
+        if response.status != 302 or 'sessionid' not in cookies:
+            raise CommandError(f"Logging in as {username!r} failed.")
+        return '; '.join(f'{name}={morsel.value}' for name, morsel in cookies.items())
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from FeedApp import purge
+
+
+class Command(BaseCommand):
+    help = "Delete for good the accounts and posts that were deleted (hidden), with everything that depends on them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Rows deleted per statement and transaction (default: settings.PURGE_BATCH_SIZE).")
+
+    def handle(self, *args, **options):
+        accounts, posts = purge.purge_deleted(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Purged {accounts} accounts and {posts} posts."))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from FeedApp import ranking
+
+
+class Command(BaseCommand):
+    help = "Recompute every user's ranked (\"Top\") friends feed. Run it periodically, e.g. from cron."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', help="Comma-separated user ids to rank (default: everyone).")
+
+    def handle(self, *args, **options):
+        owner_ids = None
+        if options['users']:
+            owner_ids = [int(pk) for pk in options['users'].split(',') if pk.strip()]
+        start = time.perf_counter()
+        ranked = ranking.rank_feeds(owner_ids)
+        self.stdout.write(self.style.SUCCESS(f"Ranked feeds for {ranked} users in {time.perf_counter() - start:.1f}s."))
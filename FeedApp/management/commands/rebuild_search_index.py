@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from FeedApp import fulltext
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index from all posts, comments and profiles."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        # One transaction, so searches keep seeing the old index until the new one is complete.
+        with transaction.atomic():
+            total = fulltext.rebuild(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {total} documents."))
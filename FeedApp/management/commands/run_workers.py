@@ -0,0 +1,69 @@
+import multiprocessing
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+def _worker_process(poll_interval, visibility_timeout):
+    # Entry point of each child process. With the "spawn" start method (Windows, macOS)
+    # the child starts from a fresh interpreter, so Django has to be set up again here.
+    import django
+    django.setup()
+
+    from FeedApp import jobs
+    try:
+        jobs.work(poll_interval=poll_interval, visibility_timeout=visibility_timeout)
+    except KeyboardInterrupt:
+        pass
+
+
+class Command(BaseCommand):
+    help = "Run background job workers that process the FeedApp job queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=settings.JOBS_WORKER_PROCESSES,
+                            help="Number of worker processes (default: JOBS_WORKER_PROCESSES).")
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to sleep when the queue is empty (default: 1).")
+        parser.add_argument('--visibility-timeout', type=int, default=settings.JOBS_VISIBILITY_TIMEOUT,
+                            help="Seconds before a claimed but unfinished job is retried elsewhere.")
+        parser.add_argument('--once', action='store_true',
+                            help="Process every due job in this process, then exit.")
+
+    def handle(self, *args, **options):
+        from FeedApp import jobs
+
+        if options['once']:
+            processed = jobs.work(visibility_timeout=options['visibility_timeout'], once=True)
+            self.stdout.write(self.style.SUCCESS(f"Processed {processed} jobs."))
+            return
+
+        # Children must not share the parent's database connection.
+        from django.db import connections
+        connections.close_all()
+
+        workers = [
+            multiprocessing.Process(target=_worker_process,
+                                    args=(options['poll_interval'], options['visibility_timeout']),
+                                    daemon=True)
+            for _ in range(options['processes'])
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f"Started {len(workers)} workers. Press CTRL-C to stop.")
+
+        # Process managers stop services with SIGTERM; treat it like CTRL-C.
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            # Shut down once, even if more signals arrive while the workers are stopping.
+            # Jobs interrupted mid-run are retried once their visibility timeout expires.
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.join()
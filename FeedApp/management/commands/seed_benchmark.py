@@ -0,0 +1,137 @@
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from FeedApp import fulltext
+from FeedApp.models import Comment, Like, Post, Profile, Relationship, TimelineEntry
+
+# Rows per INSERT statement.
+BATCH_SIZE = 2000
+
+WORDS = ("sunny day coffee morning weekend trip friends family dinner music concert "
+         "game win team work project book movie garden dog cat beach mountain city").split()
+
+
+@contextmanager
+def explicit_dates(*fields):
+    # auto_now_add would stamp every seeded row with "now"; switch it off so the
+    # generated dates spread over the past like a real history.
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def sentence(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n)).capitalize()
+
+
+class Command(BaseCommand):
+    help = "Bulk-generate users, friendships, posts, comments and likes for benchmarking."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--posts-per-user', type=int, default=20)
+        parser.add_argument('--friends-per-user', type=int, default=20)
+        parser.add_argument('--comments-per-post', type=int, default=3)
+        parser.add_argument('--likes-per-post', type=int, default=5)
+        parser.add_argument('--days', type=int, default=365, help="Spread post dates over this many days.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, for repeatable datasets.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        n_users = options['users']
+        now = timezone.now()
+
+        with transaction.atomic():
+            users = self.create_users(n_users)
+            user_ids = [u.id for u in users]
+            profiles = Profile.objects.bulk_create([Profile(user_id=uid) for uid in user_ids], batch_size=BATCH_SIZE)
+            profile_of = {p.user_id: p.id for p in profiles}
+
+            friends = self.create_friendships(rng, user_ids, profile_of, options['friends_per_user'])
+            posts = self.create_posts(rng, user_ids, options['posts_per_user'], options['days'], now)
+            self.create_engagement(rng, posts, user_ids, options['comments_per_post'], options['likes_per_post'], now)
+            self.create_timelines(posts, friends)
+            # bulk_create skips the signals that keep the search index current.
+            fulltext.rebuild()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(users)} users, {sum(map(len, friends.values())) // 2} friendships, {len(posts)} posts."))
+
+    def create_users(self, n):
+        # Hashing a password is deliberately slow, so every seeded user shares one hash.
+        # They can all log in with the password "benchmark".
+        password = make_password('benchmark')
+        start = (User.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        User.objects.bulk_create(
+            [User(username=f'bench{start + i}', password=password) for i in range(n)], batch_size=BATCH_SIZE)
+        # bulk_create doesn't return primary keys on every database, so read them back.
+        return list(User.objects.filter(username__startswith='bench', id__gte=start).order_by('id'))
+
+    def create_friendships(self, rng, user_ids, profile_of, per_user):
+        # Accepted, symmetric friendships: per_user random partners per user on average.
+        friends = {uid: set() for uid in user_ids}
+        for uid in user_ids:
+            for other in rng.sample(user_ids, min(per_user // 2 + 1, len(user_ids))):
+                if other != uid:
+                    friends[uid].add(other)
+                    friends[other].add(uid)
+
+        Friendship = Profile.friends.through
+        Friendship.objects.bulk_create(
+            [Friendship(profile_id=profile_of[uid], user_id=fid) for uid, fids in friends.items() for fid in fids],
+            batch_size=BATCH_SIZE)
+        Relationship.objects.bulk_create(
+            [Relationship(sender_id=profile_of[uid], receiver_id=profile_of[fid], status='accepted')
+             for uid, fids in friends.items() for fid in fids if uid < fid],
+            batch_size=BATCH_SIZE)
+        return friends
+
+    def create_posts(self, rng, user_ids, per_user, days, now):
+        date_posted = Post._meta.get_field('date_posted')
+        posts = [
+            Post(username_id=uid, description=sentence(rng, rng.randint(3, 12)),
+                 date_posted=now - timedelta(seconds=rng.randint(0, days * 86400)))
+            for uid in user_ids for _ in range(per_user)
+        ]
+        with explicit_dates(date_posted):
+            Post.objects.bulk_create(posts, batch_size=BATCH_SIZE)
+        return list(Post.objects.filter(username_id__in=user_ids).only('id', 'username_id', 'date_posted'))
+
+    def create_engagement(self, rng, posts, user_ids, comments_per_post, likes_per_post, now):
+        date_added = Comment._meta.get_field('date_added')
+        comments = []
+        likes = []
+        for post in posts:
+            n_comments = rng.randint(0, comments_per_post * 2)
+            for _ in range(n_comments):
+                comments.append(Comment(
+                    post_id=post.id, username_id=rng.choice(user_ids), text=sentence(rng, rng.randint(2, 8)),
+                    date_added=post.date_posted + (now - post.date_posted) * rng.random()))
+            # Distinct users per post, matching the unique (username, post) constraint.
+            likers = rng.sample(user_ids, min(rng.randint(0, likes_per_post * 2), len(user_ids)))
+            likes.extend(Like(post_id=post.id, username_id=uid) for uid in likers)
+            post.comment_count = n_comments
+            post.like_count = len(likers)
+
+        with explicit_dates(date_added):
+            Comment.objects.bulk_create(comments, batch_size=BATCH_SIZE)
+        Like.objects.bulk_create(likes, batch_size=BATCH_SIZE)
+        Post.objects.bulk_update(posts, ['like_count', 'comment_count'], batch_size=BATCH_SIZE)
+
+    def create_timelines(self, posts, friends):
+        # The materialized friends feed: each post goes to every friend of its author.
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(owner_id=fid, post_id=post.id, date_posted=post.date_posted)
+             for post in posts for fid in friends[post.username_id]],
+            batch_size=BATCH_SIZE)
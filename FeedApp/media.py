@@ -0,0 +1,171 @@
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+# Serving uploaded files (MEDIA_URL) in production.
+#
+# Files are streamed straight from disk: under gunicorn, FileResponse hands the open
+# file to wsgi.file_wrapper, which uses sendfile() so the bytes never pass through
+# Python. Range requests (video scrubbing, resumed downloads) and conditional requests
+# (If-None-Match / If-Range) are answered here too. With settings.MEDIA_ACCEL_REDIRECT
+# set, the response only names the file and nginx sends it (X-Accel-Redirect).
+#
+# Image variants are stored under content-hashed names (see images.py), so their bytes
+# can never change and browsers may cache them forever.
+
+# "<stem>.<12 hex digits>.<width>w.<ext>", as written by images.generate_variants().
+HASHED_NAME = re.compile(r'\.(?P<hash>[0-9a-f]{12})\.\d+w\.\w+$')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# The only types a browser is allowed to display. Anything else under MEDIA_ROOT (an
+# .html or .svg that got in somehow) is sent as a download, so it can never run as a
+# page on the site's origin.
+INLINE_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp'}
+
+
+class FileRange:
+    """
+    Read at most `length` bytes of an open file starting at `start`.
+
+    fileno() is kept so that sendfile() still works: gunicorn sends Content-Length
+    bytes from the file's current position.
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.remaining = length
+        file.seek(start)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def etag_for(path, stat):
+    match = HASHED_NAME.search(path)
+    if match:
+        # The content hash is already in the name.
+        return f'"{match.group("hash")}"'
+    # Like nginx: modification time and size, which change whenever the file is replaced.
+    return f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    """
+    Return (start, end) for a single "bytes=" range, None to send the whole file, or
+    False if the range can't be satisfied. Multiple ranges get the whole file.
+    """
+    match = RANGE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # "bytes=-500" means the last 500 bytes.
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        return False
+    return start, end
+
+
+def _allowed(path):
+    # Only files in the upload directories are served, never anything else under MEDIA_ROOT.
+    return any(path.startswith(directory.rstrip('/') + '/') for directory in settings.MEDIA_SERVE_DIRS)
+
+
+def _with_headers(response, headers):
+    for name, value in headers.items():
+        response[name] = value
+    return response
+
+
+@require_safe
+def serve(request, path):
+    # Resolve "." and ".." first, so "images/../db.sqlite3" is checked as "db.sqlite3".
+    path = posixpath.normpath(path).lstrip('/')
+    if not _allowed(path):
+        raise Http404("Not a media file.")
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (ValueError, OSError):
+        # ValueError: the path tried to escape MEDIA_ROOT ("../").
+        raise Http404("No such file.")
+    if not os.path.isfile(full_path):
+        raise Http404("No such file.")
+
+    etag = etag_for(path, stat)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': IMMUTABLE if HASHED_NAME.search(path) else f'public, max-age={settings.MEDIA_MAX_AGE}',
+        'Accept-Ranges': 'bytes',
+    }
+
+    if_none_match = request.headers.get('If-None-Match', '')
+    if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+        response = HttpResponseNotModified()
+        return _with_headers(response, headers)
+
+    content_type = mimetypes.guess_type(full_path)[0]
+    if content_type not in INLINE_TYPES:
+        content_type = 'application/octet-stream'
+        headers['Content-Disposition'] = 'attachment'
+
+    if settings.MEDIA_ACCEL_REDIRECT:
+        # nginx serves the file from its internal location (including Range handling);
+        # Django only checked the path and chose the headers.
+        response = HttpResponse(content_type=content_type)
+        # Header values must be ASCII: nginx decodes the percent-encoding of the URI.
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT.rstrip('/') + '/' + quote(path)
+        return _with_headers(response, headers)
+
+    byte_range = None
+    if 'Range' in request.headers:
+        # If-Range: only honour the range if the client's copy is still current.
+        if_range = request.headers.get('If-Range')
+        if if_range is None or if_range == etag:
+            byte_range = parse_range(request.headers['Range'], stat.st_size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return response
+
+    if byte_range is None:
+        status, start, length = 200, 0, stat.st_size
+    else:
+        start, end = byte_range
+        status, length = 206, end - start + 1
+
+    # HEAD answers with the same status and headers GET would, without opening the file.
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type, status=status)
+    else:
+        file = open(full_path, 'rb')
+        body = file if byte_range is None else FileRange(file, start, length)
+        response = FileResponse(body, content_type=content_type, status=status)
+    response['Content-Length'] = length
+    if byte_range is not None:
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    return _with_headers(response, headers)
@@ -0,0 +1,154 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+# In-process metrics, exported in the Prometheus text format at /metrics.
+#
+# Each process (e.g. each gunicorn worker) records into its own registry. When
+# settings.METRICS_DIR is set, every process also writes a snapshot of its registry
+# to METRICS_DIR/<pid>.json (at most once per METRICS_FLUSH_INTERVAL seconds), and
+# /metrics adds up the snapshots of all processes, so a scrape sees the whole server
+# no matter which worker answers it. The file of a process that has exited (a worker
+# gunicorn restarted) is deleted by the next scrape rather than counted forever.
+
+# Bucket upper bounds for each histogram.
+SECONDS_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+QUERY_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500]
+BYTES_BUCKETS = [1024, 4096, 16384, 65536, 262144, 1048576, 4194304]
+
+HISTOGRAMS = {
+    'prism_view_duration_seconds': ('Wall time spent handling a request.', SECONDS_BUCKETS),
+    'prism_view_db_duration_seconds': ('Time spent waiting on the database per request.', SECONDS_BUCKETS),
+    'prism_view_queries': ('SQL queries executed per request.', QUERY_BUCKETS),
+    'prism_view_response_bytes': ('Size of the response body.', BYTES_BUCKETS),
+}
+# Counters: name -> (help text, label name).
+COUNTERS = {
+    'prism_fragment_cache_hits_total': ('Feed rows served from the fragment cache.', 'template'),
+    'prism_fragment_cache_misses_total': ('Feed rows rendered because they were not cached.', 'template'),
+}
+
+_lock = threading.Lock()
+# {metric name: {label value: {"counts": [...], "sum": float, "count": int}}}
+_histograms = {name: {} for name in HISTOGRAMS}
+# {metric name: {label value: number}}
+_counters = {name: {} for name in COUNTERS}
+_last_flush = 0.0
+
+
+def observe(name, label, value):
+    """Record one observation of `value` in histogram `name` for the given label (a view name)."""
+    buckets = HISTOGRAMS[name][1]
+    with _lock:
+        series = _histograms[name].setdefault(label, {'counts': [0] * (len(buckets) + 1), 'sum': 0.0, 'count': 0})
+        # The last slot counts observations above the largest bucket (the "+Inf" bucket).
+        series['counts'][bisect_left(buckets, value)] += 1
+        series['sum'] += value
+        series['count'] += 1
+
+
+def increment(name, label, amount=1):
+    """Add `amount` to counter `name` for the given label."""
+    with _lock:
+        _counters[name][label] = _counters[name].get(label, 0) + amount
+
+
+def snapshot():
+    with _lock:
+        return json.loads(json.dumps({'histograms': _histograms, 'counters': _counters}))
+
+
+def maybe_flush():
+    """Write this process's snapshot to METRICS_DIR if the flush interval has passed."""
+    global _last_flush
+    directory = settings.METRICS_DIR
+    now = time.monotonic()
+    if not directory or now - _last_flush < settings.METRICS_FLUSH_INTERVAL:
+        return
+    _last_flush = now
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{os.getpid()}.json')
+    # Write to a temporary file and rename it so readers never see half a file.
+    with open(path + '.tmp', 'w') as f:
+        json.dump(snapshot(), f)
+    os.replace(path + '.tmp', path)
+
+
+def _alive(pid):
+    try:
+        # Signal 0 checks that the process exists without sending anything.
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # It exists, but belongs to another user.
+        pass
+    return True
+
+
+def _merged():
+    # Add up the snapshots of every live process; this process contributes its live numbers.
+    snapshots = [snapshot()]
+    directory = settings.METRICS_DIR
+    if directory and os.path.isdir(directory):
+        for filename in os.listdir(directory):
+            pid, ext = os.path.splitext(filename)
+            if ext != '.json' or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                if not _alive(int(pid)):
+                    os.remove(path)
+                    continue
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+
+    histograms = {name: {} for name in HISTOGRAMS}
+    counters = {name: {} for name in COUNTERS}
+    for snap in snapshots:
+        for name, series in snap['counters'].items():
+            for label, value in series.items():
+                counters.setdefault(name, {})
+                counters[name][label] = counters[name].get(label, 0) + value
+        for name, series in snap['histograms'].items():
+            for label, data in series.items():
+                total = histograms.setdefault(name, {}).setdefault(
+                    label, {'counts': [0] * len(data['counts']), 'sum': 0.0, 'count': 0})
+                total['counts'] = [a + b for a, b in zip(total['counts'], data['counts'])]
+                total['sum'] += data['sum']
+                total['count'] += data['count']
+    return histograms, counters
+
+
+def _escape(label):
+    return label.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render():
+    """All metrics, summed over processes, in the Prometheus text exposition format."""
+    histograms, counters = _merged()
+    lines = []
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for label, data in sorted(histograms.get(name, {}).items()):
+            view = _escape(label)
+            cumulative = 0
+            # Prometheus buckets are cumulative: each counts everything up to its bound.
+            for bound, count in zip(buckets + ['+Inf'], data['counts']):
+                cumulative += count
+                lines.append(f'{name}_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{view="{view}"}} {data["sum"]}')
+            lines.append(f'{name}_count{{view="{view}"}} {data["count"]}')
+    for name, (help_text, label_name) in COUNTERS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for label, value in sorted(counters.get(name, {}).items()):
+            lines.append(f'{name}{{{label_name}="{_escape(label)}"}} {value}')
+    return '\n'.join(lines) + '\n'
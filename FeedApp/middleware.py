@@ -0,0 +1,226 @@
+import logging
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from django.utils.functional import SimpleLazyObject
+
+from . import identity, metrics, routers, uploads
+
+# Middleware hooks into every request/response (see MIDDLEWARE in settings.py).
+
+logger = logging.getLogger(__name__)
+
+
+# The stats of the request being served. Database connections are per thread, and the
+# async ORM runs its queries on sync_to_async threads, each with connections of its own;
+# so instead of wrapping the request thread's connections for the length of a request,
+# every connection counts its queries into whichever request's context it runs in
+# (sync_to_async carries the context over to the thread).
+_request_stats = ContextVar('request_stats', default=None)
+
+
+def _count_query(execute, sql, params, many, context):
+    stats = _request_stats.get()
+    if stats is None:
+        # Outside a request: management commands, background jobs.
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats['db_time'] += time.perf_counter() - start
+        stats['queries'] += 1
+
+
+def _install(connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+connection_created.connect(_install)
+
+
+class QueryMetricsMiddleware:
+    """
+    Record wall time, database time, query count and response size for every view
+    in the histograms of FeedApp.metrics, and warn when a view runs more queries
+    than its budget (settings.METRICS_QUERY_BUDGET / METRICS_QUERY_BUDGETS).
+    """
+
+    # Supports both sync and async requests, so under ASGI it doesn't force a request onto a thread.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, token = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        self.record(request, response, stats)
+        return response
+
+    async def __acall__(self, request):
+        stats, token = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        self.record(request, response, stats)
+        return response
+
+    def start(self):
+        stats = {'queries': 0, 'db_time': 0.0, 'start': time.perf_counter()}
+        # Connections opened before this module was imported never sent connection_created.
+        for alias in connections:
+            _install(connections[alias])
+        return stats, _request_stats.set(stats)
+
+    def record(self, request, response, stats):
+        elapsed = time.perf_counter() - stats['start']
+
+        # Requests that didn't match a URL (404s) are grouped together.
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else '<unresolved>'
+
+        metrics.observe('prism_view_duration_seconds', view, elapsed)
+        metrics.observe('prism_view_db_duration_seconds', view, stats['db_time'])
+        metrics.observe('prism_view_queries', view, stats['queries'])
+        if not response.streaming:
+            metrics.observe('prism_view_response_bytes', view, len(response.content))
+        metrics.maybe_flush()
+
+        budget = settings.METRICS_QUERY_BUDGETS.get(view, settings.METRICS_QUERY_BUDGET)
+        if budget is not None and stats['queries'] > budget:
+            logger.warning("%s ran %d queries (budget %d) in %.1f ms", view, stats['queries'], budget, elapsed * 1000)
+
+
+class IdentityMiddleware:
+    """
+    Add request.profile (the current user's Profile) and request.friend_ids (a frozenset
+    of their friends' User ids). Each is loaded the first time a view reads it, with one
+    query or from the short-lived cache in FeedApp.identity. Must come after
+    AuthenticationMiddleware, and is only meaningful for logged-in users.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self.attach(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        self.attach(request)
+        return await self.get_response(request)
+
+    @staticmethod
+    def attach(request):
+        request.profile = SimpleLazyObject(lambda: identity.get_profile(request.user))
+        request.friend_ids = SimpleLazyObject(lambda: identity.get_friend_ids(request.user))
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Let safe reads from the views in settings.REPLICA_READ_VIEWS use a read replica, and
+    keep a browser on the primary for settings.REPLICA_PIN_SECONDS after it writes (see
+    FeedApp.routers). Does nothing unless settings.DATABASE_REPLICAS is set.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request.db_routing, token = routers.begin()
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.end(token)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        request.db_routing, token = routers.begin()
+        try:
+            response = await self.get_response(request)
+        finally:
+            routers.end(token)
+        return self.pin(request, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Runs once the URL is resolved, before the view itself.
+        request.db_routing.use_replica = bool(
+            settings.DATABASE_REPLICAS
+            and request.method in ('GET', 'HEAD')
+            and request.resolver_match.view_name in settings.REPLICA_READ_VIEWS
+            and routers.PIN_COOKIE not in request.COOKIES
+        )
+
+    def pin(self, request, response):
+        # After a write (a post, like, comment...), read this browser's pages from the
+        # primary until the replicas have caught up.
+        if settings.DATABASE_REPLICAS and request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE') \
+                and response.status_code < 400:
+            response.set_cookie(routers.PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
+
+
+class UploadLimitMiddleware:
+    """
+    Answer 413 to a request whose Content-Length is already over the upload limit
+    (settings.UPLOAD_MAX_BYTES plus room for the other form fields), without reading
+    the body. Must come before CsrfViewMiddleware: the CSRF check reads the whole body
+    looking for the form's token, and would answer 403 once it wasn't there.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.refuse(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        return self.refuse(request) or await self.get_response(request)
+
+    @staticmethod
+    def refuse(request):
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return None
+        if length > settings.UPLOAD_MAX_BYTES + uploads.FORM_OVERHEAD:
+            return HttpResponse(str(uploads.too_large()), status=413, content_type='text/plain; charset=utf-8')
+        return None
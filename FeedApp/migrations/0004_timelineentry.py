@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_timelines(apps, schema_editor):
+    # Build the timeline for friendships that existed before this table did.
+    Profile = apps.get_model('FeedApp', 'Profile')
+    Post = apps.get_model('FeedApp', 'Post')
+    TimelineEntry = apps.get_model('FeedApp', 'TimelineEntry')
+    for profile in Profile.objects.all():
+        posts = Post.objects.filter(username__in=profile.friends.all())
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(owner_id=profile.user_id, post_id=p.id, date_posted=p.date_posted) for p in posts],
+            batch_size=500, ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FeedApp', '0003_alter_profile_created_alter_profile_updated_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_posted', models.DateTimeField()),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='FeedApp.post')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', '-date_posted', '-id'], name='timeline_owner_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('owner', 'post'), name='unique_timeline_entry')],
+            },
+        ),
+        migrations.RunPython(backfill_timelines, migrations.RunPython.noop),
+    ]
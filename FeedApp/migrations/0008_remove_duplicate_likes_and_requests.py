@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:03
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def remove_duplicates(apps, schema_editor):
+    # The unique constraints added by the next migration can't be created while duplicate rows exist.
+    Like = apps.get_model('FeedApp', 'Like')
+    Post = apps.get_model('FeedApp', 'Post')
+    Relationship = apps.get_model('FeedApp', 'Relationship')
+
+    # Keep the first like of each (user, post) and take the extras off the post's counter.
+    duplicates = (Like.objects.values('username', 'post').order_by()
+                  .annotate(n=Count('id'), keep=Min('id')).filter(n__gt=1))
+    for dup in duplicates:
+        Like.objects.filter(username=dup['username'], post=dup['post']).exclude(id=dup['keep']).delete()
+        Post.objects.filter(id=dup['post']).update(like_count=Like.objects.filter(post=dup['post']).count())
+
+    # Keep one request per (sender, receiver), preferring one that was accepted.
+    duplicates = (Relationship.objects.values('sender', 'receiver').order_by()
+                  .annotate(n=Count('id')).filter(n__gt=1))
+    for dup in duplicates:
+        rels = Relationship.objects.filter(sender=dup['sender'], receiver=dup['receiver'])
+        keep = rels.filter(status='accepted').order_by('id').first() or rels.order_by('id').first()
+        rels.exclude(id=keep.id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FeedApp', '0007_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,104 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:17
+
+from django.db import migrations, models
+
+# The full-text index itself is database-specific, so it is created here with raw SQL
+# rather than described by the model (see SearchDocument in models.py).
+SQLITE_INDEX = [
+    # An external-content FTS5 table: it indexes FeedApp_searchdocument.body without
+    # storing a second copy of the text. The triggers keep it in step with the table.
+    """CREATE VIRTUAL TABLE "FeedApp_searchdocument_fts" USING fts5(
+        body, content='FeedApp_searchdocument', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER "FeedApp_searchdocument_ai" AFTER INSERT ON "FeedApp_searchdocument" BEGIN
+        INSERT INTO "FeedApp_searchdocument_fts"(rowid, body) VALUES (new.id, new.body);
+    END""",
+    """CREATE TRIGGER "FeedApp_searchdocument_ad" AFTER DELETE ON "FeedApp_searchdocument" BEGIN
+        INSERT INTO "FeedApp_searchdocument_fts"("FeedApp_searchdocument_fts", rowid, body)
+        VALUES ('delete', old.id, old.body);
+    END""",
+    """CREATE TRIGGER "FeedApp_searchdocument_au" AFTER UPDATE ON "FeedApp_searchdocument" BEGIN
+        INSERT INTO "FeedApp_searchdocument_fts"("FeedApp_searchdocument_fts", rowid, body)
+        VALUES ('delete', old.id, old.body);
+        INSERT INTO "FeedApp_searchdocument_fts"(rowid, body) VALUES (new.id, new.body);
+    END""",
+]
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS "FeedApp_searchdocument_au"',
+    'DROP TRIGGER IF EXISTS "FeedApp_searchdocument_ad"',
+    'DROP TRIGGER IF EXISTS "FeedApp_searchdocument_ai"',
+    'DROP TABLE IF EXISTS "FeedApp_searchdocument_fts"',
+]
+POSTGRES_INDEX = [
+    # The database computes the tsvector whenever body changes; GIN makes @@ matches indexed.
+    """ALTER TABLE "FeedApp_searchdocument" ADD COLUMN vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('english', body)) STORED""",
+    'CREATE INDEX "searchdocument_vector_idx" ON "FeedApp_searchdocument" USING GIN (vector)',
+]
+POSTGRES_DROP = [
+    'DROP INDEX IF EXISTS "searchdocument_vector_idx"',
+    'ALTER TABLE "FeedApp_searchdocument" DROP COLUMN IF EXISTS vector',
+]
+
+
+def _run(schema_editor, statements):
+    for sql in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def create_fulltext_index(apps, schema_editor):
+    # Other databases get no index; FeedApp.fulltext falls back to a plain substring match there.
+    _run(schema_editor, {'sqlite': SQLITE_INDEX, 'postgresql': POSTGRES_INDEX})
+
+
+def drop_fulltext_index(apps, schema_editor):
+    _run(schema_editor, {'sqlite': SQLITE_DROP, 'postgresql': POSTGRES_DROP})
+
+
+def index_existing(apps, schema_editor):
+    # Index the posts, comments and profiles that existed before search did.
+    Post = apps.get_model('FeedApp', 'Post')
+    Comment = apps.get_model('FeedApp', 'Comment')
+    Profile = apps.get_model('FeedApp', 'Profile')
+    SearchDocument = apps.get_model('FeedApp', 'SearchDocument')
+
+    def documents():
+        for pk, description in Post.objects.values_list('id', 'description').iterator():
+            yield SearchDocument(kind='post', object_id=pk, body=description)
+        for pk, text in Comment.objects.values_list('id', 'text').iterator():
+            yield SearchDocument(kind='comment', object_id=pk, body=text)
+        for profile in Profile.objects.select_related('user').iterator():
+            body = ' '.join([profile.user.username, profile.first_name, profile.last_name, profile.bio])
+            yield SearchDocument(kind='profile', object_id=profile.id, body=body)
+
+    batch = []
+    for document in documents():
+        batch.append(document)
+        if len(batch) >= 1000:
+            SearchDocument.objects.bulk_create(batch)
+            batch = []
+    SearchDocument.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FeedApp', '0011_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('post', 'post'), ('comment', 'comment'), ('profile', 'profile')], max_length=8)),
+                ('object_id', models.BigIntegerField()),
+                ('body', models.TextField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('kind', 'object_id'), name='unique_search_document')],
+            },
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+        migrations.RunPython(index_existing, migrations.RunPython.noop),
+    ]
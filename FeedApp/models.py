@@ -1,10 +1,23 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.utils import timezone
 
 # This file is used to define the database structure (schema) for the app.
 # Each class represents a table in the database.
 # Django handles creating the tables and managing the relationships.
 
+
+class LiveManager(models.Manager):
+    # The default manager (`objects`) of models that can be soft-deleted: rows with a
+    # deleted_at are hidden everywhere at once, then removed by FeedApp/purge.py.
+    # `all_objects` still sees them.
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at=None)
+
+
 class Profile(models.Model):
     # Field definitions:
     # Each attribute represents a column in the database table and the type of data it holds.
@@ -32,6 +45,18 @@ class Profile(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     # DateTimeField with auto_now=True is updated every time the object is saved.
     updated = models.DateTimeField(auto_now=True)
+    # Set when the account is deleted (see FeedApp/purge.py); the profile is hidden until it is purged.
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        # Only the few deleted rows are indexed, for the purge job to find them.
+        indexes = [
+            models.Index(fields=["deleted_at"], condition=models.Q(deleted_at__isnull=False),
+                         name="profile_deleted_idx"),
+        ]
 
     # __str__ defines the string representation of the object, used in the Admin site and debugging.
     def __str__(self):
@@ -55,18 +80,92 @@ class Relationship(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # Only one request per (sender, receiver); duplicate submissions are ignored on insert.
+        constraints = [
+            models.UniqueConstraint(fields=["sender", "receiver"], name="unique_relationship"),
+        ]
+
 
-class Post(models.Model):
+class PostBase(models.Model):
+    # The columns and helpers shared by Post and ArchivedPost (an abstract model has no table of its own).
     description = models.CharField(max_length=255, blank=True)
     # ForeignKey to User: one user can have many posts.
     username = models.ForeignKey(User, on_delete=models.CASCADE)
     # ImageField stores an image. 'upload_to' specifies the subdirectory in MEDIA_ROOT.
     image = models.ImageField(upload_to="images", blank=True)
+    # Resized copies of the image made by FeedApp.images at upload time,
+    # stored as a list of {"format": ..., "width": ..., "name": ...} dicts.
+    image_variants = models.JSONField(default=list, blank=True)
     date_posted = models.DateTimeField(auto_now_add=True)
+    # Denormalized counters so feeds don't have to COUNT(*) likes and comments per post.
+    # They are only changed through FeedApp.engagement, in the same transaction as the
+    # Like/Comment row itself; `manage.py reconcile_counters` repairs any drift.
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    # Bumped whenever anything shown in the post's feed row changes (likes, comments, edits).
+    # Cached row HTML is keyed on (id, version), so a bump makes the old fragment unreachable.
+    version = models.PositiveIntegerField(default=0)
+    # Set when the post is deleted (see FeedApp/purge.py); the post is hidden until it is purged.
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    # Archived posts are read-only: templates hide the like button and comment box for them.
+    archived = False
+
+    class Meta:
+        abstract = True
 
     def __str__(self):
         return self.description
 
+    # The helpers below build the values templates put in <img srcset> / <source srcset>.
+    def _srcset(self, fmt):
+        return ", ".join(f"{default_storage.url(v['name'])} {v['width']}w"
+                         for v in self.image_variants if v['format'] == fmt)
+
+    @property
+    def jpeg_srcset(self):
+        return self._srcset('jpeg')
+
+    @property
+    def webp_srcset(self):
+        return self._srcset('webp')
+
+    @property
+    def thumbnail_url(self):
+        # Smallest JPEG variant for browsers without srcset; the original if there are no variants.
+        jpegs = [v for v in self.image_variants if v['format'] == 'jpeg']
+        if jpegs:
+            return default_storage.url(min(jpegs, key=lambda v: v['width'])['name'])
+        return self.image.url
+
+
+class Post(PostBase):
+    # A post in the "hot" table that every feed reads first. Old posts are moved to
+    # ArchivedPost by `manage.py archive_posts` (see FeedApp/archive.py).
+
+    class Meta:
+        # Every feed query is "this user's posts, newest first" - index exactly that.
+        indexes = [
+            models.Index(fields=["username", "-date_posted", "-id"], name="post_user_date_idx"),
+            models.Index(fields=["deleted_at"], condition=models.Q(deleted_at__isnull=False),
+                         name="post_deleted_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Editing an existing post changes its feed row, so bump the version in the same UPDATE.
+        # F() makes the database do the increment, so concurrent like/comment bumps aren't lost.
+        if self.pk is not None and not kwargs.get('force_insert'):
+            self.version = models.F('version') + 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = [*kwargs['update_fields'], 'version']
+        super().save(*args, **kwargs)
+        if isinstance(self.version, models.Expression):
+            self.refresh_from_db(fields=['version'])
+
 
 class Comment(models.Model):
     # ForeignKey to Post: one post can have many comments.
@@ -75,6 +174,12 @@ class Comment(models.Model):
     text = models.CharField(max_length=200)
     date_added = models.DateTimeField(auto_now_add=True, blank=True)
 
+    class Meta:
+        # The comments page reads "this post's comments, oldest first".
+        indexes = [
+            models.Index(fields=["post", "date_added", "id"], name="comment_post_date_idx"),
+        ]
+
     def __str__(self):
         return self.text
 
@@ -83,3 +188,214 @@ class Like(models.Model):
     # ForeignKey to User and Post to track who liked what.
     username = models.ForeignKey(User, related_name="likes", on_delete=models.CASCADE)
     post = models.ForeignKey(Post, related_name="likes", on_delete=models.CASCADE)
+
+    class Meta:
+        # A user can like a post only once; the database enforces it so concurrent requests can't double-count.
+        constraints = [
+            models.UniqueConstraint(fields=["username", "post"], name="unique_like"),
+        ]
+
+
+class TimelineEntry(models.Model):
+    # A materialized "friends feed": one row per (reader, post) pair.
+    # Rows are written when a friend posts (fan-out on write) and when a friendship
+    # is accepted (backfill), so reading the friends feed is a single indexed range
+    # read on (owner, date_posted) instead of a scan over every friend's posts.
+    owner = models.ForeignKey(User, related_name="timeline", on_delete=models.CASCADE)
+    # Deleting the post deletes its timeline entries as well.
+    post = models.ForeignKey(Post, related_name="timeline_entries", on_delete=models.CASCADE)
+    # Copied from the post so ordering never needs a join.
+    date_posted = models.DateTimeField()
+
+    class Meta:
+        # A post appears at most once in a given user's timeline.
+        constraints = [
+            models.UniqueConstraint(fields=["owner", "post"], name="unique_timeline_entry"),
+        ]
+        # The friends feed reads "newest entries for this owner" - index exactly that.
+        indexes = [
+            models.Index(fields=["owner", "-date_posted", "-id"], name="timeline_owner_date_idx"),
+        ]
+
+
+class RankedEntry(models.Model):
+    # One post in a user's ranked ("Top") friends feed. The whole ranked list for a user
+    # is rewritten by a periodic batch job (see FeedApp/ranking.py, `manage.py rank_feeds`);
+    # readers page through it by rank, like the chronological feed pages by date.
+    owner = models.ForeignKey(User, related_name="ranked_feed", on_delete=models.CASCADE)
+    post = models.ForeignKey(Post, related_name="+", on_delete=models.CASCADE)
+    # 0 is the best post.
+    rank = models.PositiveIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["owner", "post"], name="unique_ranked_entry"),
+        ]
+        # The ranked feed reads "this owner's entries, best first".
+        indexes = [
+            models.Index(fields=["owner", "rank", "id"], name="ranked_owner_rank_idx"),
+        ]
+
+
+class FeedVersion(models.Model):
+    # A per-user stamp of everything the user's own pages show (My Posts, the friends feed,
+    # Friends, Profile). It is bumped whenever any of that changes: a friend posts, a like or
+    # comment lands on a post the user can see, a relationship or the profile changes (see
+    # FeedApp/versions.py). Those pages use it as their ETag / Last-Modified, so a reload of
+    # an unchanged page is answered with 304 Not Modified after this one lookup.
+    user = models.OneToOneField(User, primary_key=True, related_name="+", on_delete=models.CASCADE)
+    version = models.PositiveBigIntegerField(default=0)
+    updated = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.user_id} v{self.version}"
+
+
+class Upload(models.Model):
+    # A large image being sent in chunks (see FeedApp/uploads.py), so that no single
+    # request has to carry the whole file. The bytes received so far are kept in a file
+    # under settings.UPLOAD_TEMP_DIR; once `received` reaches `size` the upload can be
+    # attached to a new post. Abandoned uploads are deleted after settings.UPLOAD_EXPIRY.
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, related_name="+", on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    # Total size declared when the upload was started, and how much of it has arrived.
+    size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    @property
+    def complete(self):
+        return self.received == self.size
+
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size})"
+
+
+# Choices for the 'status' field in the Job model.
+JOB_STATUS_CHOICES = (("queued", "queued"), ("running", "running"), ("failed", "failed"))
+
+
+class Job(models.Model):
+    # A unit of deferred work for the background workers (`manage.py run_workers`).
+    # Views enqueue jobs with FeedApp.jobs.enqueue() instead of doing slow work inline.
+    # Finished jobs are deleted, so the table only holds pending, running and failed work.
+
+    # Dotted path of the function to call, e.g. "FeedApp.tasks.fan_out_post".
+    task = models.CharField(max_length=200)
+    # Keyword arguments for the function (ids and other JSON-friendly values only).
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=8, choices=JOB_STATUS_CHOICES, default="queued")
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    # Earliest time the job may run; pushed into the future when a failed attempt backs off.
+    run_after = models.DateTimeField()
+    # While a worker runs the job nobody else may take it; if the worker dies the lock
+    # expires (the "visibility timeout") and another worker picks the job up again.
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # Workers look for "queued jobs that are due", oldest first.
+        indexes = [
+            models.Index(fields=["status", "run_after"], name="job_status_run_after_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.task} ({self.status})"
+
+
+class Event(models.Model):
+    # A live update pushed to browsers over the event stream (see FeedApp/events.py).
+    # The table is a small rolling log: streams poll it for rows newer than the last one
+    # they sent, and rows older than settings.EVENTS_RETENTION are pruned.
+
+    # "like", "comment", "friend_request" or "friend_accepted".
+    kind = models.CharField(max_length=20)
+    # Events about a post go to everyone who can see it: its author and every reader
+    # with the post in their timeline. Other events are addressed to a single user.
+    post = models.ForeignKey(Post, null=True, blank=True, related_name="+", on_delete=models.CASCADE)
+    user = models.ForeignKey(User, null=True, blank=True, related_name="+", on_delete=models.CASCADE)
+    # What the browser receives, e.g. {"post_id": 1, "like_count": 3, "comment_count": 0}.
+    data = models.JSONField(default=dict)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.kind} #{self.id}"
+
+
+# Choices for the 'kind' field in the SearchDocument model.
+SEARCH_KIND_CHOICES = (("post", "post"), ("comment", "comment"), ("profile", "profile"))
+
+
+class SearchDocument(models.Model):
+    # The searchable text of one post, comment or profile (see FeedApp/fulltext.py).
+    # Rows are rewritten whenever the object they describe is saved or deleted. The
+    # full-text index over `body` is database-specific and lives outside the ORM
+    # (created by migration 0012): an FTS5 table kept current by triggers on SQLite,
+    # and a generated tsvector column with a GIN index on PostgreSQL.
+    kind = models.CharField(max_length=8, choices=SEARCH_KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    body = models.TextField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["kind", "object_id"], name="unique_search_document"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}"
+
+
+# Archive tables (see FeedApp/archive.py).
+# `manage.py archive_posts` moves posts older than a cutoff, with their comments and
+# likes, out of the hot Post/Comment/Like tables into these. Rows keep their original
+# ids, dates and counters, so links, feed cursors and cached feed rows stay valid. Every
+# archived post is older than every post still in Post, which lets the feeds read Post
+# first and simply continue into ArchivedPost when a reader pages past the end of it.
+
+
+class ArchivedPost(PostBase):
+    # The original Post id, not a new one.
+    id = models.BigIntegerField(primary_key=True)
+    username = models.ForeignKey(User, related_name="archived_posts", on_delete=models.CASCADE)
+    # Copied from the post, so not auto_now_add.
+    date_posted = models.DateTimeField()
+
+    archived = True
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["username", "-date_posted", "-id"], name="archivedpost_user_date_idx"),
+            models.Index(fields=["deleted_at"], condition=models.Q(deleted_at__isnull=False),
+                         name="archivedpost_deleted_idx"),
+        ]
+
+
+class ArchivedComment(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    post = models.ForeignKey(ArchivedPost, on_delete=models.CASCADE)
+    username = models.ForeignKey(User, related_name="archived_comments", on_delete=models.CASCADE)
+    text = models.CharField(max_length=200)
+    date_added = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["post", "date_added", "id"], name="archivedcomment_post_date_idx"),
+        ]
+
+    def __str__(self):
+        return self.text
+
+
+class ArchivedLike(models.Model):
+    username = models.ForeignKey(User, related_name="archived_likes", on_delete=models.CASCADE)
+    post = models.ForeignKey(ArchivedPost, related_name="likes", on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["username", "post"], name="unique_archived_like"),
+        ]
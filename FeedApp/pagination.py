@@ -0,0 +1,118 @@
+import base64
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import Http404
+
+# Keyset ("cursor") pagination.
+# Instead of OFFSET, each page remembers the (date, id) of its last row and the next
+# page asks for rows strictly after that key. With an index on (date, id) every page
+# is a bounded indexed read, no matter how deep into the feed the reader goes.
+
+
+def encode_cursor(date, pk):
+    """
+    Turn the (date, id) key of the last row on a page into an opaque URL-safe string.
+    The first half of the key may also be a number, for lists ordered by e.g. a rank.
+    """
+    if isinstance(date, datetime):
+        date = date.isoformat()
+    raw = json.dumps([date, pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Reverse encode_cursor(); dates come back as ISO strings. A malformed cursor is treated as a missing page."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        date, pk = json.loads(raw)
+        return date, int(pk)
+    except (ValueError, TypeError):
+        raise Http404("Invalid page cursor.")
+
+
+def _page_queryset(queryset, cursor, date_field, descending, page_size):
+    # Order by (date_field, id), keep only rows after the cursor, and ask for one row
+    # more than a page to learn whether another page exists without a COUNT(*).
+    if descending:
+        queryset = queryset.order_by('-' + date_field, '-id')
+    else:
+        queryset = queryset.order_by(date_field, 'id')
+
+    if cursor:
+        date, pk = decode_cursor(cursor)
+        # Back to the field's own type (a datetime from its ISO string, a number...).
+        try:
+            date = queryset.model._meta.get_field(date_field).to_python(date)
+        except (ValidationError, TypeError):
+            raise Http404("Invalid page cursor.")
+        if date is None:
+            raise Http404("Invalid page cursor.")
+        # "after the cursor" means strictly older (or newer, ascending), breaking ties on id.
+        op = 'lt' if descending else 'gt'
+        queryset = queryset.filter(
+            Q(**{f'{date_field}__{op}': date}) | Q(**{date_field: date, f'id__{op}': pk})
+        )
+    return queryset[:page_size + 1]
+
+
+def _split_page(rows, date_field, page_size):
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        if isinstance(last, dict):
+            next_cursor = encode_cursor(last[date_field], last['id'])
+        else:
+            next_cursor = encode_cursor(getattr(last, date_field), last.id)
+    return rows, next_cursor
+
+
+def paginate(queryset, cursor=None, date_field='date_posted', descending=True, page_size=None):
+    """
+    Return (rows, next_cursor) for one page of queryset ordered by (date_field, id).
+
+    The queryset may also be a .values() queryset, as long as its rows include
+    date_field and id. next_cursor is None on the last page.
+    """
+    page_size = page_size or settings.FEED_PAGE_SIZE
+    rows = list(_page_queryset(queryset, cursor, date_field, descending, page_size))
+    return _split_page(rows, date_field, page_size)
+
+
+async def apaginate(queryset, cursor=None, date_field='date_posted', descending=True, page_size=None):
+    """Async version of paginate(), for async views."""
+    page_size = page_size or settings.FEED_PAGE_SIZE
+    rows = [row async for row in _page_queryset(queryset, cursor, date_field, descending, page_size)]
+    return _split_page(rows, date_field, page_size)
+
+
+def paginate_through(querysets, cursor=None, date_field='date_posted', descending=True, page_size=None):
+    """
+    Like paginate(), but over several querysets read one after the other, e.g. the hot
+    Post table and then ArchivedPost. Every row of a queryset must sort before every row
+    of the ones after it. A later queryset is only queried once the earlier ones run out
+    on the current page, so readers who stay near the top never touch the archive.
+    """
+    page_size = page_size or settings.FEED_PAGE_SIZE
+    rows = []
+    for queryset in querysets:
+        # One row more than the page still needs, as in paginate().
+        rows += _page_queryset(queryset, cursor, date_field, descending, page_size - len(rows))
+        if len(rows) > page_size:
+            break
+    return _split_page(rows, date_field, page_size)
+
+
+async def apaginate_through(querysets, cursor=None, date_field='date_posted', descending=True, page_size=None):
+    """Async version of paginate_through(), for async views."""
+    page_size = page_size or settings.FEED_PAGE_SIZE
+    rows = []
+    for queryset in querysets:
+        rows += [row async for row in _page_queryset(queryset, cursor, date_field, descending, page_size - len(rows))]
+        if len(rows) > page_size:
+            break
+    return _split_page(rows, date_field, page_size)
@@ -0,0 +1,241 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import fulltext, graph, identity, jobs, tasks, uploads, versions
+from .db import raw_delete
+from .models import ArchivedComment, ArchivedLike, ArchivedPost, Comment, Like, Post, Profile, Relationship, Upload
+
+# Deleting accounts and posts.
+#
+# Model.delete() cascades through Django's collector, which loads every dependent row
+# (posts, comments, likes, timeline entries...) into memory and deletes them all in one
+# transaction: for an active account that is a long request holding locks on the
+# busiest tables. Instead, deletion happens in two steps:
+#
+#  1. delete_account() / delete_posts() only set deleted_at (and deactivate the user).
+#     Post, ArchivedPost and Profile hide such rows from their default manager
+#     (models.LiveManager), so the content disappears from feeds, search and friend
+#     lists straight away.
+#  2. purge_deleted(), run by a background job (or `manage.py purge_deleted`), deletes
+#     the rows for good with purge(): dependents first, a few hundred rows per
+#     statement and per transaction, then the rows themselves, then their image files.
+#     Rows are only purged settings.PURGE_DELAY seconds after they were hidden; until
+#     then restore_posts() / restore_account() bring them back (the admin's "Restore
+#     selected" action).
+#
+# purge() skips the collector and the delete signals, so the side effects those signals
+# have elsewhere (search documents, counters, cached identities, page versions) are
+# handled by the hooks in BEFORE_DELETE. An interrupted purge simply continues on the
+# next run. Until the purge has run, likes and comments a deleted account left on other
+# people's posts are still shown.
+
+FRIENDSHIP = Profile.friends.through
+
+
+def delete_posts(post_ids):
+    """Hide these posts (live or archived) at once and queue them for purging. Returns how many were hidden."""
+    post_ids = list(post_ids)
+    now = timezone.now()
+    with transaction.atomic():
+        # Before the update: bump_post_viewers() only looks at live posts.
+        versions.bump_post_viewers(post_ids)
+        authors = list(ArchivedPost.objects.filter(id__in=post_ids).values_list('username_id', flat=True).distinct())
+        versions.bump_friends_of(authors)
+        hidden = (Post.objects.filter(id__in=post_ids).update(deleted_at=now)
+                  + ArchivedPost.objects.filter(id__in=post_ids).update(deleted_at=now))
+    jobs.enqueue(tasks.purge_deleted, delay=settings.PURGE_DELAY)
+    return hidden
+
+
+def restore_posts(post_ids):
+    """Undo delete_posts() for these posts if they haven't been purged yet. Returns how many were restored."""
+    post_ids = list(post_ids)
+    # Posts hidden with their author's account come back with the account (restore_account()).
+    deleted_accounts = Profile.all_objects.filter(deleted_at__isnull=False).values('user_id')
+    with transaction.atomic():
+        restored = sum(
+            model.all_objects.filter(id__in=post_ids, deleted_at__isnull=False)
+            .exclude(username_id__in=deleted_accounts).update(deleted_at=None)
+            for model in (Post, ArchivedPost))
+        # After the update, for the same reason delete_posts() bumps before it.
+        versions.bump_post_viewers(post_ids)
+        authors = list(ArchivedPost.objects.filter(id__in=post_ids).values_list('username_id', flat=True).distinct())
+        versions.bump_friends_of(authors)
+    return restored
+
+
+def delete_account(user):
+    """Deactivate the user and hide their profile and posts at once; the account is purged in the background."""
+    now = timezone.now()
+    with transaction.atomic():
+        # Inactive users can't log in, and their sessions stop authenticating.
+        User.objects.filter(id=user.id).update(is_active=False)
+        profile, _ = Profile.all_objects.get_or_create(user=user)
+        Profile.all_objects.filter(id=profile.id).update(deleted_at=now)
+        Post.objects.filter(username=user).update(deleted_at=now)
+        ArchivedPost.objects.filter(username=user).update(deleted_at=now)
+        fulltext.remove_object('profile', profile.id)
+        identity.profile_changed(user.id)
+        # The account drops out of its friends' feeds and Friends pages, and out of pending requests.
+        versions.bump_friends_of([user.id])
+        versions.bump_requests_of([user.id])
+    jobs.enqueue(tasks.purge_deleted, delay=settings.PURGE_DELAY)
+
+
+def restore_account(user):
+    """Undo delete_account() if the account hasn't been purged yet. Returns whether it was restored."""
+    with transaction.atomic():
+        profile = Profile.all_objects.filter(user=user, deleted_at__isnull=False).first()
+        if profile is None:
+            return False
+        User.objects.filter(id=user.id).update(is_active=True)
+        # Only the posts hidden with the account (same deleted_at), not those deleted before it.
+        Post.all_objects.filter(username=user, deleted_at=profile.deleted_at).update(deleted_at=None)
+        ArchivedPost.all_objects.filter(username=user, deleted_at=profile.deleted_at).update(deleted_at=None)
+        Profile.all_objects.filter(id=profile.id).update(deleted_at=None)
+        profile.deleted_at = None
+        fulltext.index_object('profile', profile)
+        identity.profile_changed(user.id)
+        versions.bump([user.id])
+        versions.bump_friends_of([user.id])
+        versions.bump_requests_of([user.id])
+    return True
+
+
+def purge_deleted(batch_size=None):
+    """Delete for good the accounts and posts hidden over settings.PURGE_DELAY seconds ago. Returns (accounts, posts)."""
+    cutoff = timezone.now() - timedelta(seconds=settings.PURGE_DELAY)
+    accounts = purge(User.objects.filter(
+        id__in=Profile.all_objects.filter(deleted_at__lte=cutoff).values('user_id')), batch_size)
+    posts = (purge(Post.all_objects.filter(deleted_at__lte=cutoff), batch_size)
+             + purge(ArchivedPost.all_objects.filter(deleted_at__lte=cutoff), batch_size))
+    return accounts, posts
+
+
+def purge(queryset, batch_size=None):
+    """
+    Delete the rows of `queryset` and everything that cascades from them, batch_size
+    rows at a time. Returns the number of rows of the queryset's model deleted.
+    """
+    batch_size = batch_size or settings.PURGE_BATCH_SIZE
+    model = queryset.model
+    total = 0
+    while True:
+        pks = list(queryset.order_by().values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return total
+        # The bulk of the work: dependents, each batch in its own short transaction.
+        _delete_dependents(model, pks, batch_size, final=False)
+        with transaction.atomic():
+            # Catch anything added to these rows in the meantime (normally nothing), then delete them.
+            _delete_dependents(model, pks, batch_size)
+            hook = BEFORE_DELETE.get(model)
+            if hook:
+                hook(model, pks)
+            total += raw_delete(model, pks)
+
+
+def _relations(model):
+    # The foreign keys pointing at `model`, including those of auto-created many-to-many
+    # tables: what Model.delete() would cascade to.
+    return [f for f in model._meta.get_fields(include_hidden=True)
+            if f.auto_created and not f.concrete and (f.one_to_many or f.one_to_one)]
+
+
+def _delete_dependents(model, pks, batch_size, final=True):
+    for relation in _relations(model):
+        field = relation.field
+        dependents = relation.related_model._base_manager.filter(**{f'{field.name}__in': pks})
+        if relation.on_delete is models.CASCADE:
+            if relation.one_to_one and not final:
+                # Keep one-to-one rows (e.g. the Profile whose deleted_at marks the account
+                # for purge_deleted()) until the final transaction, with the rows they belong
+                # to, so an interrupted purge can still find its rows; clear out theirs.
+                _delete_dependents(relation.related_model, list(dependents.values_list('pk', flat=True)),
+                                   batch_size, final=False)
+            else:
+                purge(dependents, batch_size)
+        elif relation.on_delete is models.SET_NULL:
+            dependents.update(**{field.name: None})
+        elif relation.on_delete is not models.DO_NOTHING:
+            raise ValueError(f"purge() doesn't support on_delete={relation.on_delete.__name__} ({field}).")
+
+
+# Hooks run just before a batch of rows is deleted, inside its transaction: hook(model, pks).
+
+def _posts_deleted(model, pks):
+    names = []
+    for image, variants in model._base_manager.filter(pk__in=pks).exclude(image='').values_list('image', 'image_variants'):
+        names.append(image)
+        names.extend(variant['name'] for variant in variants)
+    if model is Post:
+        fulltext.remove_objects('post', pks)
+    # Only once the rows are gone for good; a rolled-back batch keeps its images.
+    transaction.on_commit(lambda: [default_storage.delete(name) for name in names])
+
+
+def _engagement_deleted(model, pks):
+    # Take the deleted likes/comments off the counters of the posts that stay (the
+    # default manager leaves out posts that are being purged themselves).
+    post_model = model._meta.get_field('post').related_model
+    counter = 'like_count' if model in (Like, ArchivedLike) else 'comment_count'
+    by_count = {}
+    for post_id, n in (model._base_manager.filter(pk__in=pks).order_by().values_list('post_id')
+                       .annotate(n=Count('pk'))):
+        by_count.setdefault(n, []).append(post_id)
+    # One UPDATE per distinct count rather than per post; Greatest() keeps a drifted counter from going negative.
+    for n, post_ids in by_count.items():
+        post_model.objects.filter(id__in=post_ids).update(
+            **{counter: Greatest(F(counter) - n, 0)}, version=F('version') + 1)
+    if post_model is Post:
+        versions.bump_post_viewers([post_id for post_ids in by_count.values() for post_id in post_ids])
+    if model is Comment:
+        fulltext.remove_objects('comment', pks)
+
+
+def _profiles_deleted(model, pks):
+    fulltext.remove_objects('profile', pks)
+    for user_id in Profile.all_objects.filter(pk__in=pks).values_list('user_id', flat=True):
+        identity.profile_changed(user_id)
+
+
+def _relationships_deleted(model, pks):
+    # The other side's Friends page loses a request.
+    rows = Relationship.objects.filter(pk__in=pks)
+    versions.bump(Profile.all_objects.filter(id__in=rows.values('sender_id')).values('user_id'))
+    versions.bump(Profile.all_objects.filter(id__in=rows.values('receiver_id')).values('user_id'))
+
+
+def _friendships_deleted(model, pks):
+    # What relationships.friendships_changed() does, minus the timeline jobs: the
+    # purge removes the timeline entries itself.
+    pairs = list(FRIENDSHIP.objects.filter(pk__in=pks).values_list('profile__user_id', 'user_id'))
+    transaction.on_commit(lambda: graph.apply_change('remove', pairs))
+    user_ids = {user_id for pair in pairs for user_id in pair}
+    identity.friends_changed(user_ids)
+    versions.bump(user_ids)
+
+
+def _uploads_deleted(model, pks):
+    transaction.on_commit(lambda: [uploads.remove_partial(pk) for pk in pks])
+
+
+BEFORE_DELETE = {
+    Post: _posts_deleted,
+    ArchivedPost: _posts_deleted,
+    Comment: _engagement_deleted,
+    Like: _engagement_deleted,
+    ArchivedComment: _engagement_deleted,
+    ArchivedLike: _engagement_deleted,
+    Profile: _profiles_deleted,
+    Relationship: _relationships_deleted,
+    FRIENDSHIP: _friendships_deleted,
+    Upload: _uploads_deleted,
+}
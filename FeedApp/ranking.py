@@ -0,0 +1,126 @@
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from . import versions
+from .models import Comment, Like, RankedEntry, TimelineEntry
+
+# The ranked ("Top") friends feed.
+#
+# The chronological friends feed shows the newest posts first, so with many friends a
+# popular post from this morning can be pushed off page one by a stream of fresh ones.
+# rank_feeds() runs as a periodic batch job (`manage.py rank_feeds`, or the
+# tasks.rank_feeds job) and, for each user, scores every post from the last
+# RANKED_FEED_WINDOW_HOURS in their timeline by:
+#
+#  - recency: halves every RANKED_FEED_HALF_LIFE_HOURS;
+#  - velocity: likes and comments per hour since the post was made;
+#  - affinity: how often the reader has liked or commented on that friend's posts.
+#
+# Scores are computed with NumPy over all candidates of a batch of users at once,
+# rather than post by post in Python. The best RANKED_FEED_SIZE posts per user are stored
+# as RankedEntry rows, which the feed pages through by rank. Posts made after the last
+# run only show up in the ranked feed at the next run (they are in the chronological one
+# straight away).
+
+
+def _pair_keys(first, second, width):
+    # One int64 per (user id, user id) pair, so pairs can be matched with array operations.
+    return first * width + second
+
+
+def _interactions(owner_ids):
+    """(reader, author, weight) arrays: one row per reader who liked or commented on the author's posts."""
+    weights = settings.RANKED_FEED_WEIGHTS
+    readers, authors, counts = [], [], []
+    for model, weight in ((Like, 1.0), (Comment, weights['comment'])):
+        pairs = (model.objects.filter(username_id__in=owner_ids).order_by()
+                 .values_list('username_id', 'post__username_id').annotate(n=Count('id')))
+        for reader, author, n in pairs:
+            readers.append(reader)
+            authors.append(author)
+            counts.append(n * weight)
+    return np.array(readers, dtype=np.int64), np.array(authors, dtype=np.int64), np.array(counts, dtype=float)
+
+
+def _interaction_counts(readers, authors, counts, width):
+    """Sorted pair keys for (reader, author) and the summed weight of each pair."""
+    if not len(readers):
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    # Sum the likes and comments of the same pair.
+    unique, inverse = np.unique(_pair_keys(readers, authors, width), return_inverse=True)
+    return unique, np.bincount(inverse, weights=counts)
+
+
+def score(age_hours, likes, comments, affinity):
+    """Score arrays of candidate posts; higher is better."""
+    weights = settings.RANKED_FEED_WEIGHTS
+    recency = 0.5 ** (age_hours / settings.RANKED_FEED_HALF_LIFE_HOURS)
+    # Engagement per hour; the +2 keeps a post with one early like from looking viral.
+    velocity = (likes + weights['comment'] * comments) / (age_hours + 2)
+    return (recency
+            * (1 + weights['velocity'] * np.log1p(velocity))
+            * (1 + weights['affinity'] * np.log1p(affinity)))
+
+
+def _rank_batch(owner_ids, now):
+    since = now - timedelta(hours=settings.RANKED_FEED_WINDOW_HOURS)
+    rows = list(TimelineEntry.objects.filter(owner_id__in=owner_ids, date_posted__gte=since, post__deleted_at=None)
+                .values_list('owner_id', 'post_id', 'post__username_id', 'date_posted',
+                             'post__like_count', 'post__comment_count'))
+    entries = []
+    if rows:
+        owner, post, author, posted, likes, comments = zip(*rows)
+        owner = np.array(owner, dtype=np.int64)
+        post = np.array(post, dtype=np.int64)
+        author = np.array(author, dtype=np.int64)
+        age_hours = np.maximum((now.timestamp() - np.array([d.timestamp() for d in posted])) / 3600, 0)
+
+        # Look up every candidate's (reader, author) interaction count in one searchsorted().
+        # The readers have interacted with authors who aren't candidates too: the width
+        # must cover every id in a key, or different pairs would share one.
+        readers, authors, counts = _interactions(owner_ids)
+        width = int(max(owner.max(), author.max(), readers.max(initial=0), authors.max(initial=0))) + 1
+        pair_keys, pair_counts = _interaction_counts(readers, authors, counts, width)
+        affinity = np.zeros(len(rows))
+        if len(pair_keys):
+            keys = _pair_keys(owner, author, width)
+            index = np.minimum(np.searchsorted(pair_keys, keys), len(pair_keys) - 1)
+            found = pair_keys[index] == keys
+            affinity[found] = pair_counts[index[found]]
+
+        scores = score(age_hours, np.array(likes, dtype=float), np.array(comments, dtype=float), affinity)
+
+        # Sort by owner, then best score, then newest post; number each owner's posts from 0.
+        order = np.lexsort((-post, -scores, owner))
+        owner, post, scores = owner[order], post[order], scores[order]
+        starts = np.flatnonzero(np.r_[True, owner[1:] != owner[:-1]])
+        ranks = np.arange(len(owner)) - np.repeat(starts, np.diff(np.r_[starts, len(owner)]))
+        keep = ranks < settings.RANKED_FEED_SIZE
+        entries = [RankedEntry(owner_id=o, post_id=p, rank=r, score=s)
+                   for o, p, r, s in zip(owner[keep].tolist(), post[keep].tolist(),
+                                         ranks[keep].tolist(), scores[keep].tolist())]
+
+    # Swap each user's whole list at once, so readers never see half of an old and half of a new ranking.
+    with transaction.atomic():
+        RankedEntry.objects.filter(owner_id__in=owner_ids).delete()
+        RankedEntry.objects.bulk_create(entries, batch_size=1000)
+        versions.bump(owner_ids)
+    return len(entries)
+
+
+def rank_feeds(owner_ids=None, now=None):
+    """Recompute the ranked feed of every user (or only `owner_ids`). Returns the number of users ranked."""
+    now = now or timezone.now()
+    if owner_ids is None:
+        owner_ids = User.objects.order_by('id').values_list('id', flat=True)
+    owner_ids = list(owner_ids)
+    batch_size = settings.RANKED_FEED_BATCH_USERS
+    for start in range(0, len(owner_ids), batch_size):
+        _rank_batch(owner_ids[start:start + batch_size], now)
+    return len(owner_ids)
@@ -0,0 +1,100 @@
+from django.db import transaction
+
+from . import events, graph, identity, jobs, tasks, versions
+from .db import insert_ignore
+from .models import Profile, Relationship
+
+# Friend requests and friendships.
+# The bulk operations below replace "one query per checkbox" loops: each validates all
+# submitted ids with one query and writes with one statement per table, inside a single
+# transaction. Submitting the same form twice does nothing the second time.
+
+
+def _parse_ids(values):
+    # Ids come straight from the POST body; anything that isn't a number is ignored.
+    ids = set()
+    for value in values:
+        try:
+            ids.add(int(value))
+        except (TypeError, ValueError):
+            continue
+    return ids
+
+
+def friendships_changed(action, pairs):
+    """
+    Update everything derived from Profile.friends after (user_id, friend_id) pairs were
+    added (action='add') or removed (action='remove').
+    """
+    pairs = list(pairs)
+    # The in-memory friend graph (graph.py) is cheap to update; do it once the change is committed.
+    transaction.on_commit(lambda: graph.apply_change(action, pairs))
+    # Both sides' cached friend ids (identity.py) and Friends pages (versions.py) are out of date.
+    user_ids = {user_id for pair in pairs for user_id in pair}
+    identity.friends_changed(user_ids)
+    versions.bump(user_ids)
+
+    # Copying a friend's whole post history can be slow, so it runs in a background worker.
+    task = tasks.backfill_timeline if action == 'add' else tasks.prune_timeline
+    jobs.enqueue_many(task, [{'owner_id': owner_id, 'author_id': author_id} for owner_id, author_id in pairs])
+
+
+def send_requests(sender_profile, receiver_ids):
+    """Send friend requests from sender_profile to the given profile ids. Returns the number created."""
+    receiver_ids = _parse_ids(receiver_ids)
+    receiver_ids.discard(sender_profile.id)
+    with transaction.atomic():
+        # One query keeps only ids that are real profiles without a request from this sender;
+        # the unique constraint on (sender, receiver) still makes the INSERT skip any
+        # request that a concurrent submission created in the meantime.
+        receivers = dict(Profile.objects.filter(id__in=receiver_ids).exclude(
+            receiver__sender=sender_profile).values_list('id', 'user_id'))
+        created = insert_ignore(Relationship, [
+            Relationship(sender=sender_profile, receiver_id=receiver_id, status='sent')
+            for receiver_id in receivers
+        ])
+        # Receivers get a live notification (see events.py); requests that already existed
+        # were excluded above, so resubmitting the form doesn't notify anyone twice.
+        if created:
+            versions.bump([sender_profile.user_id, *receivers.values()])
+            events.notify_users('friend_request', receivers.values(), {
+                'profile_id': sender_profile.id, 'username': sender_profile.user.username})
+        return created
+
+
+def accept_requests(receiver_profile, relationship_ids):
+    """
+    Accept the given friend requests sent to receiver_profile. Returns the number accepted.
+
+    Requests addressed to someone else or already accepted are skipped.
+    """
+    relationship_ids = _parse_ids(relationship_ids)
+    with transaction.atomic():
+        # select_for_update() locks the rows so two concurrent submissions can't both accept them.
+        pending = list(
+            Relationship.objects.select_for_update()
+            .filter(id__in=relationship_ids, receiver=receiver_profile, status='sent')
+            .values_list('id', 'sender_id', 'sender__user_id')
+        )
+        if not pending:
+            return 0
+
+        Relationship.objects.filter(id__in=[rel_id for rel_id, _, _ in pending]).update(status='accepted')
+
+        # Both people get each other in their friends list: two rows per request in the
+        # M2M through table, written with one INSERT.
+        Friendship = Profile.friends.through
+        rows = []
+        pairs = []
+        for _, sender_profile_id, sender_user_id in pending:
+            rows.append(Friendship(profile_id=receiver_profile.id, user_id=sender_user_id))
+            rows.append(Friendship(profile_id=sender_profile_id, user_id=receiver_profile.user_id))
+            pairs.append((receiver_profile.user_id, sender_user_id))
+            pairs.append((sender_user_id, receiver_profile.user_id))
+        Friendship.objects.bulk_create(rows, ignore_conflicts=True)
+
+        # bulk_create skips the m2m_changed signal, so update the derived data directly.
+        friendships_changed('add', pairs)
+        events.notify_users('friend_accepted', [sender_user_id for _, _, sender_user_id in pending], {
+            'profile_id': receiver_profile.id, 'username': receiver_profile.user.username})
+    return len(pending)
@@ -0,0 +1,70 @@
+import contextvars
+import random
+
+from django.conf import settings
+
+# Sending reads to read replicas (settings.DATABASE_REPLICAS).
+#
+# Writes, and every read outside a request (workers, management commands), always use
+# the primary ('default'). ReplicaRoutingMiddleware (middleware.py) lets a request read
+# from a randomly chosen replica (the same one for all of its reads) only when it is a
+# GET/HEAD of one of the views in settings.REPLICA_READ_VIEWS, and none of the following hold:
+#
+#  - the request has already written something (its later reads must see the write);
+#  - the browser made a write (POST etc.) in the last settings.REPLICA_PIN_SECONDS
+#    seconds, recorded in the PIN_COOKIE cookie. Replicas lag the primary a little, and
+#    without this someone could post and then not find the post on their own feed.
+
+PIN_COOKIE = 'primary_pin'
+
+_routing = contextvars.ContextVar('db_routing', default=None)
+
+
+class Routing:
+    """Where the current request may read from. Shared by the middleware and the router."""
+
+    def __init__(self):
+        self.use_replica = False
+        self.wrote = False
+        # Picked on the first replica read and kept for the rest of the request, so all of
+        # a page's reads see the same point in time (replicas can lag by different amounts).
+        self.replica = None
+
+
+def begin():
+    """Start routing a request; returns its Routing and a token for end()."""
+    routing = Routing()
+    return routing, _routing.set(routing)
+
+
+def end(token):
+    _routing.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """Database router (settings.DATABASE_ROUTERS) for one primary and any number of replicas."""
+
+    def db_for_read(self, model, **hints):
+        routing = _routing.get()
+        if routing is None or not routing.use_replica or routing.wrote or not settings.DATABASE_REPLICAS:
+            return 'default'
+        if model._meta.app_label == 'sessions':
+            # A session that was just created (at login) may not have reached the replicas yet.
+            return 'default'
+        if routing.replica is None:
+            routing.replica = random.choice(settings.DATABASE_REPLICAS)
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        routing = _routing.get()
+        if routing is not None:
+            routing.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary, so objects may come from either.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema (and data) from the primary through replication.
+        return db == 'default'
@@ -0,0 +1,98 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import fulltext, graph, identity, jobs, relationships, tasks, versions
+from .models import Comment, Post, Profile, Relationship
+
+# Signal receivers are functions Django calls when something happens to a model.
+# They are connected in FeedappConfig.ready() (apps.py) by importing this module.
+
+
+@receiver(m2m_changed, sender=Profile.friends.through)
+def sync_timeline_with_friends(sender, instance, action, reverse, pk_set, **kwargs):
+    # Keep the materialized friends feed and the friend graph index in step with Profile.friends, no matter
+    # whether the change came from the friends view, the admin or the shell.
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if action == 'post_clear':
+        # A cleared friends list means an empty friends feed; clearing from the
+        # User side removes that user's posts from every timeline.
+        if reverse:
+            jobs.enqueue(tasks.prune_timeline, author_id=instance.id)
+        else:
+            jobs.enqueue(tasks.prune_timeline, owner_id=instance.user_id)
+        # Clears are rare; reloading the friend graph is simpler than working out the removed edges.
+        graph.invalidate()
+        # Only this user's cached friend ids are known to be stale; the other side's expire with the TTL.
+        identity.friends_changed([instance.id if reverse else instance.user_id])
+        return
+
+    # reverse=False: instance is a Profile and pk_set holds User ids (profile.friends.add(user)).
+    # reverse=True: instance is a User and pk_set holds Profile ids (user.friends.add(profile)).
+    if reverse:
+        pairs = [(owner_id, instance.id) for owner_id in
+                 Profile.objects.filter(id__in=pk_set).values_list('user_id', flat=True)]
+    else:
+        pairs = [(instance.user_id, author_id) for author_id in pk_set]
+
+    relationships.friendships_changed('add' if action == 'post_add' else 'remove', pairs)
+
+
+# Search documents (see fulltext.py): which model is indexed under which kind, and the
+# fields its text comes from. Saves that only touch other fields (counters, image
+# variants) leave the search index alone.
+SEARCHABLE = {
+    Post: ('post', {'description'}),
+    Comment: ('comment', {'text'}),
+    Profile: ('profile', {'first_name', 'last_name', 'bio'}),
+}
+
+
+def update_search_document(sender, instance, update_fields=None, **kwargs):
+    kind, fields = SEARCHABLE[sender]
+    if update_fields is not None and not fields & set(update_fields):
+        return
+    fulltext.index_object(kind, instance)
+
+
+def delete_search_document(sender, instance, **kwargs):
+    fulltext.remove_object(SEARCHABLE[sender][0], instance.pk)
+
+
+# Connected per model: a post_delete receiver without a sender would apply to every
+# model, and Django can't fast-delete (one DELETE, no rows loaded) a model that has one.
+for model in SEARCHABLE:
+    post_save.connect(update_search_document, sender=model)
+    post_delete.connect(delete_search_document, sender=model)
+
+
+@receiver([post_save, post_delete], sender=Profile)
+def forget_cached_profile(sender, instance, **kwargs):
+    # request.profile may come from a cache (identity.py); drop it when the profile changes.
+    identity.profile_changed(instance.user_id)
+    # The profile shows on the user's own pages and on the Friends pages of their friends
+    # and of everyone with a request from or to them.
+    versions.bump([instance.user_id])
+    versions.bump_friends_of([instance.user_id])
+    versions.bump_requests_of([instance.user_id])
+
+
+# Version stamps of the per-user pages (see versions.py). Likes, comments and timeline
+# changes bump them where they happen; these cover edits made anywhere, e.g. the admin.
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, **kwargs):
+    # A new post, an edit, or resized images being attached.
+    versions.bump_post_viewers([instance.id])
+
+
+@receiver(pre_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    # pre_delete: after the delete the post's timeline entries (its readers) are gone.
+    versions.bump_post_viewers([instance.id])
+
+
+@receiver([post_save, post_delete], sender=Relationship)
+def relationship_changed(sender, instance, **kwargs):
+    versions.bump(Profile.objects.filter(id__in=[instance.sender_id, instance.receiver_id]).values('user_id'))
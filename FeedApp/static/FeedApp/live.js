@@ -0,0 +1,115 @@
+// Live likes, comments and friend requests.
+//
+// Like buttons and the comment form call the JSON API (FeedApp/api.py), which answers
+// with the post's new counts instead of a whole page. When the server has the event
+// stream on (FeedApp/events.py), changes made by other people are pushed here too.
+// Without JavaScript the pages keep working through their normal form posts.
+(function () {
+    var script = document.currentScript;
+
+    function csrfToken() {
+        var input = document.querySelector('input[name=csrfmiddlewaretoken]');
+        return input ? input.value : '';
+    }
+
+    function post(url, data, method) {
+        return fetch(url, {
+            method: method || 'POST',
+            headers: {'X-CSRFToken': csrfToken()},
+            body: data ? new URLSearchParams(data) : undefined,
+            credentials: 'same-origin'
+        }).then(function (response) {
+            if (!response.ok) {
+                throw new Error(response.status);
+            }
+            return response.json();
+        });
+    }
+
+    // Rewrite every like/comment count shown for the post.
+    function setCounts(data) {
+        document.querySelectorAll('[data-like-count="' + data.post_id + '"]').forEach(function (el) {
+            el.textContent = data.like_count;
+        });
+        document.querySelectorAll('[data-comment-count="' + data.post_id + '"]').forEach(function (el) {
+            el.textContent = data.comment_count;
+        });
+    }
+
+    // Append a comment to the post's comment list, if it is on the page and not shown yet.
+    function addComment(comment) {
+        var form = document.querySelector('form[data-comments-for="' + comment.post_id + '"]');
+        if (!form || form.dataset.lastPage !== 'true' ||
+                form.querySelector('[data-comment-id="' + comment.id + '"]')) {
+            return;
+        }
+        var empty = form.querySelector('[data-no-comments]');
+        if (empty) {
+            empty.remove();
+        }
+        var item = document.createElement('li');
+        item.dataset.commentId = comment.id;
+        var text = document.createElement('p');
+        text.textContent = comment.text + ' -- ' + comment.author;
+        item.appendChild(text);
+        form.insertBefore(item, form.querySelector('[data-comment-input]'));
+    }
+
+    function notify(message) {
+        var notices = document.getElementById('live-notices');
+        if (!notices) {
+            return;
+        }
+        var alert = document.createElement('div');
+        alert.className = 'alert alert-info';
+        alert.textContent = message;
+        notices.appendChild(alert);
+    }
+
+    document.addEventListener('click', function (event) {
+        var button = event.target.closest('button[name=like]');
+        if (!button) {
+            return;
+        }
+        event.preventDefault();
+        post('/api/posts/' + button.value + '/like/').then(setCounts);
+    });
+
+    document.addEventListener('submit', function (event) {
+        var form = event.target;
+        if (!form.dataset.commentsFor) {
+            return;
+        }
+        event.preventDefault();
+        var input = form.querySelector('input[name=comment]');
+        if (!input.value.trim()) {
+            return;
+        }
+        post('/api/posts/' + form.dataset.commentsFor + '/comments/', {text: input.value}).then(function (data) {
+            input.value = '';
+            setCounts(data);
+            addComment(data.comment);
+        });
+    });
+
+    if (script.dataset.eventsUrl && window.EventSource) {
+        // The browser reconnects by itself, resuming after the last event it received.
+        var source = new EventSource(script.dataset.eventsUrl);
+        source.addEventListener('like', function (event) {
+            setCounts(JSON.parse(event.data));
+        });
+        source.addEventListener('comment', function (event) {
+            var data = JSON.parse(event.data);
+            setCounts(data);
+            if (data.comment) {
+                addComment(data.comment);
+            }
+        });
+        source.addEventListener('friend_request', function (event) {
+            notify(JSON.parse(event.data).username + ' sent you a friend request.');
+        });
+        source.addEventListener('friend_accepted', function (event) {
+            notify(JSON.parse(event.data).username + ' accepted your friend request.');
+        });
+    }
+})();
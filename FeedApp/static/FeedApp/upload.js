@@ -0,0 +1,138 @@
+// Chunked, resumable image uploads for the new post form.
+//
+// Images larger than the form's data-chunk-bytes are sent ahead of the form in chunks
+// (FeedApp/uploads.py), so a big photo on a slow connection doesn't need one long
+// request, and a dropped connection only costs the chunk that was in flight. The
+// upload's id is remembered in sessionStorage, so reloading the page and picking the
+// same file again carries on where it stopped. Once every chunk is in, the form is
+// submitted with the upload's id in place of the file. Smaller images, and browsers
+// without JavaScript, use the normal form post.
+(function () {
+    var form = document.querySelector('form[data-upload-url]');
+    if (!form || !window.fetch) {
+        return;
+    }
+    var input = form.querySelector('input[type=file][name=image]');
+    var uploadId = form.querySelector('input[name=upload_id]');
+    var progress = form.querySelector('[data-upload-progress]');
+    var chunkBytes = parseInt(form.dataset.chunkBytes, 10);
+    var maxRetries = 5;
+
+    function csrfToken() {
+        return form.querySelector('input[name=csrfmiddlewaretoken]').value;
+    }
+
+    function request(url, options) {
+        options.headers = Object.assign({'X-CSRFToken': csrfToken()}, options.headers || {});
+        options.credentials = 'same-origin';
+        return fetch(url, options).then(function (response) {
+            return response.json().catch(function () { return {}; }).then(function (data) {
+                data.status = response.status;
+                return data;
+            });
+        });
+    }
+
+    function sleep(ms) {
+        return new Promise(function (resolve) { setTimeout(resolve, ms); });
+    }
+
+    function show(text) {
+        if (progress) {
+            progress.textContent = text;
+        }
+    }
+
+    function storageKey(file) {
+        return 'upload:' + file.name + ':' + file.size + ':' + file.lastModified;
+    }
+
+    // The upload to continue: the one started earlier for this file, or a new one.
+    function start(file) {
+        var key = storageKey(file);
+        var saved = sessionStorage.getItem(key);
+        var resume = saved
+            ? request(saved, {method: 'GET'}).then(function (data) { return data.status === 200 ? data : null; })
+            : Promise.resolve(null);
+        return resume.then(function (data) {
+            if (data) {
+                return Object.assign(data, {url: saved});
+            }
+            return request(form.dataset.uploadUrl, {
+                method: 'POST',
+                body: new URLSearchParams({filename: file.name, size: file.size})
+            }).then(function (data) {
+                if (data.status !== 201) {
+                    throw new Error(data.error || 'The upload could not be started.');
+                }
+                data.url = form.dataset.uploadUrl + data.id + '/';
+                sessionStorage.setItem(key, data.url);
+                return data;
+            });
+        });
+    }
+
+    function sendChunks(file, upload, retries) {
+        if (upload.offset >= file.size) {
+            return Promise.resolve(upload);
+        }
+        show('Uploading… ' + Math.floor(100 * upload.offset / file.size) + '%');
+        var body = file.slice(upload.offset, upload.offset + upload.chunk_size);
+        return request(upload.url, {method: 'PATCH', headers: {'Upload-Offset': upload.offset}, body: body})
+            .then(function (data) {
+                if (data.status === 200) {
+                    return sendChunks(file, Object.assign(upload, {offset: data.offset}), maxRetries);
+                }
+                if (data.status === 409) {
+                    // The server has a different offset (e.g. a chunk arrived but its answer was lost).
+                    return sendChunks(file, Object.assign(upload, {offset: data.offset}), retries);
+                }
+                if (data.status >= 500 && retries > 0) {
+                    throw new Error('retry');
+                }
+                sessionStorage.removeItem(storageKey(file));
+                throw new Error(data.error || 'The upload failed.');
+            }, function () {
+                // Network error: ask the server how much it has and carry on from there.
+                if (retries <= 0) {
+                    throw new Error('The connection was lost. Submit again to resume the upload.');
+                }
+                return sleep(1000 * (maxRetries - retries + 1)).then(function () {
+                    return request(upload.url, {method: 'GET'});
+                }).then(function (data) {
+                    return sendChunks(file, Object.assign(upload, {offset: data.offset}), retries - 1);
+                }, function () {
+                    return sendChunks(file, upload, retries - 1);
+                });
+            })
+            .catch(function (error) {
+                if (error.message === 'retry') {
+                    return sleep(1000 * (maxRetries - retries + 1)).then(function () {
+                        return sendChunks(file, upload, retries - 1);
+                    });
+                }
+                throw error;
+            });
+    }
+
+    form.addEventListener('submit', function (event) {
+        var file = input && input.files[0];
+        if (!file || !uploadId || file.size <= chunkBytes) {
+            return;
+        }
+        event.preventDefault();
+        start(file)
+            .then(function (upload) { return sendChunks(file, upload, maxRetries); })
+            .then(function (upload) {
+                sessionStorage.removeItem(storageKey(file));
+                show('Upload complete.');
+                uploadId.value = upload.id;
+                // The image is on the server already; don't send it again with the form.
+                input.value = '';
+                form.submit();
+            })
+            .catch(function (error) {
+                show(error.message);
+            });
+    });
+})();
@@ -0,0 +1,48 @@
+from . import events, images, purge, ranking, timeline, uploads
+from .models import Post
+
+# Background tasks: functions the workers run for jobs created by FeedApp.jobs.enqueue().
+# They take ids rather than model objects (the payload is stored as JSON) and must be
+# safe to run more than once, because a job can be retried after a timeout.
+
+
+def fan_out_post(post_id):
+    # Copy a new post into its author's friends' timelines after new_post has returned.
+    post = Post.objects.filter(id=post_id).first()
+    if post is None:
+        # Deleted before the worker got to it; nothing left to do.
+        return
+    timeline.fan_out_post(post)
+
+
+def generate_image_variants(post_id):
+    # A separate job from fan_out_post, so an image that fails to process (and is retried)
+    # doesn't keep the post out of the timelines; until it succeeds, feeds show the original.
+    post = Post.objects.filter(id=post_id).first()
+    if post is None:
+        return
+    images.generate_variants(post)
+
+
+def backfill_timeline(owner_id, author_id):
+    timeline.backfill(owner_id, author_id)
+
+
+def prune_timeline(owner_id=None, author_id=None):
+    timeline.prune(owner_id, author_id)
+
+
+def prune_events():
+    events.prune()
+
+
+def rank_feeds(owner_ids=None):
+    ranking.rank_feeds(owner_ids)
+
+
+def prune_uploads():
+    uploads.prune()
+
+
+def purge_deleted():
+    purge.purge_deleted()
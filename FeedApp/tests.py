@@ -1,3 +1,797 @@
-from django.test import TestCase
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import warnings
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count
+from django.db.models.deletion import Collector
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, include, path
+from django.utils import timezone
+
+from FeedApp import (
+    archive, async_views, engagement, fulltext, graph, metrics, purge, ranking, relationships, routers, tasks, uploads, versions,
+)
+from FeedApp.db import insert_ignore
+from FeedApp.pagination import encode_cursor, paginate
+from FeedApp import urls as feed_urls
+from FeedApp.models import (
+    ArchivedComment, ArchivedLike, ArchivedPost, Comment, Event, Job, Like, Post, Profile, RankedEntry, Relationship,
+    TimelineEntry, Upload,
+)
+from users import urls as user_urls
+
+# Query-plan regression tests.
+#
+# Every view in FeedApp.urls and users.urls is requested against a seeded dataset
+# (`manage.py seed_benchmark`). The SQL each request runs is captured and EXPLAINed,
+# and the test fails when:
+#
+#  - a query reads one of the HOT_TABLES by scanning the whole table instead of through
+#    an index (SQLite "SCAN <table>" without an index, PostgreSQL "Seq Scan"), unless
+#    ALLOWED_SCANS lists it with the reason;
+#  - a view runs more queries than its entry in QUERY_BUDGETS.
+#
+# A new view needs an entry in CASES and QUERY_BUDGETS. When a change legitimately
+# needs more queries, raise the budget in the same commit, so reviewers see it.
+#
+# Run with `python manage.py test FeedApp`. Against PostgreSQL (DATABASE_URL), the
+# planner is told to avoid sequential scans while explaining, so a "Seq Scan" that is
+# left means no usable index exists.
+
+FRIENDSHIP = Profile.friends.through
+
+# Tables that grow with the number of users and are read on every page.
+HOT_TABLES = {model._meta.db_table for model in (
+    User, Profile, FRIENDSHIP, Relationship, Post, Comment, Like, TimelineEntry, RankedEntry,
+    ArchivedPost, ArchivedComment, Event,
+)}
+
+# (view, table): why a full scan there is expected.
+ALLOWED_SCANS = {
+}
+
+# The most queries each case may run, keyed like CASES.
+QUERY_BUDGETS = {
+    'FeedApp:index': 2,
+    'FeedApp:profile': 4,
+    'FeedApp:myfeed': 5,
+    'FeedApp:myfeed archive': 5,
+    'FeedApp:new_post': 2,
+    'FeedApp:new_post post': 10,
+    'FeedApp:upload_create': 3,
+    'FeedApp:upload_chunk': 3,
+    'FeedApp:comments': 4,
+    'FeedApp:friends': 10,
+    'FeedApp:friend_suggestions': 4,
+    'FeedApp:friendsfeed': 4,
+    'FeedApp:friendsfeed page 2': 4,
+    'FeedApp:friendsfeed archive': 5,
+    'FeedApp:friendsfeed top': 4,
+    'FeedApp:friendsfeed like': 10,
+    'FeedApp:search': 5,
+    'FeedApp:metrics': 2,
+    'FeedApp:events': 4,
+    'FeedApp:api_myfeed': 4,
+    'FeedApp:api_friendsfeed': 3,
+    'FeedApp:api_friendsfeed top': 3,
+    'FeedApp:api_posts': 3,
+    'FeedApp:api_like': 6,
+    'FeedApp:api_comments': 3,
+    'FeedApp:api_comments post': 12,
+    'FeedApp:api_profiles': 3,
+    'users:login': 2,
+    'users:logout': 4,
+    'users:password_change': 2,
+    'users:password_change_done': 2,
+    'users:password_reset': 2,
+    'users:password_reset_done': 2,
+    'users:password_reset_confirm': 3,
+    'users:password_reset_complete': 2,
+    'users:register': 2,
+    'users:register post': 11,
+}
+
+# Requests made for each view, as (label, method, path, data). Names in braces are
+# filled in from the seeded data (QueryPlanTests.values).
+CASES = {
+    'FeedApp:index': [('', 'get', '/', None)],
+    'FeedApp:profile': [('', 'get', '/profile/', None)],
+    'FeedApp:myfeed': [('', 'get', '/myfeed/', None),
+                       ('archive', 'get', '/myfeed/?cursor={myfeed_archive_cursor}', None)],
+    'FeedApp:new_post': [('', 'get', '/new_post/', None),
+                         ('post', 'post', '/new_post/', {'description': 'Query plan test'})],
+    'FeedApp:upload_create': [('', 'post', '/uploads/', {'filename': 'a.jpg', 'size': '1000'})],
+    'FeedApp:upload_chunk': [('', 'get', '/uploads/{upload}/', None)],
+    'FeedApp:comments': [('', 'get', '/comments/{friend_post}/', None)],
+    'FeedApp:friends': [('', 'get', '/friends/', None)],
+    'FeedApp:friend_suggestions': [('', 'get', '/friends/suggestions/', None)],
+    'FeedApp:friendsfeed': [('', 'get', '/friendsfeed/', None),
+                            ('page 2', 'get', '/friendsfeed/?cursor={friendsfeed_cursor}', None),
+                            ('archive', 'get', '/friendsfeed/?cursor={friendsfeed_archive_cursor}', None),
+                            ('top', 'get', '/friendsfeed/?order=top', None),
+                            ('like', 'post', '/friendsfeed/', {'like': '{friend_post}'})],
+    'FeedApp:search': [('', 'get', '/search/?q=coffee', None)],
+    'FeedApp:metrics': [('', 'get', '/metrics', None)],
+    'FeedApp:events': [('', 'get', '/events/', None)],
+    'FeedApp:api_myfeed': [('', 'get', '/api/myfeed/', None)],
+    'FeedApp:api_friendsfeed': [('', 'get', '/api/friendsfeed/', None),
+                                ('top', 'get', '/api/friendsfeed/?order=top', None)],
+    'FeedApp:api_posts': [('', 'get', '/api/posts/?ids={post},{friend_post}', None)],
+    'FeedApp:api_like': [('', 'post', '/api/posts/{friend_post}/like/', None)],
+    'FeedApp:api_comments': [('', 'get', '/api/posts/{friend_post}/comments/', None),
+                             ('post', 'post', '/api/posts/{friend_post}/comments/', {'text': 'Nice'})],
+    'FeedApp:api_profiles': [('', 'get', '/api/profiles/?ids=1,2,3', None)],
+    'users:login': [('', 'get', '/users/login/', None)],
+    'users:logout': [('', 'post', '/users/logout/', None)],
+    'users:password_change': [('', 'get', '/users/password_change/', None)],
+    'users:password_change_done': [('', 'get', '/users/password_change/done/', None)],
+    'users:password_reset': [('', 'get', '/users/password_reset/', None)],
+    'users:password_reset_done': [('', 'get', '/users/password_reset/done/', None)],
+    'users:password_reset_confirm': [('', 'get', '/users/reset/MQ/set-password/', None)],
+    'users:password_reset_complete': [('', 'get', '/users/reset/done/', None)],
+    'users:register': [('', 'get', '/users/register/', None),
+                       ('post', 'post', '/users/register/',
+                        {'username': 'newuser', 'password1': 'x9!kQ2#vLp', 'password2': 'x9!kQ2#vLp'})],
+}
+
+
+def url_names(patterns, namespace):
+    # Every named URL of a urls module, following include()s.
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from url_names(pattern.url_patterns, pattern.namespace or namespace)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            yield f'{namespace}:{pattern.name}'
+
+
+def explain(sql):
+    """The query plan of `sql` as a list of lines."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [row[-1] for row in cursor.fetchall()]
+        # Only fall back to a sequential scan when there is no index to use.
+        cursor.execute('SET enable_seqscan = off')
+        try:
+            cursor.execute('EXPLAIN ' + sql)
+            return [row[0] for row in cursor.fetchall()]
+        finally:
+            cursor.execute('RESET enable_seqscan')
+
+
+# SQLite: "SCAN <table or alias>" with no index after it. PostgreSQL: "Seq Scan on <table>".
+SQLITE_SCAN = re.compile(r'^SCAN (\w+)$')
+POSTGRES_SCAN = re.compile(r'Seq Scan on "?(\w+)"?')
+# Tables in FROM/JOIN clauses and the aliases Django gives them ("FeedApp_profile" T3).
+TABLE_ALIAS = re.compile(r'(?:FROM|JOIN)\s+"(\w+)"(?:\s+(?:AS\s+)?"?(T\d+)\b)?')
+
+
+def scanned_tables(sql, plan):
+    """The tables `plan` reads in full, without an index."""
+    if connection.vendor != 'sqlite':
+        return {match.group(1) for line in plan for match in [POSTGRES_SCAN.search(line)] if match}
+    # SQLite names an aliased table by its alias.
+    tables = {}
+    for table, alias in TABLE_ALIAS.findall(sql):
+        tables[table] = table
+        if alias:
+            tables[alias] = table
+    return {tables.get(match.group(1), match.group(1))
+            for line in plan for match in [SQLITE_SCAN.match(line.strip())] if match}
+
+
+@override_settings(
+    JOBS_RUN_INLINE=True,
+    RANKED_FEED=True,
+    EVENTS_STREAM=True, EVENTS_STREAM_TIMEOUT=0.01, EVENTS_POLL_INTERVAL=0.01,
+    DATABASE_ROUTERS=[],
+)
+class QueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_benchmark', users=200, posts_per_user=10, friends_per_user=10, stdout=StringIO())
+        # Move the oldest posts to the archive, so deep feed pages read it too.
+        call_command('archive_posts', older_than=300, stdout=StringIO())
+        ranking.rank_feeds()
+        # Let the planner see the table sizes, as it would in production.
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        # Test from the point of view of the user with the most friends (staff, to see /metrics).
+        cls.user = User.objects.annotate(n_friends=Count('friends')).order_by('-n_friends').first()
+        cls.user.is_staff = True
+        cls.user.save()
+        # Every case runs with the user's FeedVersion row in place, whichever page comes first.
+        versions.stamp(cls.user)
+        friend_ids = list(FRIENDSHIP.objects.filter(profile__user=cls.user).values_list('user_id', flat=True))
+        timeline = TimelineEntry.objects.filter(owner=cls.user)
+        oldest_entry = timeline.order_by('date_posted', 'id').first()
+        oldest_post = Post.objects.filter(username=cls.user).order_by('date_posted', 'id').first()
+        cls.values = {
+            'post': Post.objects.filter(username=cls.user).values_list('id', flat=True).first(),
+            'friend_post': Post.objects.filter(username_id__in=friend_ids).order_by('-comment_count')
+                           .values_list('id', flat=True).first(),
+            'upload': Upload.objects.create(user=cls.user, filename='a.jpg', size=1000).id,
+            'friendsfeed_cursor': paginate(timeline)[1],
+            # Past the last live row, where the feeds continue into the archive.
+            'friendsfeed_archive_cursor': encode_cursor(oldest_entry.date_posted, oldest_entry.id),
+            'myfeed_archive_cursor': encode_cursor(oldest_post.date_posted, oldest_post.id),
+        }
+
+    def setUp(self):
+        # The upload views write partial files; keep them out of MEDIA_ROOT.
+        self.enterContext(override_settings(UPLOAD_TEMP_DIR=self.enterContext(tempfile.TemporaryDirectory())))
+        caches['default'].clear()
+        # The friend graph is loaded once per process and then kept (graph.py); start from a loaded one.
+        graph.invalidate()
+        graph.get_graph()
+
+    def request(self, method, url, data):
+        # Logged in afresh for each request (one of them logs out).
+        self.client.force_login(self.user)
+        url = url.format(**self.values)
+        if data:
+            data = {key: value.format(**self.values) for key, value in data.items()}
+        with CaptureQueriesContext(connection) as captured:
+            with warnings.catch_warnings():
+                # The test client reads the async event stream synchronously.
+                warnings.simplefilter('ignore')
+                response = getattr(self.client, method)(url, data)
+                if response.streaming:
+                    b''.join(response)
+        return response, [query['sql'] for query in captured.captured_queries]
+
+    def test_every_view_has_a_case_and_budget(self):
+        names = set(url_names(feed_urls.urlpatterns, 'FeedApp')) | set(url_names(user_urls.urlpatterns, 'users'))
+        self.assertEqual(names - set(CASES), set(), "Views without a case in CASES")
+        keys = {f'{name} {label}'.strip() for name, cases in CASES.items() for label, *_ in cases}
+        self.assertEqual(keys ^ set(QUERY_BUDGETS), set(), "CASES and QUERY_BUDGETS don't match")
+
+    def test_query_plans_and_budgets(self):
+        for name, cases in CASES.items():
+            for label, method, url, data in cases:
+                key = f'{name} {label}'.strip()
+                with self.subTest(key):
+                    response, queries = self.request(method, url, data)
+                    self.assertLess(response.status_code, 500)
+                    self.assertLessEqual(len(queries), QUERY_BUDGETS.get(key, 0),
+                                         f"{key} ran {len(queries)} queries:\n" + '\n'.join(queries))
+                    for sql in queries:
+                        if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'WITH')):
+                            continue
+                        plan = explain(sql)
+                        for table in scanned_tables(sql, plan) & HOT_TABLES:
+                            if (name, table) not in ALLOWED_SCANS:
+                                self.fail(f"{key} scans {table}:\n{sql}\n" + '\n'.join(plan))
+
+
+# Feature tests.
+
+
+@override_settings(JOBS_RUN_INLINE=True)
+class TimelineTests(TestCase):
+    def setUp(self):
+        self.author, self.reader, self.stranger = (User.objects.create_user(name)
+                                                   for name in ('author', 'reader', 'stranger'))
+        self.profile = Profile.objects.create(user=self.reader)
+        self.profile.friends.add(self.author)
+
+    def test_new_post_is_written_to_friends_timelines(self):
+        self.client.force_login(self.author)
+        self.client.post('/new_post/', {'description': 'hello friends'})
+
+        post = Post.objects.get()
+        self.assertEqual(list(TimelineEntry.objects.filter(post=post).values_list('owner_id', flat=True)),
+                         [self.reader.id])
+        self.client.force_login(self.reader)
+        self.assertContains(self.client.get('/friendsfeed/'), 'hello friends')
+
+    def test_new_friend_is_backfilled_and_pruned_again(self):
+        mine = Post.objects.create(username=self.author, description='by author')
+        tasks.fan_out_post(mine.id)
+        theirs = Post.objects.create(username=self.stranger, description='by stranger')
+        timeline = TimelineEntry.objects.filter(owner=self.reader)
+
+        # Posts from before the friendship are copied in...
+        self.profile.friends.add(self.stranger)
+        self.assertEqual(set(timeline.values_list('post_id', flat=True)), {mine.id, theirs.id})
+
+        # ...and only that friend's posts are taken out again.
+        self.profile.friends.remove(self.stranger)
+        self.assertEqual(set(timeline.values_list('post_id', flat=True)), {mine.id})
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('author')
+        now = timezone.now()
+        # Newest first: two posts stay in the hot table, three are archived.
+        self.post_ids = []
+        for days in (1, 2, 400, 401, 402):
+            post = Post.objects.create(username=self.user, description=f'{days} days old')
+            Post.objects.filter(id=post.id).update(date_posted=now - timedelta(days=days))
+            self.post_ids.append(post.id)
+        archive.archive_older_than(now - timedelta(days=300))
+
+    def test_pages_continue_from_the_hot_table_into_the_archive(self):
+        self.client.force_login(self.user)
+        # Pages of three: the first ends inside the archive, the second starts there.
+        seen, cursor = [], ''
+        for _ in range(3):
+            page = self.client.get(f'/api/myfeed/?fields=id&limit=3&cursor={cursor}').json()
+            seen += [post['id'] for post in page['posts']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(seen, self.post_ids)
+        self.assertIsNone(cursor)
+
+    def test_posts_with_the_same_date_are_not_skipped(self):
+        # The cursor holds the id too, so a page boundary between equal dates loses nothing.
+        posts = Post.objects.filter(username=self.user)
+        for _ in range(3):
+            Post.objects.create(username=self.user, description='same time')
+        posts.update(date_posted=timezone.now())
+
+        first, cursor = paginate(posts, page_size=2)
+        rest, _ = paginate(posts, cursor, page_size=10)
+        self.assertEqual([post.id for post in first + rest], sorted(posts.values_list('id', flat=True), reverse=True))
+
+
+class CounterTests(TestCase):
+    def setUp(self):
+        self.author, self.reader = User.objects.create_user('author'), User.objects.create_user('reader')
+        self.post = Post.objects.create(username=self.author, description='counted')
+
+    def counts(self):
+        return Post.objects.filter(id=self.post.id).values_list('like_count', 'comment_count').get()
+
+    def test_likes_and_comments_move_the_counters(self):
+        self.assertTrue(engagement.add_like(self.reader, self.post.id))
+        self.assertFalse(engagement.add_like(self.reader, self.post.id))
+        comment = engagement.add_comment(self.reader, self.post.id, 'first')
+        engagement.add_comment(self.author, self.post.id, 'second')
+        self.assertEqual(self.counts(), (1, 2))
+
+        engagement.remove_like(self.reader, self.post.id)
+        engagement.delete_comment(comment)
+        self.assertEqual(self.counts(), (0, 1))
+
+    def test_reconcile_counters_repairs_drift(self):
+        engagement.add_like(self.reader, self.post.id)
+        engagement.add_comment(self.reader, self.post.id, 'a comment')
+        Post.objects.filter(id=self.post.id).update(like_count=7, comment_count=0)
+        untouched = Post.objects.create(username=self.author, description='right')
+
+        out = StringIO()
+        call_command('reconcile_counters', batch_size=1, stdout=out)
+
+        self.assertEqual(self.counts(), (1, 1))
+        self.assertIn('Checked 2 posts, repaired 1.', out.getvalue())
+        self.assertEqual(Post.objects.get(id=untouched.id).version, untouched.version)
+
+
+class ConstraintTests(TestCase):
+    def setUp(self):
+        self.author, self.reader = User.objects.create_user('author'), User.objects.create_user('reader')
+        self.post = Post.objects.create(username=self.author, description='liked')
+
+    def test_duplicate_rows_are_refused(self):
+        Like.objects.create(username=self.reader, post=self.post)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Like.objects.create(username=self.reader, post=self.post)
+
+    def test_insert_ignore_counts_only_new_rows(self):
+        self.assertEqual(insert_ignore(Like, [Like(username=self.reader, post=self.post)]), 1)
+        self.assertEqual(insert_ignore(Like, [Like(username=self.reader, post=self.post),
+                                              Like(username=self.author, post=self.post)]), 1)
+        self.assertEqual(Like.objects.count(), 2)
+
+    def test_repeated_friend_requests_create_one_relationship(self):
+        sender, receiver = Profile.objects.create(user=self.reader), Profile.objects.create(user=self.author)
+        self.assertEqual(relationships.send_requests(sender, [receiver.id]), 1)
+        self.assertEqual(relationships.send_requests(sender, [receiver.id]), 0)
+        self.assertEqual(Relationship.objects.count(), 1)
+
+
+class APITests(TestCase):
+    def setUp(self):
+        self.author, self.reader = User.objects.create_user('author'), User.objects.create_user('reader')
+        self.posts = [Post.objects.create(username=self.author, description=f'post {i}') for i in range(3)]
+        self.client.force_login(self.reader)
+
+    def test_batch_fetch_keeps_the_requested_order_and_fields(self):
+        first, second, third = (post.id for post in self.posts)
+        response = self.client.get(f'/api/posts/?ids={third},{first},{third},0&fields=id,author').json()
+        self.assertEqual(response, {'posts': [{'id': third, 'author': 'author'}, {'id': first, 'author': 'author'}],
+                                    'missing': [0]})
+
+    def test_bad_parameters_are_reported_as_json(self):
+        for url in ('/api/posts/?ids=1&fields=id,password', '/api/posts/?ids=a,b', '/api/posts/',
+                    '/api/posts/?ids=' + ','.join(str(n) for n in range(101))):
+            with self.subTest(url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+    def test_like_and_comment_answer_with_the_new_counts(self):
+        post = self.posts[0]
+        response = self.client.post(f'/api/posts/{post.id}/like/').json()
+        self.assertEqual((response['like_count'], response['changed']), (1, True))
+        response = self.client.post(f'/api/posts/{post.id}/comments/', {'text': 'nice'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.json()['comment_count'], response.json()['comment']['text']), (1, 'nice'))
+        self.assertEqual(self.client.post('/api/posts/0/like/').status_code, 404)
+
+
+# Regression tests for specific bugs.
+
+
+class RankingTests(TestCase):
+    def test_affinity_ignores_authors_outside_the_candidates(self):
+        # Readers a and b both see a post by f. a has liked posts by x, who isn't among the
+        # candidates and has a higher id: (a, x) must not be mistaken for (b, f).
+        a, b, f = (User.objects.create_user(name) for name in ('a', 'b', 'f'))
+        # The id at which (a, x) would share a pair key with (b, f) if the key width only
+        # covered the candidates' ids.
+        colliding_id = (b.id - a.id) * (max(a.id, b.id, f.id) + 1) + f.id
+        x = User.objects.create_user('x')
+        while x.id < colliding_id:
+            x = User.objects.create_user(f'x{x.id}')
+        post = Post.objects.create(username=f, description='by f')
+        for reader in (a, b):
+            TimelineEntry.objects.create(owner=reader, post=post, date_posted=post.date_posted)
+        for i in range(5):
+            Like.objects.create(username=a, post=Post.objects.create(username=x, description=f'by x {i}'))
+
+        ranking.rank_feeds([a.id, b.id])
+
+        scores = dict(RankedEntry.objects.filter(post=post).values_list('owner_id', 'score'))
+        self.assertEqual(scores[a.id], scores[b.id])
+
+
+class AsyncFeedURLConf:
+    # The site's URLs with the feed pages served by their async views, as under ASGI
+    # (FeedApp.urls picks one or the other when it is imported).
+    urlpatterns = [
+        path('', include(([path(str(pattern.pattern), getattr(async_views, pattern.name), name=pattern.name)
+                           if pattern.name in ('myfeed', 'friendsfeed', 'comments') else pattern
+                           for pattern in feed_urls.urlpatterns], 'FeedApp'))),
+        path('users/', include('users.urls')),
+    ]
+
+
+@override_settings(ROOT_URLCONF=AsyncFeedURLConf)
+class QueryMetricsTests(TestCase):
+    def queries_recorded(self, view):
+        series = metrics.snapshot()['histograms']['prism_view_queries'].get(view)
+        return series['sum'] if series else 0
+
+    async def test_async_views_count_their_queries(self):
+        # The async ORM runs its queries on other threads, with their own connections.
+        user = await User.objects.acreate(username='a')
+        await self.async_client.aforce_login(user)
+        before = self.queries_recorded('FeedApp:myfeed')
+        response = await self.async_client.get('/myfeed/')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(self.queries_recorded('FeedApp:myfeed'), before)
+
+
+class MetricsFileTests(TestCase):
+    def test_files_of_exited_workers_are_dropped(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        worker = subprocess.Popen([sys.executable, '-c', ''])
+        worker.wait()
+        for pid in (worker.pid, os.getppid()):
+            with open(os.path.join(directory, f'{pid}.json'), 'w') as f:
+                json.dump({'histograms': {}, 'counters': {'prism_fragment_cache_hits_total': {'row': 1}}}, f)
+
+        with override_settings(METRICS_DIR=directory):
+            _, counters = metrics._merged()
+
+        own = metrics.snapshot()['counters']['prism_fragment_cache_hits_total'].get('row', 0)
+        self.assertEqual(counters['prism_fragment_cache_hits_total']['row'], own + 1)
+        self.assertEqual(os.listdir(directory), [f'{os.getppid()}.json'])
+
+
+class PageVersionTests(TestCase):
+    def test_profile_edit_changes_friends_and_requesters_pages(self):
+        owner, friend, requester = (User.objects.create_user(name) for name in ('owner', 'friend', 'requester'))
+        profiles = {user: Profile.objects.create(user=user) for user in (owner, friend, requester)}
+        profiles[friend].friends.add(owner)
+        Relationship.objects.create(sender=profiles[requester], receiver=profiles[owner])
+        before = {user: versions.stamp(user)[0] for user in (friend, requester)}
+
+        profiles[owner].bio = 'new bio'
+        profiles[owner].save()
+
+        for user in (friend, requester):
+            self.assertGreater(versions.stamp(user)[0], before[user], user.username)
+
+
+@override_settings(JOBS_RUN_INLINE=False, PURGE_DELAY=0)
+class SoftDeleteTests(TestCase):
+    def setUp(self):
+        self.author, self.reader = User.objects.create_user('author'), User.objects.create_user('reader')
+        self.post = Post.objects.create(username=self.author, description='gone soon')
+        engagement.add_comment(self.reader, self.post.id, 'a comment')
+        purge.delete_posts([self.post.id])
+
+    def test_deleted_post_comments_are_not_served(self):
+        self.client.force_login(self.reader)
+        self.assertEqual(self.client.get(f'/api/posts/{self.post.id}/comments/').status_code, 404)
+
+    def test_deleted_post_refuses_likes_and_comments(self):
+        self.assertFalse(engagement.add_like(self.reader, self.post.id))
+        self.assertFalse(Like.objects.filter(post_id=self.post.id).exists())
+        with self.assertRaises(Post.DoesNotExist):
+            engagement.add_comment(self.reader, self.post.id, 'too late')
+        self.assertEqual(Comment.objects.filter(post_id=self.post.id).count(), 1)
+
+    def test_interrupted_account_purge_is_picked_up_again(self):
+        purge.delete_account(self.author)
+        # A purge that stopped after the batched pass over the account's dependents.
+        purge._delete_dependents(User, [self.author.id], batch_size=10, final=False)
+        self.assertTrue(Profile.all_objects.filter(user=self.author).exists())
+
+        self.assertEqual(purge.purge_deleted(), (1, 0))
+        self.assertFalse(User.objects.filter(id=self.author.id).exists())
+
+    def test_purged_account_takes_its_engagement_off_other_posts(self):
+        other = Post.objects.create(username=self.reader, description='stays')
+        engagement.add_like(self.author, other.id)
+        engagement.add_comment(self.author, other.id, 'by the author')
+        reader_profile = Profile.objects.create(user=self.reader)
+        reader_profile.friends.add(self.author)
+        tasks.fan_out_post(Post.objects.create(username=self.author, description='in the timeline').id)
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.reader).exists())
+
+        purge.delete_account(self.author)
+        purge.purge_deleted(batch_size=1)
+
+        self.assertFalse(User.objects.filter(id=self.author.id).exists())
+        self.assertFalse(Post.all_objects.filter(username_id=self.author.id).exists())
+        self.assertFalse(TimelineEntry.objects.exists() or reader_profile.friends.exists())
+        other.refresh_from_db()
+        self.assertEqual((other.like_count, other.comment_count), (0, 0))
+        self.assertEqual(Comment.objects.filter(post=other).count(), 0)
+
+    def test_admin_restores_hidden_posts_until_purged(self):
+        admin = User.objects.create_superuser('admin')
+        self.client.force_login(admin)
+        TimelineEntry.objects.create(owner=self.reader, post_id=self.post.id, date_posted=self.post.date_posted)
+        before = versions.stamp(self.reader)[0]
+
+        with override_settings(PURGE_DELAY=60):
+            self.assertEqual(purge.purge_deleted(), (0, 0))
+        self.client.post('/admin/FeedApp/post/', {'action': 'restore_selected', '_selected_action': [self.post.id]})
+
+        self.assertTrue(Post.objects.filter(id=self.post.id).exists())
+        self.assertGreater(versions.stamp(self.reader)[0], before)
+        self.assertEqual(purge.purge_deleted(), (0, 0))
+
+    def test_restored_account_brings_back_the_posts_hidden_with_it(self):
+        kept = Post.objects.create(username=self.author, description='kept')
+        purge.delete_account(self.author)
+
+        self.assertTrue(purge.restore_account(self.author))
+
+        self.assertTrue(User.objects.get(id=self.author.id).is_active)
+        self.assertTrue(Profile.objects.filter(user=self.author).exists())
+        # self.post was deleted on its own before the account, and stays deleted.
+        self.assertEqual(list(Post.objects.filter(username=self.author)), [kept])
+
+
+class SearchIndexTests(TestCase):
+    def found(self, query):
+        return [(kind, obj.pk) for kind, obj, _ in fulltext.search(query)[0]]
+
+    def test_index_follows_saves_and_deletes(self):
+        user = User.objects.create_user('author')
+        post = Post.objects.create(username=user, description='walrus sighting')
+        comment = engagement.add_comment(user, post.id, 'a walrus indeed')
+        profile = Profile.objects.create(user=user, bio='walrus watcher')
+        self.assertEqual(set(self.found('walrus')), {('post', post.id), ('comment', comment.id), ('profile', profile.id)})
+
+        post.description = 'seal sighting'
+        post.save()
+        comment.delete()
+        self.assertEqual(self.found('walrus'), [('profile', profile.id)])
+        self.assertEqual(self.found('seal'), [('post', post.id)])
+
+    def test_unindexed_models_are_fast_deleted(self):
+        # Timeline entries, events and the like are deleted in bulk; a signal receiver on
+        # them would make every such DELETE load the rows first.
+        for model in (TimelineEntry, Event, Like, RankedEntry, Job):
+            with self.subTest(model.__name__):
+                self.assertTrue(Collector(using='default').can_fast_delete(model.objects.all()))
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+        self.old = Post.objects.create(username=self.author, description='old')
+        Post.objects.filter(id=self.old.id).update(date_posted=timezone.now() - timedelta(days=400))
+        engagement.add_like(self.author, self.old.id)
+        self.comment = engagement.add_comment(self.author, self.old.id, 'an old comment')
+        self.new = Post.objects.create(username=self.author, description='new')
+        archive.archive_older_than(timezone.now() - timedelta(days=300))
+
+    def test_archived_post_keeps_its_id_counts_comments_and_likes(self):
+        archived = ArchivedPost.objects.get(id=self.old.id)
+        self.assertEqual((archived.description, archived.like_count, archived.comment_count), ('old', 1, 1))
+        self.assertEqual(list(ArchivedComment.objects.values_list('id', 'text')), [(self.comment.id, 'an old comment')])
+        self.assertTrue(ArchivedLike.objects.filter(post=archived, username=self.author).exists())
+        self.assertEqual(list(Post.objects.values_list('id', flat=True)), [self.new.id])
+        self.assertFalse(Comment.objects.exists() or Like.objects.exists())
+
+    def test_archived_post_is_still_shown_but_read_only(self):
+        self.client.force_login(self.author)
+        self.assertContains(self.client.get(f'/comments/{self.old.id}/'), 'an old comment')
+        self.assertEqual(self.client.post(f'/api/posts/{self.old.id}/like/').status_code, 404)
+        self.client.post(f'/comments/{self.old.id}/', {'btn1': '1', 'comment': 'too late'})
+        self.assertEqual(ArchivedComment.objects.count(), 1)
+
+    def test_batch_fetch_includes_archived_posts(self):
+        self.client.force_login(self.author)
+        response = self.client.get(f'/api/posts/?ids={self.old.id},{self.new.id},0&fields=id,description').json()
+        self.assertEqual(response['posts'], [{'id': self.old.id, 'description': 'old'},
+                                             {'id': self.new.id, 'description': 'new'}])
+        self.assertEqual(response['missing'], [0])
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2', 'replica3'])
+class ReplicaRoutingTests(TestCase):
+    def test_a_request_reads_from_one_replica(self):
+        router = routers.PrimaryReplicaRouter()
+        routing, token = routers.begin()
+        try:
+            routing.use_replica = True
+            chosen = {router.db_for_read(model) for model in (Post, Comment, Profile) for _ in range(20)}
+        finally:
+            routers.end(token)
+        self.assertEqual(len(chosen), 1)
+
+
+class FriendGraphTests(TestCase):
+    def setUp(self):
+        graph.invalidate()
+        self.addCleanup(graph.invalidate)
+
+    def test_compaction_leaves_readers_graph_alone(self):
+        old = graph.get_graph()
+        graph.apply_change('add', [(1, n) for n in range(2, graph.COMPACT_THRESHOLD + 3)])
+        new = graph.get_graph()
+        self.assertIsNot(new, old)
+        self.assertEqual(len(new.neighbors(1)), graph.COMPACT_THRESHOLD + 1)
+        self.assertFalse(new.added)
+        # The graph a request already holds is unchanged apart from its overlays.
+        self.assertEqual(len(old.indices), 0)
+
+    def test_stale_graph_is_served_while_reloading(self):
+        old = graph.get_graph()
+        with override_settings(FRIEND_GRAPH_MAX_AGE=-1):
+            # Another request is already reloading: this one gets the old graph at once.
+            graph._refreshing = True
+            try:
+                with self.assertNumQueries(0):
+                    self.assertIs(graph.get_graph(), old)
+            finally:
+                graph._refreshing = False
+
+            # A friendship committed while the table is being read is replayed onto the new graph.
+            load = graph.FriendGraph.from_database
+
+            def load_during_change():
+                loaded = load()
+                graph.apply_change('add', [(1, 2)])
+                return loaded
+
+            with mock.patch.object(graph.FriendGraph, 'from_database', load_during_change):
+                new = graph.get_graph()
+        self.assertIsNot(new, old)
+        self.assertIs(graph._graph, new)
+        self.assertEqual(new.neighbors(1), {2})
+
+
+class MediaTests(TestCase):
+    def setUp(self):
+        media_root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(MEDIA_ROOT=media_root, MEDIA_ACCEL_REDIRECT=None))
+        os.makedirs(os.path.join(media_root, 'images'))
+        with open(os.path.join(media_root, 'images', 'a photo é.jpg'), 'wb') as file:
+            file.write(bytes(range(100)))
+        self.url = '/media/images/a%20photo%20%C3%A9.jpg'
+
+    def test_head_mirrors_ranged_get(self):
+        get = self.client.get(self.url, headers={'Range': 'bytes=10-19'})
+        head = self.client.head(self.url, headers={'Range': 'bytes=10-19'})
+        self.assertEqual(b''.join(get.streaming_content), bytes(range(10, 20)))
+        for response in (get, head):
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+            self.assertEqual(response['Content-Length'], '10')
+
+    def test_accel_redirect_is_quoted(self):
+        with override_settings(MEDIA_ACCEL_REDIRECT='/protected/'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/images/a%20photo%20%C3%A9.jpg')
+
+    def test_only_images_are_displayed_inline(self):
+        with open(os.path.join(settings.MEDIA_ROOT, 'images', 'evil.html'), 'wb') as file:
+            file.write(b'<script>alert(document.cookie)</script>')
+        image = self.client.get(self.url)
+        page = self.client.get('/media/images/evil.html')
+        self.assertEqual(image['Content-Type'], 'image/jpeg')
+        self.assertFalse(image.get('Content-Disposition', '').startswith('attachment'))
+        self.assertEqual(page['Content-Type'], 'application/octet-stream')
+        self.assertEqual(page['Content-Disposition'], 'attachment')
+
+
+# The smallest GIF, followed by markup that a browser would run if it were served as HTML.
+GIF = (b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00'
+       b',\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;')
+POLYGLOT = GIF + b'<script>alert(document.cookie)</script>'
+
+
+class UploadTests(TestCase):
+    def setUp(self):
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory()),
+                                            UPLOAD_TEMP_DIR=self.enterContext(tempfile.TemporaryDirectory())))
+        self.user = User.objects.create_user('uploader')
+        self.client.force_login(self.user)
+
+    def test_chunked_upload_is_stored_under_its_image_format(self):
+        upload = self.client.post('/uploads/', {'filename': 'evil.html', 'size': len(POLYGLOT)}).json()
+        self.patch(upload['id'], 0, POLYGLOT)
+        post = Post(username=self.user)
+
+        uploads.attach(post, self.user, upload['id'])
+
+        self.assertEqual(post.image.name, 'images/evil.gif')
+
+    def patch(self, upload_id, offset, data):
+        return self.client.generic('PATCH', f'/uploads/{upload_id}/', data, headers={'Upload-Offset': str(offset)})
+
+    @override_settings(UPLOAD_CHUNK_BYTES=32)
+    def test_chunked_upload_resumes_from_the_server_offset(self):
+        upload_id = self.client.post('/uploads/', {'filename': 'a.gif', 'size': len(POLYGLOT)}).json()['id']
+        self.assertEqual(self.patch(upload_id, 0, POLYGLOT[:32]).json()['offset'], 32)
+
+        # The same chunk again (the client never saw the answer): refused, with where to go on from.
+        response = self.patch(upload_id, 0, POLYGLOT[:32])
+        self.assertEqual((response.status_code, response.json()['offset']), (409, 32))
+        self.assertEqual(self.patch(upload_id, 32, POLYGLOT[32:]).status_code, 413)
+
+        offset = self.client.get(f'/uploads/{upload_id}/').json()['offset']
+        while offset < len(POLYGLOT):
+            state = self.patch(upload_id, offset, POLYGLOT[offset:offset + 32]).json()
+            offset = state['offset']
+        self.assertTrue(state['complete'])
+        with open(uploads.partial_path(upload_id), 'rb') as file:
+            self.assertEqual(file.read(), POLYGLOT)
+
+    @override_settings(UPLOAD_MAX_BYTES=1024)
+    def test_oversized_post_is_refused_before_the_csrf_check(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        client.get('/new_post/')
+        image = SimpleUploadedFile('big.gif', GIF + bytes(uploads.FORM_OVERHEAD + 2048))
+        response = client.post('/new_post/', {'csrfmiddlewaretoken': client.cookies['csrftoken'].value,
+                                              'description': 'too big', 'image': image})
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(Post.objects.exists())
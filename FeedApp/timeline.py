@@ -0,0 +1,45 @@
+from . import versions
+from .models import Post, Profile, TimelineEntry
+
+# This file keeps the materialized friends feed (TimelineEntry rows) in sync.
+# The friends feed only ever reads these rows; everything that changes who can
+# see which post calls one of the functions below.
+
+# Number of rows inserted per INSERT statement when writing timeline entries.
+BATCH_SIZE = 500
+
+
+def fan_out_post(post):
+    """Copy a new post into the timeline of every user who has its author as a friend."""
+    # Profile.friends holds the users a profile's owner is friends with, so the
+    # readers of this post are the owners of the profiles that list its author.
+    reader_ids = Profile.objects.filter(friends=post.username_id).values_list('user_id', flat=True)
+    entries = [
+        TimelineEntry(owner_id=reader_id, post_id=post.id, date_posted=post.date_posted)
+        for reader_id in reader_ids
+    ]
+    # ignore_conflicts makes the write safe to repeat (e.g. a retried request).
+    TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    versions.bump(reader_ids)
+
+
+def backfill(owner_id, author_id):
+    """Add every existing post by author_id to owner_id's timeline (called when they become friends)."""
+    posts = Post.objects.filter(username_id=author_id).values_list('id', 'date_posted')
+    entries = [
+        TimelineEntry(owner_id=owner_id, post_id=post_id, date_posted=date_posted)
+        for post_id, date_posted in posts.iterator()
+    ]
+    TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    versions.bump([owner_id])
+
+
+def prune(owner_id=None, author_id=None):
+    """Remove author_id's posts from owner_id's timeline; a None argument matches everyone."""
+    entries = TimelineEntry.objects.all()
+    if owner_id is not None:
+        entries = entries.filter(owner_id=owner_id)
+    if author_id is not None:
+        entries = entries.filter(post__username_id=author_id)
+    versions.bump(entries.values('owner_id'))
+    entries.delete()
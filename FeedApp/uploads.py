@@ -0,0 +1,279 @@
+import io
+import os
+import time
+import warnings
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.core.files import File
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.views.decorators.http import require_http_methods
+from PIL import Image
+
+from . import jobs, tasks
+from .models import Upload
+
+# Image uploads.
+#
+# A request whose Content-Length is already over the limit is refused with a 413 before
+# any of the body is read (middleware.UploadLimitMiddleware). Otherwise
+# ImageUploadHandler (settings.FILE_UPLOAD_HANDLERS) runs first for every multipart
+# request and checks the file while it streams in:
+#
+#  - the first bytes must be the header of an allowed image type, and the dimensions it
+#    declares are checked against settings.UPLOAD_MAX_PIXELS. Only the header is parsed,
+#    so a decompression bomb is rejected without decoding a single pixel;
+#  - the upload stops as soon as it goes over settings.UPLOAD_MAX_BYTES.
+#
+# A rejected upload stops the request there (the rest of the body is never read) and
+# leaves the reason in request.upload_error for the view to show.
+#
+# Large files can instead be sent in chunks of settings.UPLOAD_CHUNK_BYTES through the
+# views at the bottom (used by static/FeedApp/upload.js). Each chunk is a short
+# request, so a slow client never holds a worker for the whole transfer, and an
+# interrupted upload resumes from the last chunk that arrived:
+#
+#   POST   /uploads/       filename=..., size=...  -> {"id", "offset", "chunk_size"}
+#   PATCH  /uploads/<id>/  Upload-Offset: N, body = the next chunk -> {"offset", "complete"}
+#   GET    /uploads/<id>/  -> {"offset", ...}, to find where to resume
+#   DELETE /uploads/<id>/  cancel
+#
+# The finished upload's id is then sent as `upload_id` with the new post form (see attach()).
+
+# How much of a file may be read looking for its image header (JPEG headers can sit
+# behind large EXIF blocks).
+HEADER_BYTES = 256 * 1024
+# Room for the other form fields and multipart boundaries in a request carrying an image.
+FORM_OVERHEAD = 64 * 1024
+# The extension a stored image gets for the format Pillow found in it.
+EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'GIF': '.gif', 'WEBP': '.webp'}
+
+
+class UploadRejected(Exception):
+    """The upload is not an acceptable image. args[0] is the message; status is the HTTP status."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def too_large():
+    return UploadRejected(f"Images may be at most {settings.UPLOAD_MAX_BYTES // (1024 * 1024)} MB.", status=413)
+
+
+def probe(head, complete=False):
+    """
+    Check the image header at the start of `head` (the first bytes of a file).
+
+    Returns (format, width, height), or None if more bytes are needed to tell. Raises
+    UploadRejected for a disallowed type or too many pixels, or if the file is not an
+    allowed image even though all of it (`complete`) or HEADER_BYTES of it was given.
+    """
+    try:
+        with warnings.catch_warnings():
+            # Pillow warns about very large images; they are rejected below anyway.
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            # open() only parses the header; pixels are decoded on first use, which never happens here.
+            with Image.open(io.BytesIO(head), formats=settings.UPLOAD_IMAGE_FORMATS) as img:
+                fmt, (width, height) = img.format, img.size
+    except Image.DecompressionBombError:
+        raise UploadRejected(f"Images may have at most {settings.UPLOAD_MAX_PIXELS:,} pixels.")
+    except (OSError, SyntaxError, ValueError, EOFError):
+        if complete or len(head) >= HEADER_BYTES:
+            raise UploadRejected(f"Upload a valid image ({', '.join(settings.UPLOAD_IMAGE_FORMATS)}).")
+        return None
+    if width * height > settings.UPLOAD_MAX_PIXELS:
+        raise UploadRejected(f"Images may have at most {settings.UPLOAD_MAX_PIXELS:,} pixels.")
+    return fmt, width, height
+
+
+class ImageUploadHandler(FileUploadHandler):
+    """
+    Enforce the upload limits while the request body streams in. It passes every chunk
+    on unchanged, so Django's usual handlers still store the file (in memory or in a
+    temporary file); they just never see more than the limits allow.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.head = b''
+        self.checked = False
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        try:
+            if self.received > settings.UPLOAD_MAX_BYTES:
+                raise too_large()
+            if not self.checked:
+                self.head += raw_data
+                self.checked = probe(self.head) is not None
+                if self.checked:
+                    self.head = b''
+        except UploadRejected as e:
+            self.reject(e)
+        return raw_data
+
+    def file_complete(self, file_size):
+        if not self.checked:
+            # Smaller than a chunk: the whole file is in self.head.
+            try:
+                probe(self.head, complete=True)
+            except UploadRejected as e:
+                self.reject(e)
+        # None: let the next handler return the file.
+        return None
+
+    def reject(self, error):
+        self.request.upload_error = error
+        # connection_reset: stop reading the body instead of draining the rest of it.
+        raise StopUpload(connection_reset=True)
+
+
+# Chunked uploads.
+
+_last_prune = 0.0
+
+
+def _maybe_prune():
+    # Schedule a clean-up of abandoned uploads at most once per expiry period per process.
+    global _last_prune
+    now = time.monotonic()
+    if now - _last_prune >= settings.UPLOAD_EXPIRY:
+        _last_prune = now
+        jobs.enqueue(tasks.prune_uploads)
+
+
+def partial_path(upload_id):
+    return os.path.join(settings.UPLOAD_TEMP_DIR, f'{upload_id}.part')
+
+
+def remove_partial(upload_id):
+    try:
+        os.remove(partial_path(upload_id))
+    except FileNotFoundError:
+        pass
+
+
+def delete(upload):
+    remove_partial(upload.id)
+    upload.delete()
+
+
+def prune():
+    """Delete uploads started more than settings.UPLOAD_EXPIRY seconds ago, with their files."""
+    cutoff = timezone.now() - timedelta(seconds=settings.UPLOAD_EXPIRY)
+    for upload in Upload.objects.filter(created__lt=cutoff).iterator():
+        delete(upload)
+
+
+def attach(post, user, upload_id):
+    """Make the user's finished chunked upload the (unsaved) post's image, and delete the upload."""
+    upload = Upload.objects.filter(id=upload_id, user=user).first()
+    if upload is None or not upload.complete:
+        raise UploadRejected("The image upload did not finish. Please try again.")
+    with open(partial_path(upload.id), 'rb') as file:
+        fmt, _, _ = probe(file.read(HEADER_BYTES), complete=True)
+        # The header is fine; now the same full check forms.ImageField does for normal uploads.
+        file.seek(0)
+        try:
+            with Image.open(file, formats=settings.UPLOAD_IMAGE_FORMATS) as img:
+                img.verify()
+        except Exception:
+            raise UploadRejected(f"Upload a valid image ({', '.join(settings.UPLOAD_IMAGE_FORMATS)}).")
+        file.seek(0)
+        # The client's filename is only kept for its stem: the extension (which decides the
+        # Content-Type the file is served with) comes from the format that was checked, so
+        # an image uploaded as "x.html" is stored as "x.gif".
+        stem = os.path.splitext(upload.filename)[0] or 'upload'
+        post.image.save(stem + EXTENSIONS.get(fmt, f'.{fmt.lower()}'), File(file), save=False)
+    delete(upload)
+
+
+def _state(upload):
+    return {'id': str(upload.id), 'offset': upload.received, 'size': upload.size,
+            'complete': upload.complete, 'chunk_size': settings.UPLOAD_CHUNK_BYTES}
+
+
+def _error(error):
+    return JsonResponse({'error': str(error)}, status=error.status)
+
+
+@login_required
+@require_http_methods(['POST'])
+def create(request):
+    # Start a chunked upload of `size` bytes.
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        return _error(UploadRejected("size must be an integer."))
+    if size <= 0:
+        return _error(UploadRejected("size must be positive."))
+    if size > settings.UPLOAD_MAX_BYTES:
+        return _error(too_large())
+    filename = os.path.basename(request.POST.get('filename', '')).strip()[:255] or 'upload'
+    upload = Upload.objects.create(user=request.user, filename=filename, size=size)
+    os.makedirs(settings.UPLOAD_TEMP_DIR, exist_ok=True)
+    open(partial_path(upload.id), 'wb').close()
+    _maybe_prune()
+    return JsonResponse(_state(upload), status=201)
+
+
+@login_required
+@require_http_methods(['GET', 'PATCH', 'DELETE'])
+def chunk(request, upload_id):
+    upload = get_object_or_404(Upload, id=upload_id, user=request.user)
+    if request.method == 'GET':
+        return JsonResponse(_state(upload))
+    if request.method == 'DELETE':
+        delete(upload)
+        return HttpResponse(status=204)
+
+    # PATCH: the chunk starting at Upload-Offset. Chunks must arrive in order; a client
+    # that lost track (e.g. after a dropped connection) asks with GET where to resume.
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+        length = int(request.headers.get('Content-Length', ''))
+    except ValueError:
+        return _error(UploadRejected("Upload-Offset and Content-Length are required."))
+    if offset != upload.received:
+        return JsonResponse({**_state(upload), 'error': "Wrong offset."}, status=409)
+    if length > settings.UPLOAD_CHUNK_BYTES:
+        return _error(UploadRejected(f"Chunks may be at most {settings.UPLOAD_CHUNK_BYTES} bytes.", status=413))
+    if offset + length > upload.size:
+        return _error(UploadRejected("The chunk goes past the declared size."))
+
+    # Copy the body to the partial file in pieces rather than loading it as request.body.
+    path = partial_path(upload.id)
+    written = 0
+    with open(path, 'r+b') as file:
+        file.seek(offset)
+        while written < length:
+            data = request.read(min(64 * 1024, length - written))
+            if not data:
+                break
+            file.write(data)
+            written += len(data)
+        file.truncate()
+    received = offset + written
+
+    if offset < HEADER_BYTES:
+        # The chunk covered (part of) the header: check it as soon as enough has arrived.
+        with open(path, 'rb') as file:
+            head = file.read(HEADER_BYTES)
+        try:
+            probe(head, complete=received == upload.size)
+        except UploadRejected as e:
+            delete(upload)
+            return _error(e)
+
+    # Only move `received` forward if no other request did in the meantime.
+    if not Upload.objects.filter(id=upload.id, received=offset).update(received=received):
+        upload.refresh_from_db()
+        return JsonResponse({**_state(upload), 'error': "Wrong offset."}, status=409)
+    upload.received = received
+    return JsonResponse(_state(upload))
@@ -1,5 +1,6 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import api, async_views, uploads, views
 
 # app_name helps Django distinguish this app's URLs from others.
 # This allows us to use 'FeedApp:index' in our templates and views.
@@ -10,14 +11,32 @@ app_name = 'FeedApp'
 # 1. The URL pattern string ('' matches the root URL of this app).
 # 2. The view function to call when this pattern is matched.
 # 3. The name argument allows us to refer to this URL pattern elsewhere in the code.
+# Under ASGI the read-heavy feed pages are served by their async versions (see async_views.py).
+feed_views = async_views if settings.ASYNC_FEED_VIEWS else views
+
 urlpatterns = [
     path('', views.index, name='index'),
     path('profile/', views.profile, name='profile'),
-    path('myfeed/', views.myfeed, name='myfeed'),
+    path('myfeed/', feed_views.myfeed, name='myfeed'),
     path('new_post/', views.new_post, name='new_post'),
+    # Chunked, resumable image uploads for new posts (see uploads.py).
+    path('uploads/', uploads.create, name='upload_create'),
+    path('uploads/<uuid:upload_id>/', uploads.chunk, name='upload_chunk'),
     # <int:post_id> is a path converter. It captures an integer from the URL 
     # and passes it as the 'post_id' argument to the comments view function.
-    path('comments/<int:post_id>/', views.comments, name='comments'),
+    path('comments/<int:post_id>/', feed_views.comments, name='comments'),
     path('friends/', views.friends, name='friends'),
-    path('friendsfeed/', views.friendsfeed, name='friendsfeed'),
+    path('friends/suggestions/', views.friend_suggestions, name='friend_suggestions'),
+    path('friendsfeed/', feed_views.friendsfeed, name='friendsfeed'),
+    path('search/', views.search, name='search'),
+    path('metrics', views.metrics_endpoint, name='metrics'),
+    # Live updates as Server-Sent Events (see events.py).
+    path('events/', async_views.event_stream, name='events'),
+    # JSON API (see api.py).
+    path('api/myfeed/', api.myfeed, name='api_myfeed'),
+    path('api/friendsfeed/', api.friendsfeed, name='api_friendsfeed'),
+    path('api/posts/', api.posts, name='api_posts'),
+    path('api/posts/<int:post_id>/like/', api.like, name='api_like'),
+    path('api/posts/<int:post_id>/comments/', api.comments, name='api_comments'),
+    path('api/profiles/', api.profiles, name='api_profiles'),
 ]
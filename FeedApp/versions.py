@@ -0,0 +1,116 @@
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .db import insert_ignore
+from .models import FeedVersion, Post, Profile, Relationship, TimelineEntry
+
+# Conditional GET for the per-user HTML pages.
+#
+# Each user has a FeedVersion row whose version goes up whenever anything on their own
+# pages may have changed. The functions below are called wherever that happens
+# (engagement.py, timeline.py, relationships.py, signals.py...). @conditional_page
+# turns the version into an ETag and Last-Modified. When the browser already has that
+# version, the view answers 304 Not Modified without running its queries or templates.
+#
+# Users with no FeedVersion row have never been sent an ETag, so there is nothing to
+# invalidate for them: bumps only update existing rows, and a row is created the first
+# time one of the pages is served. Friend suggestions are the one part of the Friends
+# page that can go stale: they depend on other people's friendships, and refresh on the
+# user's own next change.
+
+
+def bump(user_ids):
+    """Mark the pages of these users (a list or a subquery of user ids) as changed."""
+    FeedVersion.objects.filter(user_id__in=user_ids).update(version=F('version') + 1, updated=timezone.now())
+
+
+def bump_post_viewers(post_ids):
+    """Mark as changed the pages of everyone who can see these posts: their authors and readers."""
+    post_ids = list(post_ids)
+    FeedVersion.objects.filter(
+        Q(user_id__in=Post.objects.filter(id__in=post_ids).values('username_id'))
+        | Q(user_id__in=TimelineEntry.objects.filter(post_id__in=post_ids).values('owner_id'))
+    ).update(version=F('version') + 1, updated=timezone.now())
+
+
+def bump_friends_of(user_ids):
+    """Mark as changed the pages of everyone who has one of these users as a friend."""
+    bump(Profile.friends.through.objects.filter(user_id__in=user_ids).values('profile__user_id'))
+
+
+def bump_requests_of(user_ids):
+    """Mark as changed the pages of everyone with a friend request from or to one of these users."""
+    bump(Relationship.objects.filter(receiver__user_id__in=user_ids).values('sender__user_id'))
+    bump(Relationship.objects.filter(sender__user_id__in=user_ids).values('receiver__user_id'))
+
+
+def stamp(user):
+    """(version, updated) for the user's pages, creating their FeedVersion row on first use."""
+    row = FeedVersion.objects.filter(user=user).values_list('version', 'updated').first()
+    if row is None:
+        # insert_ignore: two first requests at once must not fail on the primary key.
+        new = FeedVersion(user=user)
+        insert_ignore(FeedVersion, [new])
+        row = (new.version, new.updated)
+    return row
+
+
+def etag_for(request, version):
+    # Besides the version, the page depends on which page it is (the view and its query
+    # string, e.g. the cursor) and on the CSRF token in its forms, which changes when the
+    # user logs in again. PAGE_ETAG_SALT changes on deploys, when templates may have changed.
+    key = '\n'.join([request.resolver_match.view_name, request.get_full_path(), str(request.user.pk),
+                     str(version), request.META.get('CSRF_COOKIE', ''), settings.PAGE_ETAG_SALT])
+    return f'W/"{hashlib.sha1(key.encode()).hexdigest()[:24]}"'
+
+
+def _check(request, version, updated):
+    etag = etag_for(request, version)
+    # HTTP dates have whole seconds; compare at that precision.
+    last_modified = int(updated.timestamp())
+    # A 304 here when the browser's copy is current; None to run the view.
+    return etag, last_modified, get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def _finish(request, response, etag, last_modified):
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        # The page is per-user: browsers may keep it, but must check with the server each time.
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def conditional_page(view):
+    """
+    Answer GET/HEAD with 304 Not Modified when the user's FeedVersion hasn't changed
+    since the browser's copy. Goes under @login_required. Works on sync and async views.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await view(request, *args, **kwargs)
+            request.user = user = await request.auser()
+            etag, last_modified, response = await sync_to_async(lambda: _check(request, *stamp(user)))()
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            return _finish(request, response, etag, last_modified)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        etag, last_modified, response = _check(request, *stamp(request.user))
+        if response is None:
+            response = view(request, *args, **kwargs)
+        return _finish(request, response, etag, last_modified)
+    return wrapper
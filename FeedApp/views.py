@@ -1,10 +1,14 @@
-from django.shortcuts import render, redirect
-from .forms import PostForm, ProfileForm, RelationshipForm
-from .models import Post, Comment, Like, Profile, Relationship
-from datetime import datetime, date
+from django.shortcuts import get_object_or_404, render, redirect
+from .forms import PostForm, ProfileForm
+from .models import ArchivedComment, ArchivedPost, Post, Comment, Profile, RankedEntry, Relationship, TimelineEntry
+from . import engagement, fragments, fulltext, graph, jobs, metrics, relationships, tasks, uploads, versions
+from .db import insert_ignore
+from .pagination import paginate, paginate_through
 
 from django.contrib.auth.decorators import login_required
-from django.http import Http404
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+from django.utils.crypto import constant_time_compare
 
 
 # Create views here.
@@ -24,16 +28,10 @@ def index(request):
 # @login_required decorator restricts access to this view to logged-in users only.
 # If a user is not logged in, they will be redirected to the login page (configured in settings.py).
 @login_required
+@versions.conditional_page
 def profile(request):
-    # Retrieve the Profile object associated with the current user.
-    profile = Profile.objects.filter(user=request.user)
-    
-    # If no profile exists for the user, create one.
-    if not profile.exists():
-        Profile.objects.create(user=request.user) # Profile is the model here
-    
-    # Get the single profile object.
-    profile = Profile.objects.get(user=request.user)
+    # The current user's Profile, created on first use (IdentityMiddleware, see identity.py).
+    profile = request.profile
 
     # Check if this is a POST request (form submission).
     if request.method != 'POST':
@@ -52,155 +50,215 @@ def profile(request):
 
 
 @login_required
+@versions.conditional_page
 def myfeed(request):
-    comment_count_list = []
-    like_count_list = []
-    
     # Filter posts to show only those created by the current user.
-    # .order_by('-date_posted') sorts them by date in descending order (newest first).
-    posts = Post.objects.filter(username=request.user).order_by('-date_posted')
-    
-    for p in posts:
-        # Count comments and likes for each post.
-        c_count = Comment.objects.filter(post=p).count() # this enables us to count how many posts there are
-        l_count = Like.objects.filter(post=p).count()
-        comment_count_list.append(c_count)
-        like_count_list.append(l_count)
-    
-    # zip() combines multiple lists so we can iterate over them together in the template.
-    zipped_list = zip(posts, comment_count_list, like_count_list)
-
-    context = {'posts': posts, 'zipped_list': zipped_list}
+    # paginate() sorts them newest first and returns one page plus the cursor of the next page.
+    # Like and comment counts are stored on each post (like_count/comment_count), so no extra queries are needed.
+    # Posts moved to the archive (see archive.py) are only read once the reader pages past the hot table.
+    posts, next_cursor = paginate_through([Post.objects.filter(username=request.user).select_related('username'),
+                                           ArchivedPost.objects.filter(username=request.user).select_related('username')],
+                                          request.GET.get('cursor'))
+    # Each post's row HTML comes from the fragment cache when the post hasn't changed (see fragments.py).
+    rows = fragments.render_rows(posts, 'FeedApp/myfeed_row.html')
+
+    context = {'posts': posts, 'rows': rows, 'next_cursor': next_cursor}
     return render(request, 'FeedApp/myfeed.html', context)
 
 @login_required
 def new_post(request):
+    upload_error = None
     if request.method != 'POST':
         # New empty form.
         form = PostForm()
     else:
         # Form submitted with data and files (for the image).
         form = PostForm(request.POST, request.FILES)
+        # Set when uploads.ImageUploadHandler stopped the image part way through (too big, not an image...).
+        upload_error = getattr(request, 'upload_error', None)
+        if upload_error is not None:
+            form.is_valid()  # add_error() needs a cleaned form.
+            form.add_error('image', str(upload_error))
         if form.is_valid():
             # commit=False creates the object but doesn't save to DB yet.
             # We need to do this to assign the current user to the post first.
             new_post = form.save(commit=False) 
             new_post.username = request.user
-            new_post.save() # Now save the complete object.
-            return redirect('FeedApp:myfeed')
-
-    context = {'form': form}
-    return render(request, 'FeedApp/new_post.html', context)
+            try:
+                if form.cleaned_data['upload_id']:
+                    # The image was sent in chunks before the form (see uploads.py).
+                    uploads.attach(new_post, request.user, form.cleaned_data['upload_id'])
+            except uploads.UploadRejected as e:
+                upload_error = e
+                form.add_error('image', str(e))
+            else:
+                new_post.save() # Now save the complete object.
+                # Writing the post into every friend's timeline and resizing the image happen
+                # in a background worker (see tasks.py), so the user doesn't wait for them.
+                # They are separate jobs: a failing image must not hold up the fan-out.
+                jobs.enqueue(tasks.fan_out_post, post_id=new_post.id)
+                if new_post.image:
+                    jobs.enqueue(tasks.generate_image_variants, post_id=new_post.id)
+                return redirect('FeedApp:myfeed')
+
+    context = {'form': form, 'upload_chunk_bytes': settings.UPLOAD_CHUNK_BYTES}
+    # e.g. 413 Request Entity Too Large for an image over the size limit.
+    status = upload_error.status if upload_error is not None else 200
+    return render(request, 'FeedApp/new_post.html', context, status=status)
 
 @login_required
 def comments(request, post_id):
-    # Retrieve the specific post by its primary key (id).
-    post = Post.objects.get(id=post_id) 
+    # Retrieve the specific post by its primary key (id), looking in the archive if it has been moved there.
+    post = Post.objects.filter(id=post_id).first() or get_object_or_404(ArchivedPost, id=post_id)
 
     # Handle comment submission within the same view.
     if request.method == 'POST' and request.POST.get('btn1'):
         comment = request.POST.get("comment") 
-        # Create a new Comment linked to this post and user.
-        Comment.objects.create(post_id=post_id, username=request.user, text=comment, date_added=date.today())
+        # Create a new Comment linked to this post and user (and bump the post's comment_count).
+        # Archived posts are read-only.
+        if not post.archived:
+            engagement.add_comment(request.user, post_id, comment)
         return redirect('FeedApp:comments', post_id=post_id)  # Redirect to refresh the page.
 
-    # Get all comments associated with this post.
-    comments = Comment.objects.filter(post=post_id)
+    # Get one page of the comments associated with this post, oldest first.
+    comment_model = ArchivedComment if post.archived else Comment
+    comments, next_cursor = paginate(comment_model.objects.filter(post=post_id).select_related('username'), request.GET.get('cursor'),
+                                     date_field='date_added', descending=False)
 
-    context = {'post': post, 'comments': comments}
+    context = {'post': post, 'comments': comments, 'next_cursor': next_cursor}
     return render(request, 'FeedApp/comments.html', context)
 
 
 @login_required
+@versions.conditional_page
 def friendsfeed(request):
-    comment_count_list = []
-    like_count_list = []
-    
-    current_user_profile = Profile.objects.get(user=request.user)
-    # Get all users who are friends with the current user.
-    friends_users = current_user_profile.friends.all()
-    
-    # Filter posts to include only those where the username is in the list of friends.
-    posts = Post.objects.filter(username__in=friends_users).order_by('-date_posted')
-    
-    for p in posts:
-        c_count = Comment.objects.filter(post=p).count() 
-        l_count = Like.objects.filter(post=p).count()
-        comment_count_list.append(c_count)
-        like_count_list.append(l_count)
-    
-    zipped_list = zip(posts, comment_count_list, like_count_list)
-
     # Handle liking a post via POST request.
     if request.method == 'POST' and request.POST.get("like"):
         post_to_like = request.POST.get("like")
-        # Check if the user already liked this post to prevent duplicate likes.
-        like_already_exists = Like.objects.filter(post_id=post_to_like, username=request.user)
-        if not like_already_exists.exists():
-            Like.objects.create(post_id=post_to_like, username=request.user)
+        # add_like() ignores duplicate likes and bumps the post's like_count.
+        if engagement.add_like(request.user, post_to_like):
             return redirect('FeedApp:friendsfeed')
 
-    context = {'posts': posts, 'zipped_list': zipped_list}
+    # ?order=top shows the ranked feed (see ranking.py), paged by rank. Until the ranking job has
+    # produced one for this user, the chronological feed is shown instead.
+    order = 'top' if settings.RANKED_FEED and request.GET.get('order') == 'top' else None
+    posts = None
+    if order:
+        entries = RankedEntry.objects.filter(owner=request.user, post__deleted_at=None).select_related('post__username')
+        entries, next_cursor = paginate(entries, request.GET.get('cursor'), date_field='rank', descending=False)
+        if entries or request.GET.get('cursor'):
+            posts = [entry.post for entry in entries]
+        else:
+            order = None
+
+    if posts is None:
+        # The friends feed is materialized in TimelineEntry (see timeline.py), so this is
+        # one indexed read of the current user's entries instead of a scan over every friend's posts.
+        # Archived posts have no timeline entries; past the end of the timeline the feed continues with the
+        # friends' archived posts (request.friend_ids, see identity.py), which are all older.
+        # Entries of deleted posts stay until the purge job removes them (see purge.py), so they are filtered out here.
+        entries = TimelineEntry.objects.filter(owner=request.user, post__deleted_at=None).select_related('post__username')
+        archived = ArchivedPost.objects.filter(username_id__in=request.friend_ids).select_related('username')
+        rows, next_cursor = paginate_through([entries, archived], request.GET.get('cursor'))
+        posts = [row.post if isinstance(row, TimelineEntry) else row for row in rows]
+    rows = fragments.render_rows(posts, 'FeedApp/friendsfeed_row.html')
+
+    context = {'posts': posts, 'rows': rows, 'next_cursor': next_cursor, 'order': order,
+               'ranked_feed': settings.RANKED_FEED}
     return render(request, 'FeedApp/friendsfeed.html', context)
 
 
 @login_required
-def friends(request):
-    # This view manages friend requests and the friends list.
-    
-    # get the admin profile and user profile to create their first relationship
-    admin_profile = Profile.objects.get(user=1) # Assuming user ID 1 is admin.
-    
-    # get_or_create tries to get the object, or creates it if it doesn't exist.
-    user_profile, created = Profile.objects.get_or_create(user=request.user)
+def search(request):
+    # Full-text search over posts, comments and profiles, best matches first (see fulltext.py).
+    # ?kind= limits the results to one kind of object.
+    query = request.GET.get('q', '').strip()
+    kind = request.GET.get('kind')
+    if kind not in ('post', 'comment', 'profile'):
+        kind = None
+    results, next_cursor = [], None
+    if query:
+        results, next_cursor = fulltext.search(query, kind, request.GET.get('cursor'))
 
-    # to get my friends
-    user_friends = user_profile.friends.all()
-    user_friends_profiles = Profile.objects.filter(user__in=user_friends)
+    context = {'query': query, 'kind': kind, 'results': results, 'next_cursor': next_cursor}
+    return render(request, 'FeedApp/search.html', context)
 
-    # to get Friend requests sent
-    user_relationships = Relationship.objects.filter(sender=user_profile)
-    request_sent_profiles = user_relationships.values('receiver')
 
-    # to get eligible profiles - exclude the user themselves, their existing friends, and people they already sent requests to.
-    all_profiles = Profile.objects.exclude(user=request.user).exclude(id__in=user_friends_profiles).exclude(id__in=request_sent_profiles)
-
-    # get friend request recieved by the user
-    request_recieved_profiles = Relationship.objects.filter(receiver=user_profile, status='sent')
-
-    # if this is the first time to access the friend request page, create the first
-    # relationship with the admin of the website
-    if not user_relationships.exists():
-        Relationship.objects.create(sender=user_profile, receiver=admin_profile, status='sent')
+@login_required
+@versions.conditional_page
+def friends(request):
+    # This view manages friend requests and the friends list.
+    
+    # The current user's Profile, created on first use (IdentityMiddleware, see identity.py).
+    user_profile = request.profile
 
     # check to see WHICH submit button was pressed
 
     # process all send requests
     if request.method == 'POST' and request.POST.get("send_requests"):
-        receivers = request.POST.getlist("send_requests")
-        for receiver in receivers:
-            receiver_profile = Profile.objects.get(id=receiver)
-            # Create a Relationship object with status='sent'.
-            Relationship.objects.create(sender=user_profile, receiver=receiver_profile, status='sent')
-
+        # Create a Relationship object with status='sent' for every checked profile, all in one transaction.
+        relationships.send_requests(user_profile, request.POST.getlist("send_requests"))
         return redirect('FeedApp:friends')
 
     # process all recieved requests
     if request.method == 'POST' and request.POST.get("recieve_requests"):
-        senders = request.POST.getlist("recieve_requests")
-        for sender in senders:
-            # update relationship for the sender to status 'accepted'
-            Relationship.objects.filter(id=sender).update(status='accepted')
+        # Mark the checked requests 'accepted' and add both people to each other's friends list.
+        relationships.accept_requests(user_profile, request.POST.getlist("recieve_requests"))
+        return redirect('FeedApp:friends')
 
-            # create an object to access the sender's user id to add friends
-            # to list of user
-            relationship_obj = Relationship.objects.get(id=sender)
-            user_profile.friends.add(relationship_obj.sender.user)
+    # to get my friends (request.friend_ids holds their User ids)
+    # select_related('user') loads each profile's username (shown via Profile.__str__) in the same query.
+    user_friends_profiles = Profile.objects.filter(user_id__in=request.friend_ids).select_related('user')
 
-            # add the user to the friend's list of the sender profile
-            relationship_obj.sender.friends.add(request.user)
+    # to get Friend requests sent
+    # (requests to and from deleted accounts are hidden until the accounts are purged, see purge.py)
+    user_relationships = Relationship.objects.filter(sender=user_profile, receiver__deleted_at=None).select_related('receiver__user')
+
+    # if this is the first time to access the friend request page, create the first
+    # relationship with the admin of the website (assuming user ID 1 is admin)
+    # (insert_ignore makes this safe if two requests race to create it)
+    if not user_relationships.exists():
+        admin_profile = Profile.objects.filter(user=1).values_list('id', 'user_id').first()
+        if admin_profile is not None and admin_profile[0] != user_profile.id:
+            if insert_ignore(Relationship, [Relationship(sender=user_profile, receiver_id=admin_profile[0], status='sent')]):
+                # The admin has a new request on their Friends page.
+                versions.bump([admin_profile[1]])
+
+    # to get eligible profiles - the top suggestions from the in-memory friend graph (graph.py), ranked by
+    # mutual friends. The user themselves, their existing friends, and people they already sent requests to are left out.
+    all_profiles = graph.suggest_friends(request.user)
+
+    # get friend request recieved by the user
+    request_recieved_profiles = Relationship.objects.filter(receiver=user_profile, status='sent', sender__deleted_at=None).select_related('sender__user')
 
     context = {'user_friends_profiles': user_friends_profiles, 'user_relationships':user_relationships,
                'all_profiles': all_profiles, 'request_recieved_profiles': request_recieved_profiles}
 
     return render(request, 'FeedApp/friends.html', context)
+
+
+@login_required
+def friend_suggestions(request):
+    # JSON list of people the user may know, ranked by the number of mutual friends.
+    # ?k= limits how many are returned (default settings.FRIEND_SUGGESTIONS_COUNT, at most 100).
+    try:
+        k = min(int(request.GET.get('k', 0)), 100)
+    except ValueError:
+        k = 0
+    suggestions = [
+        {'profile_id': p.id, 'username': p.user.username, 'first_name': p.first_name,
+         'last_name': p.last_name, 'mutual_friends': p.mutual_friends}
+        for p in graph.suggest_friends(request.user, k)
+    ]
+    return JsonResponse({'suggestions': suggestions})
+
+
+def metrics_endpoint(request):
+    # Per-view request metrics in the Prometheus text format, summed over all worker processes.
+    # Staff users can open it in the browser; a scraper sends "Authorization: Bearer <METRICS_TOKEN>".
+    token = settings.METRICS_TOKEN
+    authorized = request.user.is_staff or (
+        token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'))
+    if not authorized:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
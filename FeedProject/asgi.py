@@ -12,5 +12,8 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'FeedProject.settings')
+# Serve the feed pages with the async views (FeedApp/async_views.py) under ASGI.
+# Set ASYNC_FEED_VIEWS=False to run the sync views here instead, e.g. to compare the two.
+os.environ.setdefault('ASYNC_FEED_VIEWS', 'True')
 
 application = get_asgi_application()
@@ -62,15 +62,24 @@ INSTALLED_APPS = [
 # It's a light, low-level 'plugin' system for globally altering Django's input or output.
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware', # Serves static files efficiently
+    'FeedApp.middleware.UploadLimitMiddleware', # Refuses oversized uploads before anything reads the body
+    'FeedApp.middleware.ReplicaRoutingMiddleware', # Sends reads of the feed pages to read replicas (FeedApp/routers.py)
     'django.contrib.sessions.middleware.SessionMiddleware', # Manages sessions across requests
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware', # Protects against Cross Site Request Forgeries
     'django.contrib.auth.middleware.AuthenticationMiddleware', # Associates users with requests
+    'FeedApp.middleware.IdentityMiddleware', # Adds request.profile and request.friend_ids, loaded on first use
     'django.contrib.messages.middleware.MessageMiddleware', # Enables temporary message storage
     'django.middleware.clickjacking.XFrameOptionsMiddleware', # Protects against clickjacking
+    'FeedApp.middleware.QueryMetricsMiddleware', # Records per-view latency and query counts for /metrics
 ]
 
+# WhiteNoise serves static files efficiently, but it is sync-only middleware: under ASGI,
+# Django has to run every request through a thread for it. Set SERVE_STATIC=False when
+# a proxy or CDN serves /static/ to keep the ASGI request path fully async.
+if os.environ.get('SERVE_STATIC', 'True') == 'True':
+    MIDDLEWARE.insert(1, 'whitenoise.middleware.WhiteNoiseMiddleware')
+
 ROOT_URLCONF = 'FeedProject.urls'
 
 # TEMPLATES configuration defines how Django loads and renders templates (HTML files).
@@ -86,6 +95,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'FeedApp.context_processors.live_events', # Tells base.html whether to open the event stream
             ],
         },
     },
@@ -105,6 +115,47 @@ DATABASES = {
     )
 }
 
+# Read replicas: DATABASE_REPLICA_URLS is a comma-separated list of database URLs that
+# replicate 'default'. Each becomes an alias 'replica1', 'replica2'... and FeedApp/routers.py
+# sends the feed pages' reads to them (see REPLICA_READ_VIEWS below). Tests use 'default' for all of them.
+DATABASE_REPLICAS = []
+for url in filter(None, (url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(','))):
+    alias = f'replica{len(DATABASE_REPLICAS) + 1}'
+    DATABASES[alias] = dj_database_url.parse(url, conn_max_age=600)
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['FeedApp.routers.PrimaryReplicaRouter']
+
+
+# Caches
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# 'fragments' holds rendered feed rows (FeedApp/fragments.py). By default it is an in-process
+# LRU cache bounded to FRAGMENT_CACHE_MAX_ENTRIES rows per worker. To share it between gunicorn
+# workers set FRAGMENT_CACHE_BACKEND to e.g. 'django.core.cache.backends.filebased.FileBasedCache'
+# (with FRAGMENT_CACHE_LOCATION a directory) or 'django.core.cache.backends.redis.RedisCache'
+# (with FRAGMENT_CACHE_LOCATION a redis:// URL).
+FRAGMENT_CACHE_BACKEND = os.environ.get('FRAGMENT_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+FRAGMENT_CACHE_MAX_ENTRIES = int(os.environ.get('FRAGMENT_CACHE_MAX_ENTRIES', 10000))
+FRAGMENT_CACHE_ALIAS = 'fragments'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    FRAGMENT_CACHE_ALIAS: {
+        'BACKEND': FRAGMENT_CACHE_BACKEND,
+        'LOCATION': os.environ.get('FRAGMENT_CACHE_LOCATION', 'feed-fragments'),
+        # Rows are invalidated by version bumps, so the timeout only bounds how long unused rows linger.
+        'TIMEOUT': 24 * 60 * 60,
+        # Bump when the row templates change, so rows cached with the old markup are ignored.
+        'VERSION': 3,
+    },
+}
+# MAX_ENTRIES (and LRU culling) only applies to the in-process and file-based backends.
+if FRAGMENT_CACHE_BACKEND.endswith(('LocMemCache', 'FileBasedCache')):
+    CACHES[FRAGMENT_CACHE_ALIAS]['OPTIONS'] = {'MAX_ENTRIES': FRAGMENT_CACHE_MAX_ENTRIES}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -151,6 +202,19 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 # STATICFILES_STORAGE defines the file storage engine to use when collecting static files.
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# Uploaded files (Post.image and its resized variants), served by FeedApp/media.py.
+MEDIA_URL = '/media/'
+# Uploads have always been stored under BASE_DIR/images/, so BASE_DIR stays the default root.
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', BASE_DIR)
+# Only these directories under MEDIA_ROOT are served.
+MEDIA_SERVE_DIRS = ['images']
+# Browser cache lifetime in seconds for files without a content hash in their name.
+# Hashed image variants are cached for a year and marked immutable.
+MEDIA_MAX_AGE = 24 * 60 * 60
+# Behind nginx, set this to an internal location that aliases MEDIA_ROOT (e.g. /protected-media/)
+# and nginx will send the files itself via X-Accel-Redirect.
+MEDIA_ACCEL_REDIRECT = os.environ.get('MEDIA_ACCEL_REDIRECT')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -161,3 +225,133 @@ LOGIN_URL = 'users:login' # URL to redirect to when login is required
 LOGOUT_REDIRECT_URL = 'FeedApp:index' # URL to redirect to after logout
 CRISPY_TEMPLATE_PACK = 'bootstrap4' # Template pack for crispy forms
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap4"
+
+# Feed settings
+# Number of posts (or comments) shown per page; later pages are reached with a cursor link.
+FEED_PAGE_SIZE = int(os.environ.get('FEED_PAGE_SIZE', 20))
+# Widths (in pixels) of the resized image variants generated for each uploaded post image.
+IMAGE_VARIANT_WIDTHS = [320, 640, 1280]
+# Number of "people you may know" suggestions shown on the friends page.
+FRIEND_SUGGESTIONS_COUNT = 20
+# Seconds before each process reloads its in-memory friend graph from the database,
+# picking up friendships changed by other processes.
+FRIEND_GRAPH_MAX_AGE = 60
+
+# Background jobs (FeedApp/jobs.py, run by `python manage.py run_workers`)
+# When True, enqueued jobs run immediately inside the request instead of waiting for a worker.
+# Defaults to on in development so the site works without a worker process.
+JOBS_RUN_INLINE = os.environ.get('JOBS_RUN_INLINE', str(DEBUG)) == 'True'
+# Number of worker processes started by run_workers.
+JOBS_WORKER_PROCESSES = int(os.environ.get('JOBS_WORKER_PROCESSES', 2))
+# Seconds a worker may hold a job before other workers consider it abandoned and retry it.
+JOBS_VISIBILITY_TIMEOUT = 300
+# A job is attempted at most this many times before it is marked "failed".
+JOBS_MAX_ATTEMPTS = 5
+# Retry delays double from JOBS_BASE_BACKOFF seconds up to JOBS_MAX_BACKOFF seconds.
+JOBS_BASE_BACKOFF = 2
+JOBS_MAX_BACKOFF = 600
+
+# Request metrics (FeedApp/metrics.py, served at /metrics)
+# Directory where each worker process writes its metrics so /metrics can add them up.
+# Leave unset for a single process; with gunicorn, point it at an empty directory that is
+# cleared on every deploy (e.g. METRICS_DIR=/tmp/prism-metrics).
+METRICS_DIR = os.environ.get('METRICS_DIR')
+# Minimum number of seconds between writes of a worker's metrics file.
+METRICS_FLUSH_INTERVAL = 1.0
+# Bearer token that lets a Prometheus scraper read /metrics without logging in.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# Log a warning when a view runs more SQL queries than this (None disables the check).
+METRICS_QUERY_BUDGET = 20
+# Per-view overrides of the budget, keyed by URL name, e.g. {'FeedApp:friends': 30}.
+METRICS_QUERY_BUDGETS = {}
+
+# Async views
+# Serve myfeed, friendsfeed and comments with the async views in FeedApp/async_views.py.
+# FeedProject/asgi.py turns this on; under WSGI the sync views are faster.
+ASYNC_FEED_VIEWS = os.environ.get('ASYNC_FEED_VIEWS', 'False') == 'True'
+
+# Live events (FeedApp/events.py, streamed at /events/)
+# Each open stream holds a connection for minutes, which only an async (ASGI) server can
+# afford, so pages only open it when the async views are on.
+EVENTS_STREAM = os.environ.get('EVENTS_STREAM', str(ASYNC_FEED_VIEWS)) == 'True'
+# Seconds between checks for new events in each open stream.
+EVENTS_POLL_INTERVAL = 1.0
+# Streams end after this many seconds and the browser reconnects, so no worker is held forever.
+EVENTS_STREAM_TIMEOUT = 300
+# Milliseconds the browser waits before reconnecting.
+EVENTS_RETRY_MS = 2000
+# Seconds of silence after which a keep-alive comment is sent.
+EVENTS_HEARTBEAT = 15
+# Events older than this many seconds are deleted.
+EVENTS_RETENTION = 3600
+
+# Request identity (FeedApp/identity.py: request.profile and request.friend_ids)
+# Cache used for each user's profile and friend ids, and how many seconds entries live
+# (0 disables caching). Changes are evicted immediately in the process that made them;
+# with a per-process cache, other processes may see old values for up to this long.
+IDENTITY_CACHE_ALIAS = 'default'
+IDENTITY_CACHE_TTL = 30
+
+# Read replicas (FeedApp/routers.py, DATABASE_REPLICAS above)
+# GET requests to these views read from a replica. Everything else uses the primary.
+REPLICA_READ_VIEWS = [
+    'FeedApp:myfeed', 'FeedApp:friendsfeed', 'FeedApp:comments', 'FeedApp:profile', 'FeedApp:search',
+    'FeedApp:api_myfeed', 'FeedApp:api_friendsfeed', 'FeedApp:api_posts', 'FeedApp:api_comments',
+    'FeedApp:api_profiles',
+]
+# After a browser writes anything, its reads stay on the primary for this many seconds,
+# so people see their own posts, likes and comments even if the replicas lag behind.
+REPLICA_PIN_SECONDS = 5
+
+# Ranked friends feed (FeedApp/ranking.py)
+# Off by default: set RANKED_FEED=True once `manage.py rank_feeds` runs periodically
+# (e.g. every 15 minutes from cron). The friends feed then offers a "Top" order.
+RANKED_FEED = os.environ.get('RANKED_FEED', 'False') == 'True'
+# How many ranked posts are kept per user, and how old a post may be to be ranked.
+RANKED_FEED_SIZE = 200
+RANKED_FEED_WINDOW_HOURS = 72
+# A post's recency factor halves every this many hours.
+RANKED_FEED_HALF_LIFE_HOURS = 12
+# comment: how many likes a comment is worth. velocity/affinity: how strongly engagement
+# per hour and the reader's past interactions with the author lift a post's score.
+RANKED_FEED_WEIGHTS = {'comment': 2.0, 'velocity': 1.0, 'affinity': 0.5}
+# Users scored together in one vectorized batch.
+RANKED_FEED_BATCH_USERS = 500
+
+# Conditional GET (FeedApp/versions.py)
+# Part of every page ETag. Change it when templates change so browsers don't keep old
+# pages; on Render it changes with every deploy.
+PAGE_ETAG_SALT = os.environ.get('RENDER_GIT_COMMIT', '')
+
+# Image uploads (FeedApp/uploads.py)
+# ImageUploadHandler checks each uploaded file while it streams in, before the usual
+# handlers store it in memory or in a temporary file.
+FILE_UPLOAD_HANDLERS = [
+    'FeedApp.uploads.ImageUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+# Largest image accepted, in bytes and in pixels (width x height, read from the header).
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 20 * 1024 * 1024))
+UPLOAD_MAX_PIXELS = 40_000_000
+# Image types accepted, as Pillow format names.
+UPLOAD_IMAGE_FORMATS = ['JPEG', 'PNG', 'GIF', 'WEBP']
+# Files larger than this are sent in chunks of this many bytes (static/FeedApp/upload.js).
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Where chunked uploads are assembled. Outside MEDIA_SERVE_DIRS, so never served.
+UPLOAD_TEMP_DIR = os.environ.get('UPLOAD_TEMP_DIR', os.path.join(MEDIA_ROOT, 'partial_uploads'))
+# Seconds after which unfinished (or finished but unused) chunked uploads are deleted.
+UPLOAD_EXPIRY = 24 * 60 * 60
+
+# Deleting accounts and posts (FeedApp/purge.py)
+# Deleted accounts and posts are hidden at once and removed by a background job, this
+# many rows per statement and per transaction.
+PURGE_BATCH_SIZE = 500
+# Seconds a deleted account or post waits before it is purged; until then it can be
+# restored from the admin.
+PURGE_DELAY = 60 * 60
+
+# Admin changelists (FeedApp/admin.py)
+# Tables with more rows than this are counted from the database's planner statistics
+# instead of COUNT(*), and filtered changelists stop counting at this many rows.
+ADMIN_COUNT_LIMIT = 10_000
@@ -15,9 +15,10 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from django.conf.urls.static import static
 from django.conf import settings
 
+from FeedApp import media
+
 
 # urlpatterns is a list where we define the mapping between URLs and the views that handle them.
 urlpatterns = [
@@ -31,7 +32,7 @@ urlpatterns = [
     path('users/', include('users.urls')),
 ]
 
-# If we are in DEBUG mode (local development), we might want to serve static/media files differently.
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL,
-                          document_root=settings.MEDIA_ROOT)
+# Uploaded images are served the same way in development and production (see FeedApp/media.py).
+urlpatterns += [
+    path(settings.MEDIA_URL.lstrip('/') + '<path:path>', media.serve, name='media'),
+]